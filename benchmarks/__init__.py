@@ -0,0 +1,30 @@
+#!/usr/bin/env python
+
+# Copyright 2016 DIANA-HEP
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmarks of filling, merging, serializing and the DataFrame workflows.
+
+The benchmarks are written for `asv <https://asv.readthedocs.io>`_ (configured in ``asv.conf.json``), which keeps
+the results of every commit it runs in ``.asv/results`` as JSON and compares them:
+
+::
+
+    asv run master^..master          # benchmark commits
+    asv continuous master HEAD       # fail if HEAD is slower than master
+    asv publish && asv preview       # browse the history
+
+Without asv, ``python -m benchmarks`` runs the same benchmarks in the current environment and appends one JSON
+line with the results of the checked-out commit to ``.asv/history.jsonl`` (see ``python -m benchmarks --help``).
+"""
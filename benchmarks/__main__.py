@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+
+# Copyright 2016 DIANA-HEP
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Run the asv-style benchmarks without asv and append the results to a JSON-lines history file.
+
+The results are seconds per call for ``time_`` benchmarks, the returned value for ``track_`` benchmarks and the peak
+of memory allocated during one call, in bytes (as seen by ``tracemalloc``), for ``peakmem_`` benchmarks.
+"""
+
+import argparse
+import datetime
+import importlib
+import itertools
+import json
+import os
+import pkgutil
+import platform
+import re
+import subprocess
+import sys
+import timeit
+import tracemalloc
+
+import benchmarks
+
+
+def _commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL,
+                                       universal_newlines=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def discover():
+    """All benchmarks as (name, class, method name, parameter combinations)."""
+    for module in pkgutil.iter_modules(benchmarks.__path__):
+        if not module.name.startswith("bench_"):
+            continue
+        mod = importlib.import_module("benchmarks." + module.name)
+        for className, cls in sorted(vars(mod).items()):
+            if not isinstance(cls, type) or cls.__module__ != mod.__name__:
+                continue
+            params = getattr(cls, "params", [])
+            if len(params) > 0 and not isinstance(params[0], list):
+                params = [params]
+            combinations = list(itertools.product(*params))
+            for methodName in sorted(vars(cls)):
+                if methodName.startswith(("time_", "track_", "peakmem_")):
+                    yield "{0}.{1}.{2}".format(module.name, className, methodName), cls, methodName, combinations
+
+
+def run(cls, methodName, args, repeat):
+    """Seconds per call (best of repeat) of a time_ benchmark, the value of a track_ benchmark or the peak memory (in
+    bytes) of a peakmem_ benchmark."""
+    instance = cls()
+    if hasattr(instance, "setup"):
+        try:
+            instance.setup(*args)
+        except NotImplementedError:
+            return None
+    method = getattr(instance, methodName)
+    if methodName.startswith("track_"):
+        return method(*args)
+    if methodName.startswith("peakmem_"):
+        tracemalloc.start()
+        try:
+            method(*args)
+            return tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    timer = timeit.Timer(lambda: method(*args))
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description=__doc__)
+    parser.add_argument("-b", "--bench", default=".", help="only run benchmarks whose name matches this regex")
+    parser.add_argument("-q", "--quick", action="store_true", help="only the first value of each parameter")
+    parser.add_argument("-r", "--repeat", type=int, default=3, help="number of timing repetitions (default: 3)")
+    parser.add_argument("-o", "--output", default=os.path.join(".asv", "history.jsonl"),
+                        help="JSON-lines file to append the results to (default: .asv/history.jsonl)")
+    options = parser.parse_args(argv)
+
+    import numpy
+    results = {}
+    for name, cls, methodName, combinations in discover():
+        if not re.search(options.bench, name):
+            continue
+        if options.quick:
+            combinations = combinations[:1]
+        for args in combinations:
+            key = "{0}({1})".format(name, ", ".join(map(str, args)))
+            results[key] = run(cls, methodName, args, options.repeat)
+            print("{0:<90} {1}".format(key, "skipped" if results[key] is None else "{0:.6g}".format(results[key])))
+            sys.stdout.flush()
+
+    record = {"commit": _commit(),
+              "date": datetime.datetime.now().isoformat(),
+              "machine": platform.node(),
+              "python": platform.python_version(),
+              "numpy": numpy.__version__,
+              "results": results}
+    directory = os.path.dirname(options.output)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+    with open(options.output, "a") as file:
+        file.write(json.dumps(record, sort_keys=True) + "\n")
+
+
+if __name__ == "__main__":
+    main()
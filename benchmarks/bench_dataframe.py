@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+
+# Copyright 2016 DIANA-HEP
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from .common import SEED
+
+try:
+    import numpy
+    import pandas
+    from histogrammar.dfinterface.make_histograms import make_histograms
+except ImportError:
+    pandas = None
+
+
+def makeFrame(rows, columns, seed=SEED):
+    """Synthetic wide DataFrame: numbers, strings, booleans and one time axis, in equal parts."""
+    rng = numpy.random.RandomState(seed)
+    data = {"date": pandas.Timestamp("2021-01-01") + pandas.to_timedelta(rng.randint(0, 365, rows), unit="D")}
+    for i in range(columns):
+        if i % 3 == 0:
+            data["num{0}".format(i)] = rng.normal(i, 1.0, rows)
+        elif i % 3 == 1:
+            data["str{0}".format(i)] = numpy.array(["v{0}".format(j) for j in range(20)])[rng.randint(0, 20, rows)]
+        else:
+            data["bool{0}".format(i)] = rng.uniform(0.0, 1.0, rows) < 0.5
+    return pandas.DataFrame(data)
+
+
+class MakeHistograms(object):
+    """``make_histograms`` on wide frames, with and without a time axis (without a progress bar)."""
+    params = [[10000, 100000], [10, 100]]
+    param_names = ["rows", "columns"]
+    timeout = 300
+
+    def setup(self, rows, columns):
+        if pandas is None:
+            raise NotImplementedError("pandas is not installed")
+        self.df = makeFrame(rows, columns)
+
+    def time_make_histograms(self, rows, columns):
+        make_histograms(self.df, time_axis="", sinks=[])
+
+    def time_make_histograms_time_axis(self, rows, columns):
+        make_histograms(self.df, time_axis="date", sinks=[])
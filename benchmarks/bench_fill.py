@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+
+# Copyright 2016 DIANA-HEP
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from .common import DEPTHS, PRIMITIVES, PYTHON_SIZES, SIZES, makeData, makeRows, makeTree
+
+
+class FillNumpy(object):
+    """Vectorized fill (``fillnumpy``) of every primitive."""
+    params = [sorted(PRIMITIVES), SIZES]
+    param_names = ["primitive", "size"]
+
+    def setup(self, primitive, size):
+        self.data = makeData(size)
+        self.make = PRIMITIVES[primitive]
+
+    def time_fill(self, primitive, size):
+        self.make().fillnumpy(self.data)
+
+    def time_fill_weighted(self, primitive, size):
+        self.make().fillnumpy(self.data, weights=self.data["positive"])
+
+    def peakmem_fill(self, primitive, size):
+        self.make().fillnumpy(self.data)
+
+
+class FillPython(object):
+    """Row-by-row fill (``fill``) of every primitive."""
+    params = [sorted(PRIMITIVES), PYTHON_SIZES]
+    param_names = ["primitive", "size"]
+
+    def setup(self, primitive, size):
+        self.rows = makeRows(makeData(size))
+        self.make = PRIMITIVES[primitive]
+
+    def time_fill(self, primitive, size):
+        h = self.make()
+        for row in self.rows:
+            h.fill(row)
+
+
+class FillTree(object):
+    """Vectorized fill of nested binnings, one level per depth."""
+    params = [DEPTHS, SIZES]
+    param_names = ["depth", "size"]
+
+    def setup(self, depth, size):
+        self.data = makeData(size)
+        self.depth = depth
+        # a tree that already has all of its bins
+        self.tree = makeTree(depth)
+        self.tree.fillnumpy(self.data)
+
+    def time_fill(self, depth, size):
+        makeTree(depth).fillnumpy(self.data)
+
+    def time_refill(self, depth, size):
+        self.tree.fillnumpy(self.data)
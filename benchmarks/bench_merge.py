@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+
+# Copyright 2016 DIANA-HEP
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from .common import DEPTHS, PRIMITIVES, filled, makeTree
+
+
+class Merge(object):
+    """Adding two filled aggregators of every primitive."""
+    params = [sorted(PRIMITIVES)]
+    param_names = ["primitive"]
+
+    def setup(self, primitive):
+        self.one = filled(PRIMITIVES[primitive], 100000, seed=1)
+        self.two = filled(PRIMITIVES[primitive], 100000, seed=2)
+
+    def time_add(self, primitive):
+        self.one + self.two
+
+    def time_iadd(self, primitive):
+        total = self.one.copy()
+        total += self.two
+
+    def time_scale(self, primitive):
+        self.one * 0.5
+
+
+class MergeTree(object):
+    """Adding nested binnings, such as the partial results of parallel workers."""
+    params = [DEPTHS]
+    param_names = ["depth"]
+
+    def setup(self, depth):
+        self.parts = [filled(lambda: makeTree(depth), 100000, seed=i) for i in range(8)]
+
+    def time_add(self, depth):
+        total = self.parts[0]
+        for part in self.parts[1:]:
+            total = total + part
+
+    def time_iadd(self, depth):
+        total = self.parts[0].copy()
+        for part in self.parts[1:]:
+            total += part
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+
+# Copyright 2016 DIANA-HEP
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import pickle
+
+import histogrammar as hg
+
+from .common import DEPTHS, PRIMITIVES, filled, makeTree
+
+
+class Serialize(object):
+    """JSON and pickle round trips of every filled primitive."""
+    params = [sorted(PRIMITIVES)]
+    param_names = ["primitive"]
+
+    def setup(self, primitive):
+        self.h = filled(PRIMITIVES[primitive], 100000)
+        self.json = json.dumps(self.h.toJson())
+        self.pickle = pickle.dumps(self.h, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def time_toJson(self, primitive):
+        json.dumps(self.h.toJson())
+
+    def time_fromJson(self, primitive):
+        hg.Factory.fromJson(json.loads(self.json))
+
+    def time_pickle(self, primitive):
+        pickle.dumps(self.h, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def time_unpickle(self, primitive):
+        pickle.loads(self.pickle)
+
+    def track_json_size(self, primitive):
+        return len(self.json)
+
+    track_json_size.unit = "bytes"
+
+
+class SerializeTree(object):
+    """JSON and pickle round trips of nested binnings."""
+    params = [DEPTHS]
+    param_names = ["depth"]
+
+    def setup(self, depth):
+        self.h = filled(lambda: makeTree(depth), 100000)
+        self.json = json.dumps(self.h.toJson())
+        self.pickle = pickle.dumps(self.h, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def time_toJson(self, depth):
+        json.dumps(self.h.toJson())
+
+    def time_fromJson(self, depth):
+        hg.Factory.fromJson(json.loads(self.json))
+
+    def time_pickle(self, depth):
+        pickle.dumps(self.h, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def time_unpickle(self, depth):
+        pickle.loads(self.pickle)
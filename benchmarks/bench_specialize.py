@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+
+# Copyright 2016 DIANA-HEP
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import histogrammar as hg
+
+from .common import DEPTHS, PRIMITIVES, makeTree
+
+
+class Construct(object):
+    """Constructing (and specializing) empty aggregators."""
+    params = [sorted(PRIMITIVES)]
+    param_names = ["primitive"]
+
+    def setup(self, primitive):
+        self.make = PRIMITIVES[primitive]
+        self.h = self.make()
+
+    def time_construct(self, primitive):
+        self.make()
+
+    def time_specialize(self, primitive):
+        self.h.specialize()
+
+    def time_zero(self, primitive):
+        self.h.zero()
+
+
+class ConstructLarge(object):
+    """Constructing binnings with many sub-aggregators."""
+    params = [[100, 10000], DEPTHS[:2]]
+    param_names = ["bins", "depth"]
+
+    def setup(self, bins, depth):
+        self.value = makeTree(depth - 1)
+        self.h = hg.Bin(bins, 0.0, 1.0, "x", self.value)
+
+    def time_bin(self, bins, depth):
+        hg.Bin(bins, 0.0, 1.0, "x", self.value)
+
+    def time_copy(self, bins, depth):
+        self.h.copy()
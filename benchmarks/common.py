@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+
+# Copyright 2016 DIANA-HEP
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import functools
+
+import numpy
+
+import histogrammar as hg
+
+SEED = 12345
+
+# number of rows for the vectorized fills and for the row-by-row fills
+SIZES = [1000, 100000, 1000000]
+PYTHON_SIZES = [100, 10000]
+
+
+@functools.lru_cache(maxsize=4)
+def makeData(size, seed=SEED):
+    """Synthetic columns, the same for a given size and seed: dict of numpy arrays (shared, do not modify)."""
+    rng = numpy.random.RandomState(seed)
+    x = rng.normal(0.0, 1.0, size)
+    x[rng.randint(0, size, size // 100)] = numpy.nan
+    return {"x": x,
+            "y": rng.normal(5.0, 2.0, size),
+            "positive": rng.exponential(1.0, size),
+            "boolean": rng.uniform(0.0, 1.0, size) < 0.5,
+            "category": numpy.array(["cat{0}".format(i) for i in range(100)])[rng.randint(0, 100, size)],
+            "user": numpy.array(["user{0}".format(i) for i in rng.zipf(1.5, size) % 100000])}
+
+
+def makeRows(data):
+    """The same data as a list of dicts, for the row-by-row fill."""
+    names = list(data)
+    return [dict(zip(names, values)) for values in zip(*[data[n].tolist() for n in names])]
+
+
+# one representative aggregator for each primitive, filled from the columns of makeData
+PRIMITIVES = {
+    "Count": lambda: hg.Count(),
+    "Sum": lambda: hg.Sum("y"),
+    "Average": lambda: hg.Average("y"),
+    "Deviate": lambda: hg.Deviate("y"),
+    "Minimize": lambda: hg.Minimize("y"),
+    "Maximize": lambda: hg.Maximize("y"),
+    "Bag": lambda: hg.Bag("category", "S"),
+    "Bin": lambda: hg.Bin(100, -5.0, 5.0, "x"),
+    "SparselyBin": lambda: hg.SparselyBin(0.1, "x"),
+    "CentrallyBin": lambda: hg.CentrallyBin([-3.0, -1.0, 0.0, 1.0, 3.0], "x"),
+    "IrregularlyBin": lambda: hg.IrregularlyBin([-3.0, -1.0, 0.0, 1.0, 3.0], "x"),
+    "Categorize": lambda: hg.Categorize("category"),
+    "TopK": lambda: hg.TopK(50, "user"),
+    "CountDistinct": lambda: hg.CountDistinct("user"),
+    "Fraction": lambda: hg.Fraction("boolean", hg.Bin(100, -5.0, 5.0, "x")),
+    "Stack": lambda: hg.Stack([-3.0, -1.0, 0.0, 1.0, 3.0], "x"),
+    "Select": lambda: hg.Select("boolean", hg.Bin(100, -5.0, 5.0, "x")),
+    "Label": lambda: hg.Label(x=hg.Bin(100, -5.0, 5.0, "x"), y=hg.Bin(100, 0.0, 10.0, "y")),
+    "Index": lambda: hg.Index(hg.Bin(100, -5.0, 5.0, "x"), hg.Bin(100, 0.0, 10.0, "y")),
+    "Branch": lambda: hg.Branch(hg.Bin(100, -5.0, 5.0, "x"), hg.Sum("y")),
+}
+
+DEPTHS = [1, 2, 3, 4]
+
+# one axis per level of a tree: a binning of each kind, so deeper trees mix them
+_AXES = [
+    lambda value: hg.SparselyBin(0.5, "x", value),
+    lambda value: hg.Categorize("category", value),
+    lambda value: hg.Bin(20, 0.0, 10.0, "y", value),
+    lambda value: hg.IrregularlyBin([0.5, 1.0, 2.0], "positive", value),
+]
+
+
+def makeTree(depth):
+    """Nested aggregator with ``depth`` binning levels around a Count."""
+    out = hg.Count()
+    for axis in reversed(_AXES[:depth]):
+        out = axis(out)
+    return out
+
+
+def filled(make, size, seed=SEED):
+    """An aggregator from ``make()``, filled with ``size`` rows of synthetic data."""
+    out = make()
+    out.fillnumpy(makeData(size, seed))
+    return out
@@ -25,6 +25,7 @@ from histogrammar.primitives.categorize import Categorize
 from histogrammar.primitives.centrallybin import CentrallyBin
 from histogrammar.primitives.collection import Collection, Branch, Index, Label, UntypedLabel
 from histogrammar.primitives.count import Count
+from histogrammar.primitives.countdistinct import CountDistinct
 from histogrammar.primitives.deviate import Deviate
 from histogrammar.primitives.fraction import Fraction
 from histogrammar.primitives.irregularlybin import IrregularlyBin
@@ -33,6 +34,7 @@ from histogrammar.primitives.select import Select
 from histogrammar.primitives.sparselybin import SparselyBin
 from histogrammar.primitives.stack import Stack
 from histogrammar.primitives.sum import Sum
+from histogrammar.primitives.topk import TopK
 
 from histogrammar.convenience import Histogram
 from histogrammar.convenience import SparselyHistogram
@@ -20,6 +20,7 @@ import json as jsonlib
 import math
 import random
 import re
+import threading
 
 try:
     from collections import OrderedDict
@@ -49,18 +50,60 @@ except ImportError:
         def __len__(self):
             return len(self.keys)
 
-from histogrammar.util import FillMethod, PlotMethod, basestring, xrange, named
-from histogrammar.parsing import C99SourceToAst
-from histogrammar.parsing import C99AstToSource
-from histogrammar.pycparser import c_ast
+from histogrammar.util import FillMethod, PlotMethod, basestring, xrange, named, _npMemo, _deepSizeOf
+from histogrammar.estimate import cost, estimate
 import histogrammar.version
 
+# the C parser (histogrammar.parsing) is slow to load, so the code generators that need it import it themselves
 
 class ContainerException(Exception):
     """Exception type for improperly configured containers."""
     pass
 
 
+class MemoryBudgetExceeded(ContainerException):
+    """Exception type for containers that use more memory than their ``MemoryBudget`` allows."""
+
+    def __init__(self, name, nbytes, limit):
+        self.nbytes = nbytes
+        self.limit = limit
+        super(MemoryBudgetExceeded, self).__init__(
+            "{0} uses {1} bytes, more than its memory budget of {2} bytes".format(name, nbytes, limit))
+
+
+class MemoryBudget(object):
+    """An upper limit on the memory of a container (its ``nbytes``), to be checked after filling or merging it.
+
+    Checking the memory walks the whole tree, so it is done explicitly, by ``check``, not on every fill. If the
+    container is over the limit, ``compact(container)`` (if given) is called to shrink it in place, e.g. by dropping
+    or coarsening bins; if it is still over the limit, ``MemoryBudgetExceeded`` is raised.
+
+    Parameters:
+        limit (int): maximum number of bytes.
+
+        compact (callable or None): function to shrink a container that exceeds the limit, in place.
+    """
+
+    def __init__(self, limit, compact=None):
+        if limit <= 0:
+            raise ValueError("limit ({0}) must be positive".format(limit))
+        self.limit = limit
+        self.compact = compact
+
+    def __repr__(self):
+        return "<MemoryBudget limit={0}>".format(self.limit)
+
+    def check(self, container, name=None):
+        """Enforce the budget on ``container`` (called ``name`` in the exception) and return its ``nbytes``."""
+        nbytes = container.nbytes
+        if nbytes > self.limit and self.compact is not None:
+            self.compact(container)
+            nbytes = container.nbytes
+        if nbytes > self.limit:
+            raise MemoryBudgetExceeded(repr(container) if name is None else name, nbytes, self.limit)
+        return nbytes
+
+
 class InvalidJsonException(Exception):
     """Exception type for strings that cannot be parsed because they are not proper JSON."""
 
@@ -177,6 +220,52 @@ class Factory(object):
             raise JsonFormatException(json, "Factory")
 
 
+def _unpickleColumns(cls, state, attr, layout, keys, keyType, prototype, columns):
+    """Used by Pickle to reconstruct a container whose sub-aggregators were stored as columns."""
+    import numpy
+    if keyType is not None:
+        keys = numpy.frombuffer(keys, dtype=keyType).tolist()
+    values = []
+    for row in zip(*[numpy.frombuffer(c, dtype=numpy.float64).tolist() for c in columns]):
+        v = prototype.zero()
+        for f, x in zip(prototype._pickleFields, row):
+            setattr(v, f, x)
+        values.append(v)
+
+    out = cls.__new__(cls)
+    out.__setstate__(state)
+    if layout is dict:
+        setattr(out, attr, dict(zip(keys, values)))
+    elif len(keys) == 0:
+        setattr(out, attr, layout(values))
+    else:
+        setattr(out, attr, layout(zip(keys, values)))
+    return out
+
+
+def _l2CacheBytes():
+    """Size of the L2 cache, or 1 MiB if it can't be determined."""
+    global _l2CacheBytesValue
+    if _l2CacheBytesValue is None:
+        import os
+        try:
+            size = os.sysconf("SC_LEVEL2_CACHE_SIZE")
+        except (AttributeError, ValueError, OSError):
+            size = 0
+        if size <= 0:
+            try:
+                with open("/sys/devices/system/cpu/cpu0/cache/index2/size") as file:
+                    text = file.read().strip()
+                size = int(text.rstrip("KMG")) * {"K": 1024, "M": 1024**2, "G": 1024**3}.get(text[-1:], 1)
+            except (IOError, ValueError):
+                size = 0
+        _l2CacheBytesValue = size if size > 0 else 1024**2
+    return _l2CacheBytesValue
+
+
+_l2CacheBytesValue = None
+
+
 class Container(object):
     """Interface for classes that contain aggregated data, such as "Count" or "Bin".
 
@@ -237,7 +326,7 @@ class Container(object):
     def __getstate__(self):
         # used by pickling
         state = dict(self.__dict__)
-        for s in ['fill', 'plot']:
+        for s in ['fill', 'plot', '_metadata']:
             # these states are set dynamically by FillMethod and PlotMethod, in factory.specialize().
             # MB 20220517: turned off specialize() for Count objects,
             # for which specialized fill and plot methods are not needed.
@@ -251,6 +340,100 @@ class Container(object):
         self.fill = FillMethod(self, self.fill)
         self.plot = PlotMethod(self, self.plot)
 
+    # numeric attributes of a leaf aggregator, which are stored as columns when many leaves are pickled together
+    _pickleFields = ()
+
+    def __reduce_ex__(self, protocol):
+        # with protocol 5, large binnings of leaves are stored as columns (see _reduceColumns)
+        if protocol >= 5:
+            out = self._reduceColumns(protocol)
+            if out is not None:
+                return out
+        return object.__reduce_ex__(self, protocol)
+
+    def _reduceColumns(self, protocol):
+        return None
+
+    def _reduceColumnsOf(self, protocol, attr, keys, values):
+        """Pickle ``self`` with the sub-aggregators ``values`` (in attribute ``attr``, keyed by ``keys``) as columns.
+
+        If all ``values`` are leaves of the same type and quantity, each of their numeric fields is stored as one
+        array (with ``protocol`` 5 or later, as an out-of-band ``PickleBuffer`` if the pickler takes them) and the
+        leaf itself only once; otherwise returns None and ``self`` is pickled normally.
+        """
+        import pickle
+        import numpy
+        if len(values) < 2:
+            return None
+        prototype = values[0]
+        fields = prototype._pickleFields
+        if len(fields) == 0:
+            return None
+        quantity = getattr(prototype, "quantity", getattr(prototype, "transform", None))
+        for v in values:
+            if type(v) is not type(prototype) or getattr(v, "quantity", getattr(v, "transform", None)) is not quantity:
+                return None
+
+        # PickleBuffer and protocol 5 are new in Python 3.8
+        buffer = pickle.PickleBuffer if protocol >= 5 else (lambda array: array)
+        columns = [buffer(numpy.array([getattr(v, f) for v in values], dtype=numpy.float64)) for f in fields]
+        keyType = None
+        if len(keys) > 0 and not any(isinstance(k, (str, bool, numpy.bool_)) for k in keys):
+            array = numpy.asarray(keys)
+            if array.dtype.kind in "iuf":
+                keyType = "int64" if array.dtype.kind in "iu" else "float64"
+                keys = buffer(numpy.ascontiguousarray(array, dtype=keyType))
+        state = self.__getstate__()
+        layout = type(state.pop(attr))
+        return (_unpickleColumns, (self.__class__, state, attr, layout, keys, keyType, prototype.zero(), columns))
+
+    def _zeroClone(self):
+        """A new zero like ``self``, which must itself be a zero (e.g. a template made once with ``zero()``).
+
+        Leaves are copied attribute by attribute, skipping the constructor's argument checks and ``specialize``, which
+        matters when a fill creates many new bins; containers with sub-aggregators override this or use ``zero()``.
+        """
+        if len(self._pickleFields) == 0:
+            return self.zero()
+        return self._shallowClone()
+
+    def _shallowClone(self):
+        out = self.__class__.__new__(self.__class__)
+        out.__dict__.update(self.__dict__)
+        out.__dict__.pop("_metadata", None)
+        if "fill" in self.__dict__:
+            # rebind the methods that specialize() attached to self
+            del out.fill, out.plot
+            out.fill = FillMethod(out, out.fill)
+            out.plot = PlotMethod(out, out.plot)
+        return out
+
+    def _cachedMetadata(self, key, stamp, compute):
+        """The result of ``compute()``, kept on this container as long as ``stamp`` stays the same.
+
+        ``stamp`` must hold everything that ``compute`` reads (such as the binning), so that a direct change of an
+        attribute is seen as well as a change by a method; what depends on the contents of sub-aggregators can't be
+        cached this way. Numpy arrays are returned as copies, so that callers can change them.
+        """
+        cache = self.__dict__.get("_metadata")
+        if cache is None:
+            cache = self._metadata = {}
+        cached = cache.get(key)
+        if cached is None or cached[0] != stamp:
+            cached = cache[key] = (stamp, compute())
+        import numpy
+        return cached[1].copy() if isinstance(cached[1], numpy.ndarray) else cached[1]
+
+    @property
+    def nbytes(self):
+        """Memory used by this container, in bytes.
+
+        Deep: it includes the sub-aggregators, the bin dicts with their keys and the quantity functions with their
+        closures. Objects that several containers share (such as a quantity function) are counted in each of them;
+        see ``histogrammar.dfinterface.make_histograms.get_nbytes`` for a dict of histograms.
+        """
+        return _deepSizeOf(self, set())
+
     def copy(self):
         """Copy this container, making a clone with no reference to the original. """
         return self + self.zero()
@@ -260,16 +443,26 @@ class Container(object):
         """List of sub-aggregators, to make it possible to walk the tree."""
         raise NotImplementedError
 
-    def _checkForCrossReferences(self, memo=None):
+    @property
+    def _filledChildren(self):
+        # the sub-aggregators that filling this container can reach (not templates like SparselyBin's value)
+        return self.children
+
+    def _checkForCrossReferences(self):
+        # the whole tree is walked once, from the first container that is filled, and the result is marked on every
+        # node; containers that the library adds to a tree later (new bins, sums, copies) are always new objects
         if not self._checkedForCrossReferences:
-            if memo is None:
-                memo = set()
-            if any(x is self for x in memo):
-                raise ContainerException("cannot fill a tree that contains the same aggregator twice: {0}".format(self))
-            memo.add(self)
-            for child in self.children:
-                child._checkForCrossReferences(memo)
-            self._checkedForCrossReferences = True
+            memo = {}
+            stack = [self]
+            while len(stack) > 0:
+                node = stack.pop()
+                if id(node) in memo:
+                    raise ContainerException("cannot fill a tree that contains the same aggregator twice: {0}".format(
+                        node))
+                memo[id(node)] = node
+                stack.extend(node._filledChildren)
+            for node in memo.values():
+                node._checkedForCrossReferences = True
 
     def toJsonFile(self, fileName):
         return jsonlib.dump(self.toJson(), open(fileName, "w"))
@@ -299,6 +492,7 @@ class Container(object):
     _clingClassNameNumber = 0
 
     def fillroot(self, ttree, start=-1, end=-1, debug=False, debugOnError=True, **exprs):
+        from histogrammar.parsing import C99SourceToAst, C99AstToSource
         self._checkForCrossReferences()
 
         if not hasattr(self, "_clingFiller"):
@@ -463,6 +657,7 @@ public:
 
     def cuda(self, namespace=True, namespaceName=None, writeSize=False, commentMain=True,
              split=False, testData=[round(random.gauss(0, 1), 2) for x in xrange(10)], **exprs):
+        from histogrammar.parsing import C99SourceToAst, C99AstToSource
         parser = C99SourceToAst()
         generator = C99AstToSource()
 
@@ -863,6 +1058,7 @@ int main(int argc, char** argv) {{
             return out
 
     def fillpycuda(self, length=None, **exprs):
+        from histogrammar.parsing import C99SourceToAst, C99AstToSource
         import numpy
         import pycuda.autoinit
         import pycuda.driver
@@ -998,6 +1194,193 @@ int main(int argc, char** argv) {{
         pycuda.driver.Context.synchronize()
         self._cudaUnpackAndFill(result.tostring(), False, 4)    # TODO: determine bigendian, alignment and use them!
 
+    # compiled kernels by their source, least recently used first; at most _numbaKernelsMax are kept
+    _numbaKernels = OrderedDict()
+    _numbaKernelsMax = 64
+    _numbaKernelsLock = threading.Lock()
+
+    def filljit(self, data=None, weights=1.0, debug=False, **arrays):
+        """Fill the whole tree in one pass over Numpy arrays with a Numba-compiled kernel.
+
+        Input fields are taken from ``data`` (a dict of arrays, a Pandas DataFrame or a Numpy record array) and
+        from the keyword ``arrays``. Quantities given as Python strings are compiled into the kernel, with names of
+        input fields standing for the current element; other functions are evaluated on ``data`` beforehand.
+
+        The generated kernel depends only on the shape of the tree (primitives, binning and quantities), so it is
+        compiled once and reused for every tree with the same shape (the ``Container._numbaKernelsMax`` most
+        recently used kernels are kept).
+        """
+        import numpy
+        import numba
+
+        self._checkForCrossReferences()
+
+        inputFields = {}
+        if data is not None:
+            if isinstance(data, dict):
+                inputFields.update(data)
+            elif isinstance(data, numpy.ndarray) and data.dtype.names is not None:
+                inputFields.update((n, data[n]) for n in data.dtype.names)
+            elif hasattr(data, "columns"):
+                inputFields.update((n, data[n]) for n in data.columns)
+            else:
+                raise TypeError("data must be a dict of arrays, a Pandas DataFrame or a Numpy record array")
+        inputFields.update(arrays)
+
+        inputFieldNames = OrderedDict()
+        derivedFieldExprs = OrderedDict()
+        globalCode = []
+        initCode = []
+        fillCode = []
+        weightVars = ["weight_0"]
+        weightVarStack = ("weight_0",)
+        tmpVarTypes = {}
+
+        self._numbaGenerateCode(inputFields, inputFieldNames, derivedFieldExprs, globalCode, initCode, "0", 4,
+                                fillCode, "0", 12, weightVars, weightVarStack, tmpVarTypes)
+
+        scalarWeights = not isinstance(weights, numpy.ndarray) and not hasattr(weights, "__iter__")
+        if scalarWeights and not weights > 0.0:
+            return
+
+        source = "\n".join(globalCode + [
+            "def fill(length, heap, top, index, weights{0}):".format(
+                "".join(", " + x for x in list(inputFieldNames) + list(derivedFieldExprs)))] + initCode + [
+            "    for i in range(length):",
+            "        weight_0 = weights" if scalarWeights else "        weight_0 = weights[i]",
+            "        if weight_0 > 0.0:"] + fillCode + [
+            "    return heap, top",
+            ""])
+
+        if debug:
+            print("line |")
+            print("\n".join("{0:4d} | {1}".format(i + 1, line) for i, line in enumerate(source.split("\n"))))
+
+        with Container._numbaKernelsLock:
+            kernel = Container._numbaKernels.get(source)
+            if kernel is not None:
+                Container._numbaKernels.move_to_end(source)
+        if kernel is None:
+            namespace = {"math": math, "np": numpy, "numpy": numpy}
+            exec(compile(source, "<histogrammar.numba>", "exec"), namespace)
+            kernel = numba.njit(namespace["fill"])
+            with Container._numbaKernelsLock:
+                Container._numbaKernels[source] = kernel
+                while len(Container._numbaKernels) > Container._numbaKernelsMax:
+                    Container._numbaKernels.popitem(last=False)
+
+        length = None
+        arguments = []
+        for name in inputFieldNames.values():
+            array = numpy.ascontiguousarray(inputFields[name])
+            if array.dtype.kind in "Mm":
+                array = array.astype(array.dtype.kind + "8[ns]").view(numpy.int64)
+            elif array.dtype.kind not in "biuf":
+                raise TypeError("input field \"{0}\" must be numeric, not {1}".format(name, array.dtype))
+            arguments.append(array)
+        for fcn in derivedFieldExprs.values():
+            arguments.append(numpy.ascontiguousarray(fcn(inputFields if data is None else data), dtype=numpy.float64))
+        if not scalarWeights:
+            weights = numpy.ascontiguousarray(weights, dtype=numpy.float64)
+            arguments.append(weights)
+
+        for array in arguments:
+            if len(array.shape) != 1:
+                raise ValueError("Numpy arrays must be one-dimensional")
+            if length is None:
+                length = array.shape[0]
+            elif array.shape[0] != length:
+                raise ValueError("input arrays must all have the same length ({0} vs {1})".format(
+                    length, array.shape[0]))
+        if not scalarWeights:
+            arguments.pop()
+
+        if length is None:
+            raise ValueError("no arrays specified as input fields in the aggregator to get length from")
+
+        top = self._numbaStorageSize()
+        heap = numpy.zeros(top + 1024, dtype=numpy.float64)
+        index = numba.typed.Dict.empty(numba.types.UniTuple(numba.types.int64, 2), numba.types.int64)
+
+        heap, top = kernel(length, heap, top, index, weights, *arguments)
+
+        dynamic = {}
+        for (owner, key), offset in index.items():
+            dynamic.setdefault(owner, []).append((key, offset))
+        self._numbaUpdate(heap, dynamic, 0)
+
+    def _numbaExpandPrefix(self, prefix, shift):
+        if shift == 0:
+            return prefix
+        elif re.match("^[0-9]+$", prefix) is not None:
+            return str(int(prefix) + shift)
+        else:
+            return "{0} + {1}".format(prefix, shift)
+
+    def _numbaConstant(self, x):
+        x = float(x)
+        if math.isnan(x):
+            return "math.nan"
+        elif math.isinf(x):
+            return "math.inf" if x > 0.0 else "-math.inf"
+        else:
+            return repr(x)
+
+    def _numbaNormalizeExpr(self, expr, inputFields, inputFieldNames, weightVar):
+        import io
+        import keyword
+        import tokenize
+
+        try:
+            tokens = [x for x in tokenize.generate_tokens(io.StringIO(expr.strip()).readline)
+                      if x[0] not in (tokenize.NEWLINE, tokenize.NL, tokenize.COMMENT, tokenize.ENDMARKER)]
+        except (tokenize.TokenError, IndentationError) as err:
+            raise SyntaxError("""Couldn't parse Python expression "{0}": {1}""".format(expr, str(err)))
+
+        out = []
+        for i, (toktype, tokstring) in enumerate(x[:2] for x in tokens):
+            # interpret raw identifiers as input field names IF they're in the input (otherwise, leave them alone)
+            if toktype == tokenize.NAME and not keyword.iskeyword(tokstring) and \
+                    (i == 0 or tokens[i - 1][1] != ".") and (i + 1 == len(tokens) or tokens[i + 1][1] != "="):
+                if weightVar is not None and tokstring == "weight":
+                    tokstring = weightVar
+                elif tokstring in inputFields:
+                    norm = None
+                    for k, v in inputFieldNames.items():
+                        if v == tokstring:
+                            norm = k
+                    if norm is None:
+                        norm = "input_" + str(len(inputFieldNames))
+                        inputFieldNames[norm] = tokstring
+                    tokstring = norm + "[i]"
+                elif tokstring in math.__dict__:
+                    tokstring = "math." + tokstring
+                elif tokstring not in ("np", "numpy", "abs", "bool", "float", "int", "max", "min", "round"):
+                    raise ContainerException("no input supplied for \"{0}\" in expression \"{1}\"".format(
+                        tokstring, expr))
+            out.append(tokstring)
+        return " ".join(out)
+
+    def _numbaQuantityExpr(self, inputFields, inputFieldNames, derivedFieldExprs, weightVar):
+        if weightVar is not None:
+            if not isinstance(self.transform.expr, basestring):
+                raise ContainerException("Count.transform must be provided as a Python string when used with Numba")
+            return "np.float64(" + self._numbaNormalizeExpr(self.transform.expr, inputFields, inputFieldNames,
+                                                            weightVar) + ")"
+
+        elif isinstance(self.quantity.expr, basestring):
+            return "np.float64(" + self._numbaNormalizeExpr(self.quantity.expr, inputFields, inputFieldNames,
+                                                            None) + ")"
+
+        else:
+            # functions can't be compiled into the kernel; evaluate them once, up front, on the whole input
+            for name, fcn in derivedFieldExprs.items():
+                if fcn is self.quantity:
+                    return name + "[i]"
+            name = "quantity_" + str(len(derivedFieldExprs))
+            derivedFieldExprs[name] = self.quantity
+            return name + "[i]"
+
     def _cppExpandPrefix(self, *prefix):
         return self._c99ExpandPrefix(*prefix)
 
@@ -1042,6 +1425,7 @@ int main(int argc, char** argv) {{
         return self._c99NormalizeExpr(ast, inputFieldNames, inputFieldTypes, weightVar)
 
     def _c99NormalizeExpr(self, ast, inputFieldNames, inputFieldTypes, weightVar):
+        from histogrammar.pycparser import c_ast
         # interpret raw identifiers as tree field names IF they're in the tree (otherwise, leave them alone)
         if isinstance(ast, c_ast.ID):
             if weightVar is not None and ast.name == "weight":
@@ -1101,6 +1485,7 @@ int main(int argc, char** argv) {{
         return ast
 
     def _cudaNormalizeExpr(self, ast, inputFieldNames, inputFieldTypes, weightVar, derivedFieldExprs, intermediates):
+        from histogrammar.pycparser import c_ast
         if isinstance(ast, c_ast.ID):
             if weightVar is not None and ast.name == "weight":
                 ast.name = weightVar
@@ -1193,6 +1578,7 @@ int main(int argc, char** argv) {{
 
     def _c99QuantityExpr(self, parser, generator, inputFieldNames, inputFieldTypes,
                          derivedFieldTypes, derivedFieldExprs, weightVar):
+        from histogrammar.pycparser import c_ast
         if weightVar is not None:
             if not isinstance(self.transform.expr, basestring):
                 raise ContainerException("Count.transform must be provided as a C99 string when used with Cling")
@@ -1247,6 +1633,7 @@ int main(int argc, char** argv) {{
 
     def _cudaQuantityExpr(self, parser, generator, inputFieldNames, inputFieldTypes,
                           derivedFieldTypes, derivedFieldExprs, weightVar):
+        from histogrammar.pycparser import c_ast
         if weightVar is not None:
             if not isinstance(self.transform.expr, basestring):
                 raise ContainerException("Count.transform must be provided as a C99 string when used with CUDA")
@@ -1351,9 +1738,75 @@ int main(int argc, char** argv) {{
     def _cudaStorageType(self):
         return self._c99StructName()
 
-    def fillnumpy(self, data, weights=1.0):
+    numpyChunkRows = None
+
+    def fillnumpy(self, data, weights=1.0, n_threads=1, memo=None):
+        """Fill the tree with all rows of ``data`` (Numpy arrays, a dict of them, a record array or a DataFrame).
+
+        Each quantity is evaluated once per fill, in a dict (``memo``) that goes with the rows. To share these
+        evaluations among several trees filled with the same rows, such as column subsets of one DataFrame, pass them
+        one dict as ``memo``; it must not be used with any other rows.
+
+        With ``n_threads`` greater than one, the rows are split into chunks that are filled into ``zero()`` copies of
+        this tree on a pool of threads, which are then added into this one. Most of the filling is done by Numpy, which
+        releases the GIL. The chunk size (``numpyChunkRows``, if not set) is chosen to keep a chunk's working set at
+        all levels of the tree within the L2 cache.
+        """
         self._checkForCrossReferences()
-        self._numpy(data, weights, shape=[None])
+        if n_threads is not None and n_threads > 1:
+            length = self._npLength(data, weights)
+            chunkRows = self.numpyChunkRows or self._npChunkRows()
+            if length is not None and length > chunkRows:
+                return self._fillnumpyThreaded(data, weights, length, n_threads, chunkRows, memo)
+        self._numpy(data, weights, [None], {} if memo is None else memo)
+
+    def _fillnumpyThreaded(self, data, weights, length, n_threads, chunkRows, memo):
+        import numpy
+        from concurrent.futures import ThreadPoolExecutor
+
+        chunks = iter(xrange(0, length, chunkRows))
+        lock = threading.Lock()
+
+        def work():
+            out = self.zero()
+            while True:
+                with lock:
+                    start = next(chunks, None)
+                if start is None:
+                    return out
+                rows = slice(start, min(start + chunkRows, length))
+                chunk = self._npSliceData(data, rows, length)
+                out._numpy(chunk, weights[rows] if isinstance(weights, numpy.ndarray) else weights, [None],
+                           {} if memo is None else {None: (memo, rows)})
+
+        with ThreadPoolExecutor(max_workers=n_threads) as executor:
+            futures = [executor.submit(work) for i in xrange(n_threads)]
+            parts = [future.result() for future in futures]
+
+        # no possibility of exception from here on out (for rollback)
+        for part in parts:
+            self += part
+
+    def _npLength(self, data, weights):
+        import numpy
+        if isinstance(weights, numpy.ndarray):
+            return len(weights)
+        elif isinstance(data, dict):
+            lengths = set(len(v) for v in data.values() if isinstance(v, numpy.ndarray) and len(v.shape) > 0)
+            return lengths.pop() if len(lengths) == 1 else None
+        elif isinstance(data, (numpy.ndarray, list, tuple)) or hasattr(data, "iloc"):
+            return len(data)
+        else:
+            return None
+
+    def _npChunkRows(self):
+        # roughly a quantity, a weight and an index (8 bytes each) per row at every level of the tree
+        depth = 1
+        level = self.children
+        while len(level) > 0:
+            depth += 1
+            level = [y for x in level for y in x.children]
+        return min(max(_l2CacheBytes() // (24 * depth), 2**16), 2**22)
 
     def _checkNPQuantity(self, q, shape):
         import numpy
@@ -1379,6 +1832,134 @@ int main(int argc, char** argv) {{
         else:
             return weights * numpy.ones(shape, dtype=numpy.float64)
 
+    def _npWeightsSum(self, weights, shape):
+        import numpy
+        if isinstance(weights, numpy.ndarray):
+            return float(weights.sum())
+        else:
+            return float(weights * shape[0])
+
+    def _npSliceData(self, data, rows, length):
+        """The rows of ``data`` (with ``length`` rows) at the integer array ``rows``; raises ``TypeError`` if ``data``
+        can't be sliced."""
+        import numpy
+        if data is None:
+            return None
+        elif isinstance(data, dict):
+            # fields of other lengths can't be the quantities being binned; pass them on as they are
+            out = dict((k, v[rows] if isinstance(v, numpy.ndarray) and v.shape[:1] == (length,) else v)
+                       for k, v in data.items())
+        elif isinstance(data, numpy.ndarray):
+            out = data[rows]
+        elif isinstance(data, (list, tuple)):
+            out = numpy.asarray(data)[rows]
+        elif hasattr(data, "iloc"):
+            # Pandas DataFrame or Series (data[rows] would select columns)
+            out = data.iloc[rows]
+        else:
+            raise TypeError("cannot slice rows of {0}".format(type(data)))
+        return out
+
+    def _npQuantity(self, data, memo):
+        """``self.quantity(data)``, evaluated once per fill of these rows (see ``histogrammar.util._npMemo``)."""
+        return _npMemo(memo, self.quantity._memoKey(), lambda: self.quantity._call(data), sliceable=True)
+
+    def _npFillRows(self, sub, data, weights, rows, shape, memo):
+        """Fill ``sub`` with only the rows of ``data`` at the integer array ``rows`` (ascending).
+
+        The child sees a compacted view: the selected rows of the data and of the weights (a scalar weight stays
+        scalar), so it never touches rows that don't reach it. A child without quantities gets no data at all, and
+        data that can't be sliced by rows are passed on whole, with zero weight outside of ``rows``. A Pandas
+        DataFrame is sliced with all of its columns, so pass only the columns that the quantities read.
+        """
+        import numpy
+        if len(rows) == 0:
+            return
+        if not sub._npReadsData():
+            # e.g. the Counts in the bins of a histogram: only the weights are sliced
+            sub._numpy(None, weights[rows] if isinstance(weights, numpy.ndarray) else weights, [len(rows)], {})
+            return
+        try:
+            sliced = self._npSliceData(data, rows, shape[0])
+        except TypeError:
+            subweights = numpy.zeros(shape[0], dtype=numpy.float64)
+            subweights[rows] = weights[rows] if isinstance(weights, numpy.ndarray) else weights
+            sub._numpy(data, subweights, shape, memo)
+        else:
+            # quantities already computed on data are sliced rather than computed again on the sliced rows
+            sub._numpy(sliced, weights[rows] if isinstance(weights, numpy.ndarray) else weights, [len(rows)],
+                       {None: (memo, rows)})
+
+    def _npReadsData(self):
+        """Whether ``_numpy`` reads the data anywhere in this tree (it has quantities), rather than only the weights."""
+        return getattr(self, "quantity", None) is not None or any(x._npReadsData() for x in self.children)
+
+    def _npFillSelected(self, sub, data, weights, selection, shape, memo):
+        """Fill ``sub`` with the rows of ``data`` for which the boolean array ``selection`` is ``True``."""
+        import numpy
+        self._npFillRows(sub, data, weights, numpy.flatnonzero(selection), shape, memo)
+
+    def _npPartition(self, index, n):
+        """Split the rows among ``n`` bins: a list of the (ascending) rows whose ``index`` is 0, 1, ..., ``n - 1``.
+
+        Rows with an index outside of that range are in none of them. One stable sort replaces a full pass over the
+        rows for every bin.
+        """
+        import numpy
+        order = numpy.argsort(index, kind="stable")
+        bounds = numpy.searchsorted(index[order], numpy.arange(n + 1))
+        return [order[bounds[i]:bounds[i + 1]] for i in xrange(n)]
+
+    def estimate(self, rows, cardinalities=None):
+        """Expected cost of filling this tree with ``rows`` rows by ``fillnumpy``, worked out without filling it.
+
+        ``cardinalities`` maps quantity names (such as column names) to their number of distinct values, which bounds
+        the number of bins of a ``Categorize`` or ``SparselyBin`` of that quantity; it can also be a function of the
+        aggregator, returning that number or ``None``. Other quantities are assumed to have
+        ``histogrammar.estimate.DEFAULT_CARDINALITY``. Returns a ``histogrammar.estimate.Estimate``: the strategy,
+        number of containers, fill calls, rows, memory and rough time of every node of the tree, and warnings about
+        the expensive ones.
+        """
+        return estimate(self, rows, cardinalities)
+
+    def explain(self, rows, cardinalities=None):
+        """The ``estimate`` of filling this tree with ``rows`` rows as a text table, followed by its warnings."""
+        return str(self.estimate(rows, cardinalities))
+
+    def _estimate(self, rows, cardinalities):
+        """Cost of one ``_numpy`` call on ``rows`` rows, as a ``histogrammar.estimate.cost``."""
+        # by default, one pass to compute the quantity (if any) and all rows go to every sub-aggregator
+        passes = 0 if getattr(self, "quantity", None) is None else 1
+        return cost("vectorized", passes, children=[(x, 1, 1, rows) for x in self._filledChildren])
+
+    def _sql(self, query, weight):
+        """Add the keys and aggregates of this aggregator to ``query`` and return the loader of its result rows.
+
+        The loader, ``fill(container, keys, aggregates)``, adds one result row to a container of this type.
+        """
+        raise NotImplementedError("{0} cannot be filled by SQL".format(self.name))
+
+    def fillsql(self, connection, table, weights=None, where=None, dialect=None):
+        """Fill this tree by one ``GROUP BY`` query on an SQL table, so that only the filled bins leave the database.
+
+        Parameters:
+            connection: a DB-API connection, such as one of ``sqlite3``, ``duckdb`` or ``psycopg2``.
+
+            table (str): the table, or any SQL expression that can follow ``FROM``.
+
+            weights (str or None): SQL expression of the weight of each row (default 1).
+
+            where (str or None): SQL condition on the rows to fill.
+
+            dialect (str or None): ``"sqlite"`` or ``"ansi"``; if None, it is guessed from the connection.
+
+        The quantities of the tree must be SQL expressions (strings) and its primitives Bin, SparselyBin, Categorize,
+        Select, Count, Sum, Average, Deviate, Minimize or Maximize (see ``histogrammar.sql``).
+        """
+        from histogrammar.sql import fillsql
+        delta = fillsql(self, connection, table, weights, where, dialect)
+        self += delta
+
     def fillsparksql(self, df):
         converter = df._sc._jvm.org.dianahep.histogrammar.sparksql.pyspark.AggregatorConverter()
         agg = self._sparksql(df._sc._jvm, converter)
@@ -17,18 +17,40 @@
 # IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
 # CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
-from .addmethods import add_pandas_methods, add_sparksql_methods
+import importlib
 
-try:
+
+def _add_pandas_methods():
+    from pandas import DataFrame as pdf
+    from .addmethods import add_pandas_methods
+    # add function to create histogrammar histograms
+    add_pandas_methods(cls=pdf, prefix='hg_')
+
+
+def _add_sparksql_methods():
     from pyspark.sql import DataFrame as sdf
+    from .addmethods import add_sparksql_methods
     # add function to create histogrammar histograms
     add_sparksql_methods(cls=sdf, prefix='hg_')
+
+
+# DataFrames get their hg_ methods when histogrammar is imported, whether pandas (or pyspark) is imported before or
+# after it, so pandas and pyspark.sql are imported here if they are installed. The rest of this package (the fillers,
+# make_histograms, tqdm) is only loaded on first use.
+try:
+    _add_sparksql_methods()
 except (ModuleNotFoundError, AttributeError):
     pass
 
 try:
-    from pandas import DataFrame as pdf
-    # add function to create histogrammar histograms
-    add_pandas_methods(cls=pdf, prefix='hg_')
+    _add_pandas_methods()
 except (ModuleNotFoundError, AttributeError):
     pass
+
+
+def __getattr__(name):
+    # submodules are imported on first use: they import pandas
+    if name in ("addmethods", "cache", "filling_utils", "histogram_filler_base", "make_histograms",
+                "pandas_histogrammar", "sinks", "spark_histogrammar"):
+        return importlib.import_module("." + name, __name__)
+    raise AttributeError("module {0} has no attribute {1}".format(__name__, name))
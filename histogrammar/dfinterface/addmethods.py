@@ -49,7 +49,6 @@ from ..convenience import TwoDimensionallySparselyHistogram as hg_TwoDimensional
 
 
 from ..defs import Factory
-from .make_histograms import make_histograms
 
 
 def add_sparksql_methods(cls, prefix=''):
@@ -110,8 +109,8 @@ def add_methods(cls, hg, prefix='hg_'):
     def Select(self, quantity, cut=hg_Count()):
         return self.histogrammar(hg_Select(quantity, cut))
 
-    def SparselyBin(self, binWidth, quantity, value=hg_Count(), nanflow=hg_Count(), origin=0.0):
-        return self.histogrammar(hg_SparselyBin(binWidth, quantity, value, nanflow, origin))
+    def SparselyBin(self, binWidth, quantity, value=hg_Count(), nanflow=hg_Count(), origin=0.0, maxBins=None):
+        return self.histogrammar(hg_SparselyBin(binWidth, quantity, value, nanflow, origin, maxBins))
 
     def Stack(self, thresholds, quantity, value=hg_Count(), nanflow=hg_Count()):
         return self.histogrammar(hg_Stack(thresholds, quantity, value, nanflow))
@@ -216,6 +215,13 @@ def add_methods(cls, hg, prefix='hg_'):
                 types.MethodType(TwoDimensionallySparselyHistogram, cls))
 
 
+def make_histograms(self, *args, **kwargs):
+    """Histograms of the features of this dataframe, see histogrammar.dfinterface.make_histograms.make_histograms"""
+    # imported on first use: it loads the fillers and tqdm
+    from .make_histograms import make_histograms
+    return make_histograms(self, *args, **kwargs)
+
+
 def hg_fill_sparksql(self, hist):
     hist.fill.sparksql(self)
     return hist
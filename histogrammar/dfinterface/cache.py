@@ -0,0 +1,228 @@
+"""On-disk cache of the histograms made by ``make_histograms``, for repeated runs on the same data.
+
+An entry is keyed by a fingerprint of the dataframe and by the specification of the fill (features, binning, time
+axis, ...): the same data histogrammed the same way is found again, anything else is a new entry. The fingerprint of
+a pandas dataframe is its schema, its number of rows and a hash of evenly spaced chunks of its rows, so it is fast
+for large dataframes, but a change in rows outside of these chunks goes unnoticed. A caller that knows the version of
+its data (such as a snapshot date) can pass that instead, which is also what Spark dataframes need.
+
+The histograms of an entry are stored as their JSON representation, compressed, in one file. When the files take
+more than ``max_bytes``, the least recently used ones are removed. Histograms read from the cache have quantities
+with names but no functions: they can be added, plotted and updated with ``make_histograms(previous=...)``, but not
+filled directly. Arguments that hold functions (such as ``time_spill``), or other values without a representation
+that is the same in every process, can't be part of a key: see ``cacheable``.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import zlib
+
+import numpy as np
+import pandas as pd
+
+from ..defs import Factory
+
+# part of every key, so that entries written in another format are not read
+FORMAT = "histogrammar-cache-1"
+
+
+def fingerprint(df, version=None, chunks=16, chunk_rows=1024):
+    """Fingerprint of a dataframe, for looking up its histograms in a cache
+
+    :param df: input pandas or spark dataframe
+    :param version: version of the data known to the caller, e.g. a snapshot date. if given, it replaces the hash of
+        the rows (and it is required for spark dataframes). (optional)
+    :param int chunks: number of evenly spaced chunks of rows to hash. if None, all rows are hashed.
+    :param int chunk_rows: number of rows per chunk.
+    :return: hex digest of the schema and the rows (or version) of the dataframe
+    """
+    digest = hashlib.sha256()
+    dtypes = df.dtypes.items() if isinstance(df, pd.DataFrame) else df.dtypes
+    digest.update(repr([(str(col), str(dt)) for col, dt in dtypes]).encode("utf-8"))
+    if version is not None:
+        digest.update(("version:" + str(version)).encode("utf-8"))
+        return digest.hexdigest()
+    if not isinstance(df, pd.DataFrame):
+        raise ValueError("only pandas dataframes are hashed; pass a version key for other dataframes.")
+
+    n_rows = len(df)
+    digest.update(("rows:" + str(n_rows)).encode("utf-8"))
+    if chunks is None or n_rows <= chunks * chunk_rows:
+        parts = [df]
+    else:
+        starts = np.linspace(0, n_rows - chunk_rows, chunks).astype(np.int64)
+        parts = [df.iloc[start:start + chunk_rows] for start in starts]
+    for part in parts:
+        digest.update(pd.util.hash_pandas_object(part, index=True).values.tobytes())
+    return digest.hexdigest()
+
+
+def cacheable(spec):
+    """Whether the histograms made with spec can be cached: spec holds no functions, and only values with a key
+
+    A function can't be compared between processes, and it may have side effects (such as the time_spill of
+    make_histograms) that a cached result would skip. Values that are not JSON need a representation that is the
+    same in every process, see HistogramCache.key().
+
+    :param spec: arguments of make_histograms, see HistogramCache.key()
+    :return: bool
+    """
+    if isinstance(spec, dict):
+        return all(cacheable(v) for v in spec.values())
+    if isinstance(spec, (list, tuple)):
+        return all(cacheable(v) for v in spec)
+    if callable(spec):
+        return False
+    try:
+        json.dumps(spec, default=_jsonable)
+    except (TypeError, ValueError):
+        return False
+    return True
+
+
+def _jsonable(x):
+    # numpy scalars and arrays by value; anything else that is not JSON by its type and its repr, if that doesn't
+    # depend on the process (as an address in memory does)
+    if isinstance(x, np.generic) and not isinstance(x, (np.datetime64, np.timedelta64)):
+        return x.item()
+    if isinstance(x, np.ndarray):
+        return {"<numpy.ndarray>": str(x.dtype), "values": x.tolist()}
+    if isinstance(x, (set, frozenset)):
+        return sorted(x, key=repr)
+    text = repr(x)
+    if " at 0x" in text:
+        raise TypeError("{0} can't be part of a cache key".format(text))
+    return "<{0}.{1}>{2}".format(type(x).__module__, type(x).__name__, text)
+
+
+class HistogramCache(object):
+    """Cache of dicts of histograms in a directory, with least recently used eviction
+
+    :param str directory: directory of the cache files, created if needed.
+    :param int max_bytes: maximum total size of the cache files. default is 1 GB.
+    """
+
+    suffix = ".hgz"
+
+    def __init__(self, directory, max_bytes=2**30):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, df, spec, version=None):
+        """Key of the histograms of a dataframe
+
+        :param df: input pandas or spark dataframe
+        :param dict spec: everything that determines the histograms besides the data, e.g. the arguments of
+            make_histograms. it is normalized as sorted JSON; numpy scalars and arrays are taken by value and other
+            values that are not JSON (such as timestamps) by their type and repr. raises TypeError for values
+            without a repr that is the same in every process, see cacheable().
+        :param version: version of the data, see fingerprint(). (optional)
+        :return: str
+        """
+        text = json.dumps(spec, sort_keys=True, default=_jsonable)
+        digest = hashlib.sha256(FORMAT.encode("utf-8"))
+        digest.update(fingerprint(df, version).encode("utf-8"))
+        digest.update(text.encode("utf-8"))
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + self.suffix)
+
+    def get(self, key):
+        """The histograms stored under key, or None
+
+        :param str key: key of the histograms, see key()
+        :return: dict of histograms or None
+        """
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            hists = json.loads(zlib.decompress(data).decode("utf-8"))
+        except (IOError, OSError):
+            with self._lock:
+                self.misses += 1
+            return None
+        except ValueError:
+            # an incomplete or corrupted file: drop it
+            self._remove(path)
+            with self._lock:
+                self.misses += 1
+            return None
+        # the modification time of a file is the time it was last used
+        os.utime(path, None)
+        with self._lock:
+            self.hits += 1
+        return {name: Factory.fromJson(h) for name, h in hists.items()}
+
+    def put(self, key, hists):
+        """Store the histograms under key, then evict the least recently used entries over max_bytes
+
+        :param str key: key of the histograms, see key()
+        :param dict hists: dict of histograms
+        """
+        hists = {name: h.toJson() for name, h in hists.items()}
+        data = zlib.compress(json.dumps(hists).encode("utf-8"))
+        # written to a temporary file first, so that readers never see half of it
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, self._path(key))
+        except BaseException:
+            self._remove(tmp)
+            raise
+        self.evict()
+
+    def evict(self):
+        """Remove the least recently used entries until the cache takes at most max_bytes"""
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(self.suffix):
+                path = os.path.join(self.directory, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if self._remove(path):
+                total -= size
+                with self._lock:
+                    self.evictions += 1
+
+    def clear(self):
+        """Remove all entries"""
+        for name in os.listdir(self.directory):
+            if name.endswith(self.suffix):
+                self._remove(os.path.join(self.directory, name))
+
+    def stats(self):
+        """Hits, misses and evictions so far, and the number of entries and bytes in the cache
+
+        :return: dict
+        """
+        sizes = [os.path.getsize(os.path.join(self.directory, name)) for name in os.listdir(self.directory)
+                 if name.endswith(self.suffix)]
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions, "entries": len(sizes),
+                    "bytes": sum(sizes)}
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+            return True
+        except OSError:
+            return False
@@ -7,12 +7,14 @@ All modifications copyright ING WBAA.
 """
 
 import copy
+import functools
 import logging
 from collections import defaultdict
 
 import numpy as np
 import pandas as pd
 
+from ..defs import MemoryBudget
 from ..primitives.average import Average
 from ..primitives.bag import Bag
 from ..primitives.bin import Bin
@@ -26,8 +28,10 @@ from ..primitives.select import Select
 from ..primitives.sparselybin import SparselyBin
 from ..primitives.stack import Stack
 from ..primitives.sum import Sum
+from ..primitives.topk import TopK
 
 from .filling_utils import check_column, check_dtype
+from .sinks import TqdmSink, _Sinks
 
 
 class HistogramFillerBase(object):
@@ -39,6 +43,9 @@ class HistogramFillerBase(object):
     Final histograms are stored in the datastore.
     """
 
+    # categorical columns with more than max_nunique unique values get a TopK histogram, instead of being skipped
+    _topk_huge_categories = True
+
     def __init__(
         self,
         features=None,
@@ -52,6 +59,10 @@ class HistogramFillerBase(object):
         nbins_2d=20,
         nbins_3d=10,
         max_nunique=500,
+        sinks=None,
+        profile=False,
+        memory_budget=None,
+        previous=None,
     ):
         """Initialize module instance.
 
@@ -86,7 +97,10 @@ class HistogramFillerBase(object):
                              'h': {'bag': True},
                              }
 
-            In the bin specs for x:y, x reverts to the 1-dim setting.
+            In the bin specs for x:y, x reverts to the 1-dim setting. A 'binWidth' spec can also have a 'max_bins',
+            the most bins to keep: beyond it, adjacent bins are merged by doubling the bin width. It can also have a
+            'window', the number of most recent bins to keep (e.g. of a time axis), and a 'spill' function, called as
+            spill(feature, index, histogram) with each bin that falls out of that window.
 
         :param str time_axis: name of datetime feature, used as time axis, eg 'date'. if True, will be guessed.
             If time_axis is set, if no features given, features becomes: ['date:x', 'date:y', 'date:z'] etc.
@@ -99,6 +113,17 @@ class HistogramFillerBase(object):
         :param int nbins_2d: auto-binning number of bins for 2d histograms. default is 20.
         :param int nbins_3d: auto-binning number of bins for 3d histograms. default is 10.
         :param int max_nunique: auto-binning threshold for unique categorical values. default is 500.
+        :param list sinks: receivers of the filling progress and metrics, see histogrammar.dfinterface.sinks.
+            default is a progress bar, [TqdmSink()].
+        :param bool profile: if true, profile the fill of each histogram and pass the per-node report to the sinks.
+            (pandas only, default is false)
+        :param memory_budget: maximum memory per histogram, checked after filling it: number of bytes or
+            histogrammar.defs.MemoryBudget (to compact histograms over the limit), or a dict of these by feature.
+            A histogram over its budget raises histogrammar.defs.MemoryBudgetExceeded. (optional)
+        :param dict previous: histograms made before, by feature, to update with the rows of the input dataframe.
+            The new rows are filled in the binning of these histograms and added to them. Their features are the
+            default features, their bin specifications take precedence over bin_specs, and the auto-binning of
+            columns (with its quantiles and unique counts) is skipped. (optional)
         """
         # common logger for histogram filling
         self.logger = logging.getLogger()
@@ -125,9 +150,38 @@ class HistogramFillerBase(object):
         self._auto_n_bins_2d = nbins_2d
         self._auto_n_bins_3d = nbins_3d
         self._nunique_threshold = max_nunique
+        self.sinks = [TqdmSink()] if sinks is None else list(sinks)
+        self.profile = profile
+        self.memory_budget = memory_budget
+        self.previous = previous or {}
+        if self.previous:
+            from .make_histograms import get_bin_specs
+
+            if not self.features:
+                self.features = [check_column(c) for c in self.previous]
+            self.bin_specs = dict(self.bin_specs, **get_bin_specs(self.previous))
 
         # these get filled during execution
         self._hists = {}
+        self._topk_features = set()
+
+    def _sinks(self):
+        """All sinks, called as one"""
+        return _Sinks(self.sinks)
+
+    def check_memory(self, name, hist):
+        """Enforce the memory budget of a histogram, if any
+
+        :param str name: feature of the histogram
+        :param hist: filled histogram
+        :return: memory of the histogram in bytes, or None if it has no budget
+        """
+        budget = self.memory_budget.get(name) if isinstance(self.memory_budget, dict) else self.memory_budget
+        if budget is None:
+            return None
+        if not isinstance(budget, MemoryBudget):
+            budget = MemoryBudget(budget)
+        return budget.check(hist, f'Histogram "{name}"')
 
     def set_logger(self, logger):
         """Set logger of module
@@ -192,6 +246,30 @@ class HistogramFillerBase(object):
         * clever auto-binning is done in case no bin-specs have been provided
         * do the actual value counting based on categories and created indices
         * then convert to histograms
+
+        and, with previous histograms, adds the new histograms to them.
+        """
+        idf, _ = self._prepare(df)
+
+        # 5. do the actual histogram/counter filling
+        self.logger.info(
+            f"Filling {len(self.features)} specified histograms. {self.binning}-binning."
+        )
+        self.fill_histograms(idf)
+
+        # 6. add the histograms made before, which have the same binning
+        for name, hist in self.previous.items():
+            if name in self._hists:
+                self._hists[name] = self._hists[name] + hist
+                self.check_memory(name, self._hists[name])
+
+        return self._hists
+
+    def _prepare(self, df):
+        """Steps 1 to 4 of _execute(): everything but the filling
+
+        :param df: input data frame
+        :return: converted data frame and dict of columns by type
         """
         df = self.assert_dataframe(df)
 
@@ -208,16 +286,68 @@ class HistogramFillerBase(object):
         idf = self.process_features(df, cols_by_type)
 
         # 4. complete bin-specs that have not been provided in case of 'auto' binning option
+        #    (previous histograms provide those of their features)
         if self.binning == "auto":
             self.auto_complete_bin_specs(idf, cols_by_type)
+        return idf, cols_by_type
 
-        # 5. do the actual histogram/counter filling
-        self.logger.info(
-            f"Filling {len(self.features)} specified histograms. {self.binning}-binning."
+    def estimate(self, df):
+        """Estimate the cost of filling the histograms of input dataframe, without filling them.
+
+        The number of rows and the unique values and ranges of the columns are taken from the dataframe. Warnings
+        about expensive histograms are logged.
+
+        :param df: input data frame
+        :return: dict of histogrammar.estimate.Estimate per feature, see Container.estimate()
+        """
+        idf, cols_by_type = self._prepare(df)
+        n_rows = self.get_row_count(idf)
+        columns = sorted(set(c for cols in self.features for c in cols))
+        nunique = self.get_nunique(idf, columns)
+        ranges = self.get_quantiles(
+            idf, [0.0, 1.0], [c for c in columns if c in cols_by_type["num"] or c in cols_by_type["dt"]]
         )
-        self.fill_histograms(idf)
 
-        return self._hists
+        def cardinality(hist):
+            col = self._quantity_column(hist.quantity)
+            if col not in nunique:
+                return None
+            n = nunique[col]
+            if isinstance(hist, SparselyBin) and col in ranges and np.all(np.isfinite(ranges[col])):
+                # no more bins than fit in the range of the column
+                low, high = [np.floor((x - hist.origin) / hist.binWidth) for x in ranges[col]]
+                n = min(n, high - low + 1)
+            return n
+
+        estimates = {}
+        for cols in self.features:
+            name = ":".join(cols)
+            estimates[name] = self.construct_empty_hist_of(idf, cols).estimate(n_rows, cardinality)
+            for warning in estimates[name].warnings:
+                self.logger.warning(f'Histogram "{name}": {warning}')
+        return estimates
+
+    def explain(self, df):
+        """Text report of estimate(df), histogram by histogram
+
+        :param df: input data frame
+        :return: str
+        """
+        return "\n\n".join(
+            f'Histogram "{name}":\n{estimate}' for name, estimate in self.estimate(df).items()
+        )
+
+    def get_row_count(self, df):
+        """return number of rows of dataframe"""
+        raise NotImplementedError("get_row_count not implemented!")
+
+    def construct_empty_hist_of(self, df, features):
+        """Create an (empty) histogram of right type for the features of (converted) dataframe df"""
+        return self.construct_empty_hist(features)
+
+    def _quantity_column(self, quantity):
+        # the column that a quantity function of these histograms reads
+        return quantity.name
 
     def assign_and_check_features(self, df, cols_by_type):
         """auto assign feature to make histograms of and do basic checks on them
@@ -290,7 +420,14 @@ class HistogramFillerBase(object):
             for c in str_cols:
                 if nuniq[c] < self._nunique_threshold:
                     continue
-                if no_initial_features:
+                if no_initial_features and self._topk_huge_categories:
+                    # we're the boss. only keep track of its most frequent categories (see get_hist_bin)
+                    self._topk_features.add(c)
+                    self.logger.info(
+                        f"Column {c} has {nuniq[c]} unique entries (large). "
+                        f"Histogramming its {self._nunique_threshold} most frequent ones."
+                    )
+                elif no_initial_features:
                     # we're the boss. we're not going to histogram this ...
                     huge_cats.append(c)
                 else:  # debug mode
@@ -314,15 +451,16 @@ class HistogramFillerBase(object):
         # do this based on range of 5-95% quantiles, so extreme outliers are binned separately
         # otherwise, the idea is to always reuse 1-dim binning for high n-dim, if those exist.
         bs_keys = list(self.bin_specs.keys())  # create initial unchanging list of keys
-        all_selected_cols = np.unique([j for i in self.features for j in i])
+        # only the columns of features without bin_specs need quantiles
+        open_cols = np.unique([j for i in self.features if ":".join(i) not in bs_keys for j in i])
         cols = list(cols_by_type["num"]) + list(cols_by_type["dt"])
-        num_cols = [c for c in all_selected_cols if c in cols and c not in bs_keys]
+        num_cols = [c for c in open_cols if c in cols and c not in bs_keys]
 
         # quantiles for bin specs
         int_cols = [c for c in num_cols if c in cols_by_type["int"]]
-        quantiles_i = self.get_quantiles(df, quantiles=[0.0, 1.0], columns=int_cols)
+        quantiles_i = self.get_quantiles(df, quantiles=[0.0, 1.0], columns=int_cols) if int_cols else {}
         float_cols = [c for c in num_cols if c not in cols_by_type["int"]]
-        quantiles_f = self.get_quantiles(df, quantiles=[0.05, 0.95], columns=float_cols)
+        quantiles_f = self.get_quantiles(df, quantiles=[0.05, 0.95], columns=float_cols) if float_cols else {}
 
         for cols in self.features:
             n = ":".join(cols)
@@ -473,6 +611,20 @@ class HistogramFillerBase(object):
         """
         return self._execute(input_df)
 
+    def get_fill_plan(self):
+        """Group the features by the first axis of their histograms
+
+        Histograms in one group bin their first axis on the same column, so a filler can compute that axis once
+        for the whole group (e.g. the time axis shared by all "date:x" features) and release it when the group is
+        done.
+
+        :return: list of (column, list of features) pairs, in the order the columns first appear in the features
+        """
+        plan = {}
+        for c in self.features:
+            plan.setdefault(c[0], []).append(c)
+        return list(plan.items())
+
     def get_features_specs(self):
         """Return bin specifications used to generate histograms
 
@@ -516,6 +668,9 @@ class HistogramFillerBase(object):
                     origin=specs.get("origin", specs.get("bin_offset", 0.)),
                     quantity=quant,
                     value=hist,
+                    maxBins=specs.get("maxBins", specs.get("max_bins")),
+                    window=specs.get("window"),
+                    spill=functools.partial(specs["spill"], ":".join(features)) if "spill" in specs else None,
                 )
             elif "num" in specs and "low" in specs and "high" in specs:
                 hist = Bin(
@@ -573,6 +728,9 @@ class HistogramFillerBase(object):
         else:
             if not is_bool and ("bag" in specs or "range" in specs):
                 hist = Bag(range=specs.get('range', 'S'), quantity=quant)
+            elif "capacity" in specs or col in self._topk_features:
+                # high-cardinality categories: keep the most frequent ones in bounded memory
+                hist = TopK(capacity=specs.get("capacity", self._nunique_threshold), quantity=quant, value=hist)
             else:
                 # string and booleans are treated as categories
                 hist = Categorize(quantity=quant, value=hist)
@@ -39,11 +39,13 @@ from ..primitives.select import Select
 from ..primitives.sparselybin import SparselyBin
 from ..primitives.stack import Stack
 from ..primitives.sum import Sum
+from ..primitives.topk import TopK
 
 from .pandas_histogrammar import PandasHistogrammar
 from .spark_histogrammar import SparkHistogrammar
 from .filling_utils import check_dtype
-from ..util import _get_sub_hist
+from .cache import HistogramCache, cacheable
+from ..util import _deepSizeOf, _get_sub_hist
 
 logger = logging.getLogger()
 
@@ -56,12 +58,20 @@ def make_histograms(
     time_axis="",
     time_width='30d',
     time_offset='2010-01-04',
+    time_window=None,
+    time_spill=None,
     var_dtype=None,
     ret_specs=False,
     nbins_1d=40,
     nbins_2d=20,
     nbins_3d=10,
     max_nunique=500,
+    sinks=None,
+    profile=False,
+    memory_budget=None,
+    previous=None,
+    cache=None,
+    cache_key=None,
 ):
     """Create histograms from pandas or spark dataframe.
 
@@ -95,7 +105,8 @@ def make_histograms(
                          }
 
         In the bin specs for x:y, x is not provided (here) and reverts to the 1-dim setting. The 'binWidth',
-        'origin' notation makes an open-ended histogram (for that feature) with given bin width and offset.
+        'origin' notation makes an open-ended histogram (for that feature) with given bin width and offset;
+        adding 'max_bins' caps its number of bins by doubling the bin width when needed.
         The notation 'num', 'low', 'high' gives a fixed range histogram from 'low' to 'high' with 'num'
         number of bins.
     :param str time_axis: name of datetime feature, used as time axis, eg 'date'. if True, will be guessed.
@@ -116,12 +127,35 @@ def make_histograms(
             Examples: '1-1-2020', 0 (number of ns since 1-1-1970),
                       anything parsed by pd.Timestamp(time_offset).value
 
+    :param time_window: keep only the most recent bins of time_axis: a number of bins, or a time span (str, as
+        time_width) that is rounded up to whole bins. Older bins are evicted as newer ones are filled. (optional)
+    :param time_spill: function called as time_spill(feature, index, histogram) with each bin of time_axis that is
+        evicted from the time_window, e.g. to write it to storage. (optional)
     :param dict var_dtype: dictionary with specified datatype per feature (optional)
     :param bool ret_specs: if true, also return features, bin_specs, var_dtype, time_axis used for filling histograms.
     :param int nbins_1d: auto-binning number of bins for 1d histograms. default is 40.
     :param int nbins_2d: auto-binning number of bins for 2d histograms. default is 20.
     :param int nbins_3d: auto-binning number of bins for 3d histograms. default is 10.
     :param int max_nunique: auto-binning threshold for unique categorical values. default is 500.
+        Auto-selected categorical features with more unique values are histogrammed with TopK, which keeps only
+        the max_nunique most frequent ones.
+    :param list sinks: receivers of the filling progress and metrics, see histogrammar.dfinterface.sinks.
+        default is a progress bar, [TqdmSink()].
+    :param bool profile: if true, profile the fill of each histogram and pass the per-node report to the sinks.
+        (pandas only, default is false)
+    :param memory_budget: maximum memory per histogram, checked after filling it: number of bytes or
+        histogrammar.defs.MemoryBudget (to compact histograms over the limit), or a dict of these by feature.
+        A histogram over its budget raises histogrammar.defs.MemoryBudgetExceeded. (optional)
+    :param dict previous: histograms made before (e.g. by make_histograms on older rows of the data) to update with
+        df, which then only needs to contain the new rows: df is filled in the binning of these histograms, without
+        re-deriving it, and added to them. Their features are the default features. (optional)
+    :param cache: histogrammar.dfinterface.cache.HistogramCache, or the directory of one, to look up the histograms of
+        the same data and arguments in before filling them, and to store them in after. Not used with ret_specs,
+        previous, time_spill or other functions in bin_specs. Histograms found in the cache are read back from their
+        JSON representation: they can be added, plotted and updated with previous, but not filled directly. Histograms
+        that were not found are returned as they were filled. (optional)
+    :param cache_key: version of the data in df for the cache, e.g. a snapshot date, instead of a hash of its rows.
+        required to cache spark dataframes. (optional)
     :return: dict of created histogrammar histograms
     """
     # basic checks on presence of time_axis
@@ -172,6 +206,31 @@ def make_histograms(
                 f'time-axis "{time_axis}" already found in binning specifications. not overwriting.'
             )
 
+        # a sliding window over the time axis
+        if time_window is not None or time_spill is not None:
+            time_specs = dict(bin_specs[time_axis])
+            if isinstance(time_window, str):
+                time_window = int(np.ceil(pd.Timedelta(time_window).value /
+                                          float(time_specs.get("binWidth", time_specs.get("bin_width")))))
+            if time_window is not None:
+                time_specs["window"] = time_window
+            if time_spill is not None:
+                time_specs["spill"] = time_spill
+            bin_specs[time_axis] = time_specs
+
+    # look up histograms of the same data and arguments
+    spec = dict(features=features, binning=binning, bin_specs=bin_specs, time_axis=time_axis, var_dtype=var_dtype,
+                nbins_1d=nbins_1d, nbins_2d=nbins_2d, nbins_3d=nbins_3d, max_nunique=max_nunique)
+    if cache is not None and not ret_specs and previous is None and cacheable(spec):
+        if not isinstance(cache, HistogramCache):
+            cache = HistogramCache(cache)
+        cache_key = cache.key(df, spec, cache_key)
+        hists = cache.get(cache_key)
+        if hists is not None:
+            return hists
+    else:
+        cache = None
+
     cls = PandasHistogrammar if isinstance(df, pd.DataFrame) else SparkHistogrammar
     hist_filler = cls(
         features=features,
@@ -183,8 +242,14 @@ def make_histograms(
         nbins_2d=nbins_2d,
         nbins_3d=nbins_3d,
         max_nunique=max_nunique,
+        sinks=sinks,
+        profile=profile,
+        memory_budget=memory_budget,
+        previous=previous,
     )
     hists = hist_filler.get_histograms(df)
+    if cache is not None:
+        cache.put(cache_key, hists)
 
     if ret_specs:
         features, binning, var_dtype, time_axis = hist_filler.get_features_specs()
@@ -269,10 +334,17 @@ def _get_bin_specs(h):
 
     if isinstance(h, Categorize):
         bin_specs.append({})
+    elif isinstance(h, TopK):
+        bin_specs.append(dict(capacity=h.capacity))
     elif isinstance(h, Bin):
         bin_specs.append(dict(num=h.num, low=h.low, high=h.high))
     elif isinstance(h, SparselyBin):
-        bin_specs.append(dict(binWidth=h.binWidth, origin=h.origin))
+        specs = dict(binWidth=h.binWidth, origin=h.origin)
+        if h.maxBins is not None:
+            specs["max_bins"] = h.maxBins
+        if h.window is not None:
+            specs["window"] = h.window
+        bin_specs.append(specs)
     elif isinstance(h, IrregularlyBin):
         bin_specs.append(dict(edges=h.edges[1:]))  # ignore -inf
     elif isinstance(h, CentrallyBin):
@@ -345,3 +417,19 @@ def get_bin_specs(hd, skip_first_axis=False):
         bs = bs[0] if len(bs) == 1 else bs
         bin_specs = bs
     return bin_specs
+
+
+def get_nbytes(hd):
+    """Get memory used by histograms, in bytes
+
+    Objects shared by several histograms of a dict (such as the quantity function of a column) are only counted in
+    the first histogram that uses them, so the values add up to the memory of the whole dict.
+
+    :param hd: input histogrammar histogram (or dict of input histograms)
+    :return: number of bytes (or dict with number of bytes per histogram)
+    :rtype: int (or dict)
+    """
+    if not isinstance(hd, dict):
+        return hd.nbytes
+    seen = set()
+    return {key: _deepSizeOf(h, seen) for key, h in hd.items()}
@@ -6,13 +6,15 @@ https://github.com/KaveIO/Eskapade/blob/master/python/eskapade/analysis/links/hi
 All modifications copyright ING WBAA.
 """
 
+import time
+
 import histogrammar as hg
 import numpy as np
 import pandas as pd
-from tqdm import tqdm
 from pandas.api.types import infer_dtype
 
 from .filling_utils import to_ns, QUANTITY
+from .. import profiling
 from .histogram_filler_base import HistogramFillerBase
 
 
@@ -37,6 +39,10 @@ class PandasHistogrammar(HistogramFillerBase):
         nbins_2d=20,
         nbins_3d=10,
         max_nunique=500,
+        sinks=None,
+        profile=False,
+        memory_budget=None,
+        previous=None,
     ):
         """Initialize module instance.
 
@@ -85,6 +91,15 @@ class PandasHistogrammar(HistogramFillerBase):
         :param int nbins_2d: auto-binning number of bins for 2d histograms. default is 20.
         :param int nbins_3d: auto-binning number of bins for 3d histograms. default is 10.
         :param int max_nunique: auto-binning threshold for unique categorical values. default is 500.
+        :param list sinks: receivers of the filling progress and metrics, see histogrammar.dfinterface.sinks.
+            default is a progress bar, [TqdmSink()].
+        :param bool profile: if true, profile the fill of each histogram and pass the per-node report to the sinks.
+            (pandas only, default is false)
+        :param memory_budget: maximum memory per histogram, checked after filling it: number of bytes or
+            histogrammar.defs.MemoryBudget (to compact histograms over the limit), or a dict of these by feature.
+            A histogram over its budget raises histogrammar.defs.MemoryBudgetExceeded. (optional)
+        :param dict previous: histograms made before, by feature, to update with the rows of the input dataframe.
+            The new rows are filled in the binning of these histograms, which is not re-derived. (optional)
         """
         HistogramFillerBase.__init__(
             self,
@@ -99,7 +114,13 @@ class PandasHistogrammar(HistogramFillerBase):
             nbins_2d,
             nbins_3d,
             max_nunique,
+            sinks,
+            profile,
+            memory_budget,
+            previous,
         )
+        # one quantity function per column, shared by all histograms binning that column
+        self._quantities = {}
 
     def assert_dataframe(self, df):
         """Check that input data is a filled pandas data frame.
@@ -157,6 +178,20 @@ class PandasHistogrammar(HistogramFillerBase):
         qd = {c: qdf[c].values.tolist() for c in columns}
         return qd
 
+    def get_row_count(self, df):
+        """return number of rows of dataframe
+
+        :param df: input pandas data frame
+        """
+        return len(df)
+
+    def _quantity_column(self, quantity):
+        # the quantity functions are lambdas: find the column by function
+        for col, fnc in self._quantities.items():
+            if quantity.expr is fnc:
+                return col
+        return None
+
     def get_nunique(self, df, columns=[]):
         """return dict with number of unique entries for given columns
 
@@ -201,15 +236,30 @@ class PandasHistogrammar(HistogramFillerBase):
                 # create an (empty) histogram of right type
                 self._hists[name] = self.construct_empty_hist(cols)
 
-        # histogram filling with working progress bar
-        res = [
-            _fill_histogram(idf=idf[c], hist=self._hists[":".join(c)], features=c)
-            for c in tqdm(self.features, total=len(self.features), ncols=100)
-        ]
-
-        # update dictionary
-        for name, hist in res:
-            self._hists[name] = hist
+        # histogram filling, reported to the sinks (by default a progress bar). histograms sharing a first axis are
+        # filled with one memo of the quantities evaluated on idf, so that axis is binned only once per group
+        sinks = self._sinks()
+        sinks.start(len(self.features), "Filling histograms")
+        try:
+            for _, group in self.get_fill_plan():
+                memo = {}
+                for c in group:
+                    start = time.perf_counter()
+                    if self.profile:
+                        with profiling.profile() as prof:
+                            name, hist = _fill_histogram(idf=idf, hist=self._hists[":".join(c)], features=c, memo=memo)
+                    else:
+                        name, hist = _fill_histogram(idf=idf, hist=self._hists[":".join(c)], features=c, memo=memo)
+                    metrics = {"rows": len(idf), "time": time.perf_counter() - start}
+                    if self.profile:
+                        metrics["nodes"] = prof.report()
+                    nbytes = self.check_memory(name, hist)
+                    if nbytes is not None:
+                        metrics["nbytes"] = nbytes
+                    self._hists[name] = hist
+                    sinks.update(name, metrics)
+        finally:
+            sinks.close()
 
     def construct_empty_hist(self, features):
         """Create an (empty) histogram of right type.
@@ -233,21 +283,18 @@ class PandasHistogrammar(HistogramFillerBase):
             dt = self.var_dtype[col]
 
             # processing function, e.g. only accept booleans during filling
-            f = QUANTITY[dt]
-            if len(features) == 1:
-                # df[col] is a pd.series
-                quant = lambda x, fnc=f: fnc(x)  # noqa
-            else:
-                # df[features] is a pd.Dataframe
-                # fix column to col
-                quant = lambda x, fnc=f, clm=col: fnc(x[clm])  # noqa
+            if col not in self._quantities:
+                # fix column to col when filled with a pd.Dataframe; also accepts df[col] as a pd.series
+                self._quantities[col] = lambda x, fnc=QUANTITY[dt], clm=col: fnc(  # noqa
+                    x[clm] if hasattr(x, "columns") else x)
+            quant = self._quantities[col]
 
             hist = self.get_hist_bin(hist, features, quant, col, dt)
 
         return hist
 
 
-def _fill_histogram(idf, hist, features):
+def _fill_histogram(idf, hist, features, memo=None):
     """Fill input histogram with column(s) of input dataframe.
 
     Separate function call for parallellization.
@@ -255,9 +302,10 @@ def _fill_histogram(idf, hist, features):
     :param idf: input data frame used for filling histogram
     :param hist: empty histogrammar histogram about to be filled
     :param list features: histogram column(s)
+    :param dict memo: quantities already evaluated on the rows of idf (see Container.fillnumpy), optional
     """
     name = ":".join(features)
-    clm = features[0] if len(features) == 1 else features
+    # a one-dim histogram reads its column directly; multi-dim histograms slice their rows, so only pass their columns
     # do the actual filling
-    hist.fill.numpy(idf[clm])
+    hist.fill.numpy(idf if len(features) == 1 else idf[features], memo=memo)
     return name, hist
@@ -0,0 +1,88 @@
+"""Receivers of the progress of histogram filling: a progress bar, a logger or a function of one's own.
+
+A histogrammar (and ``make_histograms``) reports to each of its ``sinks`` that it starts filling ``total`` histograms,
+then each histogram it has filled, with metrics of that fill, and finally that it is done. The metrics are a dict
+with the wall ``time`` (in seconds) of the fill, its number of ``rows`` (pandas only) and, when filling with
+``profile=True``, the per-node ``report`` of a ``histogrammar.profiling.FillProfile`` as ``nodes`` and, with a
+``memory_budget``, the memory of the histogram as ``nbytes``.
+"""
+
+import logging
+
+
+class Sink(object):
+    """Base class of the sinks, which ignores everything: subclasses override the calls they need."""
+
+    def start(self, total, description=""):
+        """Called before filling ``total`` histograms."""
+        pass
+
+    def update(self, name, metrics):
+        """Called when histogram ``name`` has been filled, with a dict of ``metrics`` of that fill."""
+        pass
+
+    def close(self):
+        """Called when the filling is done (or has failed)."""
+        pass
+
+
+class TqdmSink(Sink):
+    """Progress bar on the terminal (the default sink)."""
+
+    def __init__(self, ncols=100, **kwargs):
+        self.kwargs = dict(kwargs, ncols=ncols)
+        self.pbar = None
+
+    def start(self, total, description=""):
+        from tqdm import tqdm
+
+        self.pbar = tqdm(total=total, desc=description or None, **self.kwargs)
+
+    def update(self, name, metrics):
+        self.pbar.update(1)
+
+    def close(self):
+        if self.pbar is not None:
+            self.pbar.close()
+            self.pbar = None
+
+
+class LoggingSink(Sink):
+    """Log a line with the rows and time of each filled histogram."""
+
+    def __init__(self, logger=None, level=logging.INFO):
+        self.logger = logger or logging.getLogger(__name__)
+        self.level = level
+
+    def update(self, name, metrics):
+        self.logger.log(self.level, 'Filled histogram "%s": %d rows in %.3f s.', name, metrics.get("rows", 0),
+                        metrics.get("time", 0.0))
+
+
+class CallbackSink(Sink):
+    """Call ``callback(name, metrics)`` for each filled histogram, e.g. to send the metrics to a monitoring system."""
+
+    def __init__(self, callback):
+        self.callback = callback
+
+    def update(self, name, metrics):
+        self.callback(name, metrics)
+
+
+class _Sinks(Sink):
+    """All sinks of a histogrammar, called as one."""
+
+    def __init__(self, sinks):
+        self.sinks = list(sinks)
+
+    def start(self, total, description=""):
+        for sink in self.sinks:
+            sink.start(total, description)
+
+    def update(self, name, metrics):
+        for sink in self.sinks:
+            sink.update(name, metrics)
+
+    def close(self):
+        for sink in self.sinks:
+            sink.close()
@@ -6,9 +6,10 @@ https://github.com/KaveIO/Eskapade-Spark/blob/master/python/eskapadespark/links/
 All modifications copyright ING WBAA.
 """
 
+import time
+
 import histogrammar as hg
 import numpy as np
-from tqdm import tqdm
 
 from .histogram_filler_base import HistogramFillerBase
 
@@ -28,6 +29,9 @@ class SparkHistogrammar(HistogramFillerBase):
     is applied. Final histograms are stored in the datastore.
     """
 
+    # TopK cannot be filled through SparkSQL, so huge categorical columns are skipped
+    _topk_huge_categories = False
+
     def __init__(
         self,
         features=None,
@@ -41,6 +45,10 @@ class SparkHistogrammar(HistogramFillerBase):
         nbins_2d=20,
         nbins_3d=10,
         max_nunique=500,
+        sinks=None,
+        profile=False,
+        memory_budget=None,
+        previous=None,
     ):
         """Initialize module instance.
 
@@ -90,6 +98,15 @@ class SparkHistogrammar(HistogramFillerBase):
         :param int nbins_2d: auto-binning number of bins for 2d histograms. default is 20.
         :param int nbins_3d: auto-binning number of bins for 3d histograms. default is 10.
         :param int max_nunique: auto-binning threshold for unique categorical values. default is 500.
+        :param list sinks: receivers of the filling progress and metrics, see histogrammar.dfinterface.sinks.
+            default is a progress bar, [TqdmSink()].
+        :param bool profile: if true, profile the fill of each histogram and pass the per-node report to the sinks.
+            (pandas only, default is false)
+        :param memory_budget: maximum memory per histogram, checked after filling it: number of bytes or
+            histogrammar.defs.MemoryBudget (to compact histograms over the limit), or a dict of these by feature.
+            A histogram over its budget raises histogrammar.defs.MemoryBudgetExceeded. (optional)
+        :param dict previous: histograms made before, by feature, to update with the rows of the input dataframe.
+            The new rows are filled in the binning of these histograms, which is not re-derived. (optional)
         """
         HistogramFillerBase.__init__(
             self,
@@ -104,6 +121,10 @@ class SparkHistogrammar(HistogramFillerBase):
             nbins_2d,
             nbins_3d,
             max_nunique,
+            sinks,
+            profile,
+            memory_budget,
+            previous,
         )
         self._unit_timestamp_specs = {
             k: float(self._unit_timestamp_specs[k])
@@ -140,6 +161,17 @@ class SparkHistogrammar(HistogramFillerBase):
         qd = {c: qs for c, qs in zip(columns, qsl)}
         return qd
 
+    def get_row_count(self, df):
+        """return number of rows of dataframe
+
+        :param df: input (spark) data frame
+        """
+        return df.count()
+
+    def construct_empty_hist_of(self, df, features):
+        """Create an (empty) histogram of right type for the features of (converted) dataframe df"""
+        return self.construct_empty_hist(df, features)
+
     def get_nunique(self, df, columns=[]):
         """return dict with number of unique entries for given columns
 
@@ -238,11 +270,23 @@ class SparkHistogrammar(HistogramFillerBase):
 
         :param idf: input data frame used for filling histogram
         """
-        for cols in tqdm(self.features, ncols=100):
-            self.logger.debug(
-                'Processing feature "{cols}".'.format(cols=":".join(cols))
-            )
-            self.fill_histogram(idf, cols)
+        sinks = self._sinks()
+        sinks.start(len(self.features), "Filling histograms")
+        try:
+            for cols in self.features:
+                self.logger.debug(
+                    'Processing feature "{cols}".'.format(cols=":".join(cols))
+                )
+                start = time.perf_counter()
+                self.fill_histogram(idf, cols)
+                # the rows are counted by Spark, while filling, so they are not known here
+                metrics = {"time": time.perf_counter() - start}
+                nbytes = self.check_memory(":".join(cols), self._hists[":".join(cols)])
+                if nbytes is not None:
+                    metrics["nbytes"] = nbytes
+                sinks.update(":".join(cols), metrics)
+        finally:
+            sinks.close()
 
     def fill_histogram(self, idf, features):
         """Fill input histogram with column(s) of input dataframe.
@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+
+# Copyright 2016 DIANA-HEP
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Expected cost of filling a tree of aggregators with ``fillnumpy``, worked out before filling it.
+
+Each primitive describes what one ``_numpy`` call on a number of rows does (its ``_estimate`` method): the strategy it
+will choose, how many vectorized passes it makes over the rows, whether it sorts them, how many bins it creates and
+how the rows are divided among its sub-aggregators. ``Container.estimate`` walks the tree with these, assuming that
+rows are spread evenly over the bins, and adds up the containers, fill calls, memory and (roughly) time per node.
+
+The time is an order of magnitude, from ``ROW_SECONDS`` per row and pass and ``CALL_SECONDS`` per fill call; what
+matters is which nodes dominate it.
+"""
+
+import math
+
+from histogrammar.util import _pathLabel
+
+# number of distinct values assumed for quantities that are not in the cardinalities
+DEFAULT_CARDINALITY = 100
+
+# rough costs: a vectorized pass over one row, a vectorized fill call, a scalar fill call
+ROW_SECONDS = 2e-9
+CALL_SECONDS = 7e-5
+SCALAR_CALL_SECONDS = 1e-5
+
+# memory of an aggregator object with its attributes (without its sub-aggregators) and the temporary arrays of a pass
+NODE_BYTES = 400
+ROW_BYTES = 8
+
+# thresholds of the warnings
+MAX_CONTAINERS = 10**6
+MAX_BYTES = 2**30
+MIN_ROWS_PER_CALL = 100
+MAX_CALLS = 10**4
+
+
+def cost(strategy, passes=0, sort=False, calls=0, bytes=NODE_BYTES, children=()):
+    """The cost of one ``_numpy`` call, as returned by ``Container._estimate``.
+
+    Parameters:
+        strategy (str): how the rows are filled, for the report.
+
+        passes (int): number of vectorized passes over the rows (computing the quantity, comparisons, ...).
+
+        sort (bool): whether the rows are sorted (an O(n log n) pass).
+
+        calls (float): number of scalar fill calls, such as the counts of a ``numpy.histogram`` going into their bins.
+
+        bytes (int): memory of this aggregator when filled, without its sub-aggregators.
+
+        children (list of tuples): ``(sub-aggregator, instances, filled, rows)``: the number of instances of the
+            sub-aggregator per instance of this one, how many of them are filled by ``_numpy`` and with how many rows
+            each.
+    """
+    return {"strategy": strategy, "passes": passes, "sort": sort, "calls": calls, "bytes": bytes,
+            "children": list(children)}
+
+
+def cardinality(node, cardinalities, rows):
+    """Number of bins that a fill of ``rows`` rows creates in ``node`` (binning by distinct value), and whether that is
+    only assumed."""
+    if callable(cardinalities):
+        value = cardinalities(node)
+    else:
+        value = cardinalities.get(getattr(getattr(node, "quantity", None), "name", None))
+    if value is not None:
+        return min(float(value), max(rows, 0.0)), False
+    return min(float(DEFAULT_CARDINALITY), max(rows, 0.0)), True
+
+
+class Estimate(object):
+    """Expected cost of filling a tree of aggregators, node by node (see ``Container.estimate``).
+
+    ``nodes`` lists one dict per node path (such as ``"Categorize(c)/Bin(x)/Count"``), parents before their
+    sub-aggregators, with the ``strategy`` of the fill, the number of ``containers`` at that path, the vectorized fill
+    ``calls`` (not counting the scalar fills of bin contents), the ``rows`` they fill (all calls together), the
+    ``bytes`` of the filled containers, the temporary ``workBytes`` of one call and its sub-aggregators, and the
+    ``seconds`` it takes. The attributes of the same names are the totals of the tree (``workBytes`` is the peak), and
+    ``warnings`` lists the expensive parts of the tree.
+    """
+
+    def __init__(self, rows, nodes):
+        self.rows = rows
+        self.nodes = sorted(nodes, key=lambda node: node["path"].split("/"))
+        self.containers = int(sum(node["containers"] for node in nodes))
+        self.calls = int(sum(node["calls"] for node in nodes))
+        self.bytes = int(sum(node["bytes"] for node in nodes))
+        self.workBytes = int(max([node["workBytes"] for node in nodes] + [0]))
+        self.seconds = sum(node["seconds"] for node in nodes)
+
+        self.warnings = []
+        if self.containers > MAX_CONTAINERS:
+            self.warnings.append("{0} containers: the tree may be too large to fill, merge or serialize".format(
+                self.containers))
+        if self.bytes + self.workBytes > MAX_BYTES:
+            self.warnings.append("{0:.1f} GB of memory are needed".format((self.bytes + self.workBytes) / 2.0**30))
+        for node in self.nodes:
+            if node["calls"] > MAX_CALLS and node["rows"] < MIN_ROWS_PER_CALL * node["calls"]:
+                self.warnings.append(
+                    "{0}: {1} fills of {2:.1f} rows each are dominated by Python overhead; bin it more coarsely or "
+                    "nest it less deeply".format(node["path"], int(node["calls"]), node["rows"] / node["calls"]))
+
+    def __repr__(self):
+        return "<Estimate containers={0} calls={1} bytes={2} workBytes={3} seconds={4:.3g}>".format(
+            self.containers, self.calls, self.bytes, self.workBytes, self.seconds)
+
+    def __str__(self):
+        lines = ["{0:<40s} {1:<40s} {2:>10s} {3:>10s} {4:>12s} {5:>12s} {6:>9s}".format(
+            "node", "strategy", "containers", "calls", "rows", "bytes", "seconds")]
+        for node in self.nodes:
+            parts = node["path"].split("/")
+            lines.append("{0:<40s} {1:<40s} {2:>10d} {3:>10d} {4:>12d} {5:>12d} {6:>9.3g}".format(
+                "  " * (len(parts) - 1) + parts[-1], node["strategy"], int(node["containers"]), int(node["calls"]),
+                int(round(node["rows"])), int(node["bytes"]), node["seconds"]))
+        lines.append("total: {0} containers, {1} calls, {2} bytes filled, {3} bytes of temporary arrays, about {4:.3g} "
+                     "seconds for {5} rows".format(self.containers, self.calls, self.bytes, self.workBytes,
+                                                   self.seconds, self.rows))
+        lines.extend("warning: " + x for x in self.warnings)
+        return "\n".join(lines)
+
+
+def estimate(container, rows, cardinalities=None):
+    """Estimate the cost of filling ``container`` with ``rows`` rows (see ``Container.estimate``)."""
+    nodes = {}
+    _walk(container, _pathLabel(container), 1.0, 1.0, float(rows), cardinalities or {}, nodes)
+    return Estimate(rows, list(nodes.values()))
+
+
+# the strategy reported for a path that several sub-aggregators share is the first of: a fill with rows, the parent's
+# scalar fill, none
+_STRATEGIES = {None: -1, "empty": 0, "filled by parent": 1}
+
+
+def _walk(node, path, instances, filled, rows, cardinalities, nodes):
+    # returns the temporary memory of one call on this node, including the calls on its sub-aggregators
+    out = node._estimate(rows, cardinalities)
+    calls = filled if rows > 0 else 0.0
+    seconds = calls * (CALL_SECONDS + ROW_SECONDS * rows * out["passes"] + SCALAR_CALL_SECONDS * out["calls"])
+    if out["sort"] and rows > 1:
+        seconds += calls * ROW_SECONDS * rows * math.log(rows, 2)
+    work = ROW_BYTES * rows * (out["passes"] + (2 if out["sort"] else 0)) if calls > 0 else 0.0
+
+    record = nodes.get(path)
+    if record is None:
+        record = nodes[path] = {"path": path, "strategy": None, "containers": 0.0, "calls": 0.0, "rows": 0.0,
+                                "bytes": 0.0, "workBytes": 0.0, "seconds": 0.0}
+    # a node that is not filled with rows either gets a sum of weights from its parent or no rows at all
+    strategy = out["strategy"] if calls > 0 else "filled by parent" if filled == 0 else "empty"
+    if _STRATEGIES.get(record["strategy"], 2) <= _STRATEGIES.get(strategy, 2):
+        record["strategy"] = strategy
+    record["containers"] += instances
+    record["calls"] += calls
+    record["rows"] += calls * rows
+    record["bytes"] += instances * out["bytes"]
+    record["seconds"] += seconds
+
+    childWork = 0.0
+    for child, childInstances, childFilled, childRows in out["children"]:
+        childWork = max(childWork, _walk(child, path + "/" + _pathLabel(child), instances * childInstances,
+                                         filled * childFilled, childRows, cardinalities, nodes))
+    record["workBytes"] = max(record["workBytes"], work + childWork)
+    return work + childWork
@@ -20,6 +20,7 @@ import numbers
 import struct
 
 from histogrammar.defs import Container, Factory, identity, JsonFormatException, ContainerException
+from histogrammar.sql import number
 from histogrammar.util import n_dim, datatype, serializable, inheritdoc, maybeAdd, floatToJson, hasKeys, numeq, \
     basestring
 
@@ -32,6 +33,8 @@ class Average(Factory, Container):
     *Univeristy of Cambridge Computing Service,* 2009.
     """
 
+    _pickleFields = ("entries", "mean")
+
     @staticmethod
     def ed(entries, mean):
         """Create an Average that is only capable of being added.
@@ -220,6 +223,52 @@ class Average(Factory, Container):
         self.entries = entries
         self.mean = mean
 
+    def _numbaGenerateCode(self, inputFields, inputFieldNames, derivedFieldExprs, globalCode, initCode, initPrefix,
+                           initIndent, fillCode, fillPrefix, fillIndent, weightVars, weightVarStack, tmpVarTypes):
+        initCode.append(" " * initIndent + "heap[{0}] = 0.0".format(initPrefix))
+        initCode.append(" " * initIndent + "heap[{0}] = 0.0".format(self._numbaExpandPrefix(initPrefix, 1)))
+
+        normexpr = self._numbaQuantityExpr(inputFields, inputFieldNames, derivedFieldExprs, None)
+        q = "q_" + str(len(tmpVarTypes))
+        tmpVarTypes[q] = "float64"
+
+        fillCode.append("""{indent}{q} = {normexpr}
+{indent}if {entries} == 0.0:
+{indent}    {mean} = {q}
+{indent}{entries} += {weight}
+{indent}if math.isnan({mean}) or math.isnan({q}):
+{indent}    {mean} = math.nan
+{indent}elif math.isinf({mean}) or math.isinf({q}):
+{indent}    if math.isinf({mean}) and math.isinf({q}) and {mean} * {q} < 0.0:
+{indent}        {mean} = math.nan
+{indent}    elif math.isinf({q}):
+{indent}        {mean} = {q}
+{indent}    if math.isinf({entries}) or math.isnan({entries}):
+{indent}        {mean} = math.nan
+{indent}else:
+{indent}    {mean} += ({q} - {mean}) * {weight} / {entries}""".format(
+            indent=" " * fillIndent,
+            q=q,
+            normexpr=normexpr,
+            entries="heap[{0}]".format(fillPrefix),
+            mean="heap[{0}]".format(self._numbaExpandPrefix(fillPrefix, 1)),
+            weight=weightVarStack[-1]))
+
+    def _numbaStorageSize(self):
+        return 2
+
+    def _numbaUpdate(self, heap, dynamic, offset):
+        entries = float(heap[offset])
+        if self.entries == 0.0:
+            mean = float(heap[offset + 1])
+        elif entries == 0.0:
+            mean = self.mean
+        else:
+            mean = (self.entries*self.mean + entries*float(heap[offset + 1]))/(self.entries + entries)
+
+        self.entries += entries
+        self.mean = mean
+
     def _c99StructName(self):
         return "Av"
 
@@ -318,11 +367,10 @@ class Average(Factory, Container):
         self.mean = mean
         return data[struct.calcsize(format):]
 
-    def _numpy(self, data, weights, shape):
-        q = self.quantity(data)
+    def _numpy(self, data, weights, shape, memo):
+        q = self._npQuantity(data, memo)
         self._checkNPQuantity(q, shape)
         self._checkNPWeights(weights, shape)
-        weights = self._makeNPWeights(weights, shape)
 
         # no possibility of exception from here on out (for rollback)
         ca, ma = self.entries, self.mean
@@ -330,11 +378,17 @@ class Average(Factory, Container):
             ma = 0.0
 
         import numpy
-        selection = weights > 0.0
-        q = q[selection]
-        weights = weights[selection]
-
-        self.entries += float(weights.sum())
+        if isinstance(weights, numpy.ndarray):
+            selection = weights > 0.0
+            q = q[selection]
+            weights = weights[selection]
+            self.entries += float(weights.sum())
+        elif weights > 0.0 and len(q) > 0:
+            # a scalar weight drops out of the weighted average
+            self.entries += float(weights * len(q))
+            weights = None
+        else:
+            return
         ca_plus_cb = self.entries
 
         if math.isinf(ca_plus_cb):
@@ -343,6 +397,19 @@ class Average(Factory, Container):
             mb = numpy.average(q, weights=weights)
             self.mean = float((ca*ma + (ca_plus_cb - ca)*mb) / ca_plus_cb)
 
+    def _sql(self, query, weight):
+        q = self.quantity.asSQL()
+        entries = query.aggregate("SUM({0})".format(weight))
+        # the mean is over the rows with a quantity
+        sumw = query.aggregate("SUM(CASE WHEN {0} IS NULL THEN 0 ELSE {1} END)".format(q, weight))
+        sumwq = query.aggregate("SUM({0} * {1})".format(weight, q))
+
+        def fill(container, keys, aggregates):
+            w = number(aggregates[sumw])
+            container += Average.ed(number(aggregates[entries]),
+                                    number(aggregates[sumwq]) / w if w > 0.0 else float("nan"))
+        return fill
+
     def _sparksql(self, jvm, converter):
         return converter.Average(self.quantity.asSparkSQL())
 
@@ -16,8 +16,10 @@
 
 import math
 import numbers
+import random
 
 from histogrammar.defs import Container, Factory, identity, JsonFormatException, ContainerException
+from histogrammar.estimate import NODE_BYTES, cost, cardinality
 from histogrammar.util import n_dim, datatype, serializable, inheritdoc, maybeAdd, floatToJson, hasKeys, numeq, \
     floatOrNan, rangeToJson, basestring, xrange
 
@@ -33,6 +35,10 @@ class Bag(Factory, Container):
     Although the user-defined function may return scalar numbers, fixed-dimension vectors of numbers, or categorical
     strings, it may not mix range types. For the purposes of Label and Index (which can only collect aggregators of
     a single type), bags with different ranges are different types.
+
+    With a ``capacity``, a bag is a weighted reservoir sample of at most that many distinct values (Efraimidis and
+    Spirakis' A-Res, with the weights of identical values merged), so that it can be filled with a stream of
+    unbounded cardinality. ``entries`` still counts every observation.
     """
 
     @staticmethod
@@ -62,12 +68,13 @@ class Bag(Factory, Container):
         """Synonym for ``__init__``."""
         return Bag(quantity)
 
-    def __init__(self, quantity=identity, range="S"):
+    def __init__(self, quantity=identity, range="S", capacity=None):
         """Create a Bag that is capable of being filled and added.
 
         Parameters:
             quantity (function returning a float, a tuple of floats, or a str): computes the quantity of interest from
             the data.
+            capacity (int or None): if not None, the maximum number of distinct values to keep (as a reservoir sample).
 
         Other parameters:
             entries (float): the number of entries, initially 0.0.
@@ -75,6 +82,11 @@ class Bag(Factory, Container):
             range ("N", "N#" where "#" is a positive integer, or "S"): the data type: number, vector of numbers,
             or string. default is "S".
         """
+        if capacity is not None and not isinstance(capacity, numbers.Integral):
+            raise TypeError("capacity ({0}) must be None or an integer".format(capacity))
+        if capacity is not None and capacity < 1:
+            raise ValueError("capacity ({0}) must be positive".format(capacity))
+
         self.quantity = serializable(identity(quantity) if isinstance(quantity, str) else quantity)
         self.entries = 0.0
         self.values = {}
@@ -83,12 +95,17 @@ class Bag(Factory, Container):
             self.dimension = int(range[1:])
         except BaseException:
             self.dimension = 0
+        self.capacity = capacity
+        if capacity is not None:
+            # reservoir keys log(u)/weight of the values kept, and the smallest of them once the reservoir is full
+            self._priorities = {}
+            self._threshold = float("-inf")
         super(Bag, self).__init__()
         self.specialize()
 
     @inheritdoc(Container)
     def zero(self):
-        return Bag(self.quantity, self.range)
+        return Bag(self.quantity, self.range, self.capacity)
 
     @inheritdoc(Container)
     def __add__(self, other):
@@ -98,16 +115,25 @@ class Bag(Factory, Container):
                     "cannot add Bag because range differs ({0} vs {1})".format(
                         self.range, other.range))
 
-            out = Bag(self.quantity, self.range)
+            # the sum is bounded by the smaller capacity, if either operand has one
+            capacities = [x.capacity for x in (self, other) if x.capacity is not None]
+            out = Bag(self.quantity, self.range, min(capacities) if len(capacities) > 0 else None)
 
             out.entries = self.entries + other.entries
 
-            out.values = dict(self.values)
-            for value, count in other.values.items():
-                if value in out.values:
-                    out.values[value] += count
-                else:
-                    out.values[value] = count
+            if out.capacity is None:
+                out.values = dict(self.values)
+                for value, count in other.values.items():
+                    if value in out.values:
+                        out.values[value] += count
+                    else:
+                        out.values[value] = count
+            else:
+                for bag in (self, other):
+                    priorities = getattr(bag, "_priorities", {})
+                    for value, count in bag.values.items():
+                        out._addWeight(value, count, priorities.get(value))
+                out._trim()
 
             return out.specialize()
 
@@ -116,8 +142,13 @@ class Bag(Factory, Container):
 
     @inheritdoc(Container)
     def __iadd__(self, other):
-        self.entries = other.entries
-        self.values = other.values
+        both = self + other
+        self.entries = both.entries
+        self.values = both.values
+        self.capacity = both.capacity
+        if self.capacity is not None:
+            self._priorities = both._priorities
+            self._threshold = both._threshold
         return self
 
     @inheritdoc(Container)
@@ -129,6 +160,10 @@ class Bag(Factory, Container):
             out.entries = factor * self.entries
             for value, count in self.values.items():
                 out.values[value] = factor * count
+            if self.capacity is not None:
+                # scaling all weights keeps the same sample
+                out._priorities = dict((value, p / factor) for value, p in self._priorities.items())
+                out._threshold = self._threshold / factor
             return out.specialize()
 
     @inheritdoc(Container)
@@ -165,10 +200,39 @@ class Bag(Factory, Container):
 
         # no possibility of exception from here on out (for rollback)
         self.entries += weight
+        self._addWeight(q, weight)
+        if self.capacity is not None and len(self.values) > self.capacity:
+            self._trim()
+
+    def _addWeight(self, q, weight, priority=None):
+        if self.capacity is None:
+            self.values[q] = self.values.get(q, 0.0) + weight
+            return
+
+        if priority is None:
+            priority = math.log(1.0 - random.random()) / weight
         if q in self.values:
+            # the largest of the keys log(u_i)/w_i is distributed like one key log(u)/sum(w_i)
             self.values[q] += weight
-        else:
+            self._priorities[q] = max(self._priorities[q], priority)
+        elif len(self.values) < self.capacity or priority > self._threshold:
             self.values[q] = weight
+            self._priorities[q] = priority
+
+    def _trim(self):
+        """Drop the values with the smallest reservoir keys until at most ``capacity`` are left."""
+        excess = len(self.values) - self.capacity
+        if excess == 1:
+            victims = [min(self._priorities, key=self._priorities.get)]
+        elif excess > 1:
+            victims = sorted(self._priorities, key=self._priorities.get)[:excess]
+        else:
+            victims = []
+        for q in victims:
+            del self.values[q]
+            del self._priorities[q]
+        if len(self.values) == self.capacity:
+            self._threshold = min(self._priorities.values())
 
     def _cppGenerateCode(self, parser, generator, inputFieldNames, inputFieldTypes, derivedFieldTypes,
                          derivedFieldExprs, storageStructs, initCode, initPrefix, initIndent, fillCode, fillPrefix,
@@ -246,16 +310,23 @@ class Bag(Factory, Container):
             key = i.first
             if self.range[0] == "N" and len(self.range) > 1:
                 key = tuple(getattr(key, "v" + str(x)) for x in xrange(self.dimension))
-            if key not in self.values:
-                self.values[key] = 0.0
-            self.values[key] += i.second
+            self._addWeight(key, i.second)
+        if self.capacity is not None and len(self.values) > self.capacity:
+            self._trim()
+
+    def _numbaGenerateCode(self, inputFields, inputFieldNames, derivedFieldExprs, globalCode, initCode, initPrefix,
+                           initIndent, fillCode, fillPrefix, fillIndent, weightVars, weightVarStack, tmpVarTypes):
+        raise NotImplementedError("no Numba implementation of Bag (string-valued keys)")
+
+    def _numbaStorageSize(self):
+        raise NotImplementedError("no Numba implementation of Bag (string-valued keys)")
 
     def _c99StructName(self):
         return "Bg" + self.range + "_"
 
-    def _numpy(self, data, weights, shape):
+    def _numpy(self, data, weights, shape, memo):
         import numpy
-        q = self.quantity(data)
+        q = self._npQuantity(data, memo)
         assert isinstance(q, numpy.ndarray)
         if shape[0] is None:
             shape[0] = q.shape[0]
@@ -263,13 +334,75 @@ class Bag(Factory, Container):
             assert q.shape[0] == shape[0]
 
         self._checkNPWeights(weights, shape)
-        weights = self._makeNPWeights(weights, shape)
+        if isinstance(weights, numpy.ndarray):
+            selection = weights > 0.0
+            q = q[selection]
+            weights = weights[selection]
+        elif not weights > 0.0:
+            return
+        if len(q) == 0:
+            return
+
+        # identical values are merged by numpy.unique, so that only distinct values are added to the dict
+        keys, inverse = self._npUniques(q)
+        if isinstance(weights, numpy.ndarray):
+            sums = numpy.bincount(inverse, weights=weights, minlength=len(keys))
+        else:
+            sums = numpy.bincount(inverse, minlength=len(keys)) * float(weights)
+
+        # no possibility of exception from here on out (for rollback)
+        self.entries += float(sums.sum())
+        if self.capacity is None:
+            for key, w in zip(keys, sums.tolist()):
+                self._addWeight(key, w)
+        else:
+            priorities = numpy.log(1.0 - numpy.random.random(len(sums))) / sums
+            for key, w, p in zip(keys, sums.tolist(), priorities.tolist()):
+                self._addWeight(key, w, p)
+            self._trim()
 
-        for x, w in zip(q, weights):
-            if w > 0.0:
-                if isinstance(x, numpy.ndarray):
-                    x = x.tolist()
-                self._update(x, float(w))
+    def _npUniques(self, q):
+        """Distinct values of ``q`` as keys of ``values``, and the index of each row's value among them."""
+        import numpy
+        if self.range == "S":
+            if q.dtype.kind not in "UO":
+                raise TypeError("function return values ({0}) must be strings for range {1}".format(
+                    q.dtype, self.range))
+            try:
+                uniques, inverse = numpy.unique(q, return_inverse=True)
+            except TypeError:
+                uniques = None
+            if uniques is None or (q.dtype.kind == "O" and not all(isinstance(x, basestring) for x in uniques)):
+                raise TypeError("function return values must be strings for range {0}".format(self.range))
+            return uniques.tolist(), inverse
+
+        try:
+            qf = numpy.array(q.tolist() if q.dtype.kind == "O" else q, dtype=numpy.float64)
+        except (TypeError, ValueError):
+            raise TypeError("function return values ({0}) must be numbers for range {1}".format(q.dtype, self.range))
+
+        if self.range == "N":
+            if qf.ndim != 1:
+                raise TypeError("function return values must be numbers for range {0}".format(self.range))
+            uniques, inverse = numpy.unique(qf, return_inverse=True)
+            return [floatOrNan(x) for x in uniques.tolist()], inverse
+
+        if qf.ndim != 2 or qf.shape[1] != self.dimension:
+            raise TypeError("function return values must be vectors of numbers with length {0} for range {1}".format(
+                self.dimension, self.range))
+        # rows are compared as raw bytes, so first give all zeros and all NaNs the same bytes
+        qf = qf + 0.0
+        qf[numpy.isnan(qf)] = numpy.nan
+        rows = qf.view(numpy.dtype((numpy.void, qf.itemsize * self.dimension))).ravel()
+        uniques, first, inverse = numpy.unique(rows, return_index=True, return_inverse=True)
+        return [tuple(floatOrNan(x) for x in qf[i].tolist()) for i in first], inverse
+
+    def _estimate(self, rows, cardinalities):
+        values, assumed = cardinality(self, cardinalities, rows)
+        if self.capacity is not None:
+            values = min(values, float(self.capacity))
+        return cost("numpy.unique, {0:.0f} values{1}".format(values, " (assumed)" if assumed else ""), 2, sort=True,
+                    bytes=NODE_BYTES + 100 * values)
 
     def _sparksql(self, jvm, converter):
         return converter.Bag(self.quantity.asSparkSQL(), self.range)
@@ -307,16 +440,23 @@ class Bag(Factory, Container):
         else:
             aslist = sorted(x for x in self.values.items())
 
+        if self.capacity is None:
+            values = [{"w": floatToJson(n), "v": rangeToJson(v)} for v, n in aslist]
+        else:
+            # with the reservoir keys, so that the sample can go on
+            values = [{"w": floatToJson(n), "v": rangeToJson(v), "p": floatToJson(self._priorities[v])}
+                      for v, n in aslist]
+
         return maybeAdd({
             "entries": floatToJson(self.entries),
-            "values": [{"w": floatToJson(n), "v": rangeToJson(v)} for v, n in aslist],
+            "values": values,
             "range": self.range,
-        }, name=(None if suppressName else self.quantity.name))
+        }, name=(None if suppressName else self.quantity.name), capacity=self.capacity)
 
     @staticmethod
     @inheritdoc(Factory)
     def fromJsonFragment(json, nameFromParent):
-        if isinstance(json, dict) and hasKeys(json.keys(), ["entries", "values", "range"], ["name"]):
+        if isinstance(json, dict) and hasKeys(json.keys(), ["entries", "values", "range"], ["name", "capacity"]):
             if json["entries"] in ("nan", "inf", "-inf") or isinstance(json["entries"], numbers.Real):
                 entries = json["entries"]
             else:
@@ -329,13 +469,18 @@ class Bag(Factory, Container):
             else:
                 raise JsonFormatException(json["name"], "Bag.name")
 
+            capacity = json.get("capacity", None)
+            if capacity is not None and (not isinstance(capacity, numbers.Integral) or capacity < 1):
+                raise JsonFormatException(capacity, "Bag.capacity")
+
+            priorities = {}
             if json["values"] is None:
                 values = None
 
             elif json["values"] is None or isinstance(json["values"], list):
                 values = {}
                 for i, nv in enumerate(json["values"]):
-                    if isinstance(nv, dict) and hasKeys(nv.keys(), ["w", "v"]):
+                    if isinstance(nv, dict) and hasKeys(nv.keys(), ["w", "v"], ["p"]):
                         if nv["w"] in ("nan", "inf", "-inf") or isinstance(nv["w"], numbers.Real):
                             n = float(nv["w"])
                         else:
@@ -355,6 +500,13 @@ class Bag(Factory, Container):
 
                         values[v] = n
 
+                        if "p" not in nv:
+                            pass
+                        elif nv["p"] in ("nan", "inf", "-inf") or isinstance(nv["p"], numbers.Real):
+                            priorities[v] = float(nv["p"])
+                        else:
+                            raise JsonFormatException(nv["p"], "Bag.values {0} p".format(i))
+
                     else:
                         raise JsonFormatException(nv, "Bag.values {0}".format(i))
 
@@ -371,6 +523,13 @@ class Bag(Factory, Container):
 
             out = Bag.ed(entries, values, range)
             out.quantity.name = nameFromParent if name is None else name
+            if capacity is not None:
+                out.capacity = capacity
+                # values without a reservoir key get a new one, as when they were first filled
+                out._priorities = dict((v, priorities[v] if v in priorities else
+                                        math.log(1.0 - random.random()) / n) for v, n in values.items())
+                out._threshold = float("-inf")
+                out._trim()
             return out.specialize()
 
         else:
@@ -380,6 +539,9 @@ class Bag(Factory, Container):
         return "<Bag size={0} range={1}>".format(len(self.values), self.range)
 
     def __eq__(self, other):
+        if not isinstance(other, Bag) or self.capacity != other.capacity:
+            return False
+
         if len(self.values) != len(other.values):
             return False
 
@@ -20,6 +20,8 @@ import numbers
 import struct
 
 from histogrammar.defs import Container, Factory, identity, JsonFormatException, ContainerException
+from histogrammar.estimate import cost
+from histogrammar.sql import number
 from histogrammar.util import n_dim, datatype, serializable, inheritdoc, maybeAdd, floatToJson, hasKeys, numeq, \
     xrange, long, basestring
 
@@ -148,7 +150,8 @@ class Bin(Factory, Container):
             self.values = [None] * num
             self.contentType = "Count"
         else:
-            self.values = [value.zero() for i in range(num)]
+            template = value.zero()
+            self.values = [template._zeroClone() for i in range(num)]
             self.contentType = value.name
         self.underflow = underflow.copy()
         self.overflow = overflow.copy()
@@ -214,6 +217,14 @@ class Bin(Factory, Container):
         return Bin(len(self.values), self.low, self.high, self.quantity, self.values[0].zero(), self.underflow.zero(),
                    self.overflow.zero(), self.nanflow.zero())
 
+    def _zeroClone(self):
+        out = self._shallowClone()
+        out.values = [v._zeroClone() for v in self.values]
+        out.underflow = self.underflow._zeroClone()
+        out.overflow = self.overflow._zeroClone()
+        out.nanflow = self.nanflow._zeroClone()
+        return out
+
     @inheritdoc(Container)
     def __add__(self, other):
         if isinstance(other, Bin):
@@ -299,7 +310,17 @@ class Bin(Factory, Container):
         if self.under(x) or self.over(x) or self.nan(x):
             return -1
         else:
-            return int(math.floor(self.num * (x - self.low) / (self.high - self.low)))
+            # rounding can put values just below high at num
+            return min(int(math.floor(self.num * (x - self.low) / (self.high - self.low))), self.num - 1)
+
+    def _npBins(self, q):
+        """The bin indexes of the Numpy array of floats ``q``, as in ``bin``: -1 where out of range or NaN."""
+        import numpy
+        with numpy.errstate(invalid="ignore"):
+            out = numpy.floor(self.num * (q - self.low) / (self.high - self.low))
+            numpy.minimum(out, self.num - 1, out)
+            out[~((q >= self.low) & (q < self.high))] = -1
+        return numpy.array(out, dtype=numpy.int64)
 
     def under(self, x):
         """Return ``true`` iff ``x`` is in the underflow region (less than ``low``)."""
@@ -493,6 +514,87 @@ class Bin(Factory, Container):
         self.overflow._clingUpdate(obj, ("var", "overflow"))
         self.nanflow._clingUpdate(obj, ("var", "nanflow"))
 
+    def _numbaGenerateCode(self, inputFields, inputFieldNames, derivedFieldExprs, globalCode, initCode, initPrefix,
+                           initIndent, fillCode, fillPrefix, fillIndent, weightVars, weightVarStack, tmpVarTypes):
+        normexpr = self._numbaQuantityExpr(inputFields, inputFieldNames, derivedFieldExprs, None)
+        q = "q_" + str(len(tmpVarTypes))
+        tmpVarTypes[q] = "float64"
+
+        underflowStart = 1
+        overflowStart = underflowStart + self.underflow._numbaStorageSize()
+        nanflowStart = overflowStart + self.overflow._numbaStorageSize()
+        valuesStart = nanflowStart + self.nanflow._numbaStorageSize()
+        valueSize = self.values[0]._numbaStorageSize()
+
+        initCode.append(" " * initIndent + "heap[{0}] = 0.0".format(initPrefix))
+        fillCode.append(" " * fillIndent + "{0} = {1}".format(q, normexpr))
+        fillCode.append(" " * fillIndent + "heap[{0}] += {1}".format(fillPrefix, weightVarStack[-1]))
+
+        for condition, flow, start in (("math.isnan({0})".format(q), self.nanflow, nanflowStart),
+                                       ("{0} < {1}".format(q, self._numbaConstant(self.low)), self.underflow,
+                                        underflowStart),
+                                       ("{0} >= {1}".format(q, self._numbaConstant(self.high)), self.overflow,
+                                        overflowStart)):
+            fillCode.append(" " * fillIndent + ("if " if flow is self.nanflow else "elif ") + condition + ":")
+            flow._numbaGenerateCode(inputFields,
+                                    inputFieldNames,
+                                    derivedFieldExprs,
+                                    globalCode,
+                                    initCode,
+                                    self._numbaExpandPrefix(initPrefix, start),
+                                    initIndent,
+                                    fillCode,
+                                    self._numbaExpandPrefix(fillPrefix, start),
+                                    fillIndent + 4,
+                                    weightVars,
+                                    weightVarStack,
+                                    tmpVarTypes)
+
+        bin = "bin_" + str(len(tmpVarTypes))
+        tmpVarTypes[bin] = "int64"
+        offset = "offset_" + str(len(tmpVarTypes))
+        tmpVarTypes[offset] = "int64"
+
+        initCode.append(" " * initIndent + "for {0} in range({1}):".format(bin, len(self.values)))
+        initCode.append(" " * (initIndent + 4) + "{0} = {1} + {2} * {3}".format(
+            offset, self._numbaExpandPrefix(initPrefix, valuesStart), bin, valueSize))
+
+        fillCode.append(" " * fillIndent + "else:")
+        # the same expression as Bin.bin, so that the kernel puts values at the bin edges where fill and fill.numpy do
+        fillCode.append(" " * (fillIndent + 4) + "{0} = min(int(math.floor({1} * ({2} - {3}) / {4})), {5})".format(
+            bin, len(self.values), q, self._numbaConstant(self.low), self._numbaConstant(self.high - self.low),
+            len(self.values) - 1))
+        fillCode.append(" " * (fillIndent + 4) + "{0} = {1} + {2} * {3}".format(
+            offset, self._numbaExpandPrefix(fillPrefix, valuesStart), bin, valueSize))
+
+        self.values[0]._numbaGenerateCode(inputFields,
+                                          inputFieldNames,
+                                          derivedFieldExprs,
+                                          globalCode,
+                                          initCode,
+                                          offset,
+                                          initIndent + 4,
+                                          fillCode,
+                                          offset,
+                                          fillIndent + 4,
+                                          weightVars,
+                                          weightVarStack,
+                                          tmpVarTypes)
+
+    def _numbaStorageSize(self):
+        return 1 + self.underflow._numbaStorageSize() + self.overflow._numbaStorageSize() + \
+            self.nanflow._numbaStorageSize() + len(self.values) * self.values[0]._numbaStorageSize()
+
+    def _numbaUpdate(self, heap, dynamic, offset):
+        self.entries += float(heap[offset])
+        offset += 1
+        for flow in (self.underflow, self.overflow, self.nanflow):
+            flow._numbaUpdate(heap, dynamic, offset)
+            offset += flow._numbaStorageSize()
+        valueSize = self.values[0]._numbaStorageSize()
+        for i, v in enumerate(self.values):
+            v._numbaUpdate(heap, dynamic, offset + i * valueSize)
+
     def _c99StructName(self):
         return "Bn" + str(len(self.values)) + self.values[0]._c99StructName(
         ) + self.underflow._c99StructName() + self.overflow._c99StructName() + self.nanflow._c99StructName()
@@ -776,65 +878,89 @@ class Bin(Factory, Container):
 
         return data
 
-    def _numpy(self, data, weights, shape):
-        q = self.quantity(data)
+    def _numpy(self, data, weights, shape, memo):
+        q = self._npQuantity(data, memo)
         self._checkNPQuantity(q, shape)
         self._checkNPWeights(weights, shape)
-        weights = self._makeNPWeights(weights, shape)
-        newentries = weights.sum()
+        newentries = self._npWeightsSum(weights, shape)
 
         import numpy
 
+        # each sub-aggregator is filled with only the rows that belong to it (see Container._npFillRows)
+        q = numpy.array(q, dtype=numpy.float64)
         selection = numpy.isnan(q)
-        numpy.bitwise_not(selection, selection)
-        subweights = weights.copy()
-        subweights[selection] = 0.0
-        self.nanflow._numpy(data, subweights, shape)
+        self._npFillSelected(self.nanflow, data, weights, selection, shape, memo)
 
         # avoid nan warning in calculations by flinging the nans elsewhere
-        numpy.bitwise_not(selection, selection)
-        q = numpy.array(q, dtype=numpy.float64)
+        valid = numpy.bitwise_not(selection)
         q[selection] = self.high
-        weights = weights.copy()
-        weights[selection] = 0.0
 
-        numpy.greater_equal(q, self.low, selection)
-        subweights[:] = weights
-        subweights[selection] = 0.0
-        self.underflow._numpy(data, subweights, shape)
+        numpy.less(q, self.low, selection)
+        self._npFillSelected(self.underflow, data, weights, selection, shape, memo)
+
+        numpy.greater_equal(q, self.high, selection)
+        numpy.bitwise_and(selection, valid, selection)
+        self._npFillSelected(self.overflow, data, weights, selection, shape, memo)
 
+        # nans were flung to high, so they are not in range either
+        inrange = numpy.greater_equal(q, self.low)
         numpy.less(q, self.high, selection)
-        subweights[:] = weights
-        subweights[selection] = 0.0
-        self.overflow._numpy(data, subweights, shape)
+        numpy.bitwise_and(inrange, selection, inrange)
 
         if all(isinstance(value, Count) and value.transform is identity for value in self.values) and numpy.all(
-                numpy.isfinite(q)) and numpy.all(numpy.isfinite(weights)):
-            # Numpy defines histograms as including the upper edge of the last bin only, so drop that
-            weights[q == self.high] == 0.0
-
-            h, _ = numpy.histogram(q, self.num, (self.low, self.high), weights=weights)
+                numpy.isfinite(weights)):
+            # bin indexes as in Bin.bin: numpy.histogram would place values at the bin edges differently
+            index = self._npBins(q[inrange])
+            if isinstance(weights, numpy.ndarray):
+                h = numpy.bincount(index, weights=weights[inrange], minlength=self.num)
+            else:
+                h = numpy.bincount(index, minlength=self.num) * weights
 
             for hi, value in zip(h, self.values):
                 value.fill(None, float(hi))
 
         else:
-            q = numpy.array(q, dtype=numpy.float64)
-            numpy.subtract(q, self.low, q)
-            numpy.multiply(q, self.num, q)
-            numpy.divide(q, self.high - self.low, q)
-            numpy.floor(q, q)
-            q = numpy.array(q, dtype=int)
-
-            for index, value in enumerate(self.values):
-                numpy.not_equal(q, index, selection)
-                subweights[:] = weights
-                subweights[selection] = 0.0
-                value._numpy(data, subweights, shape)
+            for value, rows in zip(self.values, self._npPartition(self._npBins(q), self.num)):
+                self._npFillRows(value, data, weights, rows, shape, memo)
 
         # no possibility of exception from here on out (for rollback)
         self.entries += float(newentries)
 
+    def _estimate(self, rows, cardinalities):
+        flows = [(x, 1, 1, 0.0) for x in (self.underflow, self.overflow, self.nanflow)]
+        if all(isinstance(value, Count) and value.transform is identity for value in self.values):
+            return cost("numpy.bincount", 8, calls=self.num, children=flows + [(self.values[0], self.num, 0, 0.0)])
+        filled = min(float(self.num), rows)
+        return cost("partition into {0} bins".format(self.num), 8, sort=True,
+                    children=flows + [(self.values[0], self.num, filled, rows / filled if filled > 0 else 0.0)])
+
+    def _sql(self, query, weight):
+        # bin index, or -1 for underflow, -2 for overflow and NULL for nanflow
+        q = self.quantity.asSQL()
+        low, high = query.literal(self.low), query.literal(self.high)
+        index = query.key("(CASE WHEN {0} IS NULL THEN NULL WHEN {0} < {1} THEN -1 WHEN {0} >= {2} THEN -2 "
+                          "ELSE {3} END)".format(q, low, high, query.floor("(({0} - {1}) * {2} / ({3} - {1}))".format(
+                              q, low, self.num, high))))
+        entries = query.aggregate("SUM({0})".format(weight))
+        fillValue = self.values[0]._sql(query, weight)
+        fillUnderflow = self.underflow._sql(query, weight)
+        fillOverflow = self.overflow._sql(query, weight)
+        fillNanflow = self.nanflow._sql(query, weight)
+
+        def fill(container, keys, aggregates):
+            container.entries += number(aggregates[entries])
+            i = keys[index]
+            if i is None:
+                fillNanflow(container.nanflow, keys, aggregates)
+            elif i == -1:
+                fillUnderflow(container.underflow, keys, aggregates)
+            elif i == -2:
+                fillOverflow(container.overflow, keys, aggregates)
+            else:
+                # rounding can put a value just below high into bin num
+                fillValue(container.values[min(int(i), container.num - 1)], keys, aggregates)
+        return fill
+
     def _sparksql(self, jvm, converter):
         return converter.Bin(len(self.values), self.low, self.high, self.quantity.asSparkSQL(),
                              self.values[0]._sparksql(jvm, converter), self.underflow._sparksql(jvm, converter),
@@ -845,6 +971,9 @@ class Bin(Factory, Container):
         """List of sub-aggregators, to make it possible to walk the tree."""
         return [self.underflow, self.overflow, self.nanflow] + self.values
 
+    def _reduceColumns(self, protocol):
+        return self._reduceColumnsOf(protocol, "values", [], self.values)
+
     @inheritdoc(Container)
     def toJsonFragment(self, suppressName):
         if getattr(self.values[0], "quantity", None) is not None:
@@ -1071,7 +1200,8 @@ class Bin(Factory, Container):
         num_bins = self.num_bins(low, high)
         # trivial cases first
         if low is None and high is None:
-            return np.linspace(self.low, self.high, num_bins + 1)
+            return self._cachedMetadata("bin_edges", (self.low, self.high, num_bins),
+                                        lambda: np.linspace(self.low, self.high, num_bins + 1))
         # catch weird cases
         elif low is not None and high is not None:
             if low > high:
@@ -1114,7 +1244,8 @@ class Bin(Factory, Container):
         # trivial case
         if low is None and high is None:
             bw = self.bin_width()
-            return np.arange(self.low + bw / 2., self.high + bw / 2., bw)
+            return self._cachedMetadata("bin_centers", (self.low, self.high, len(self.values)),
+                                        lambda: np.arange(self.low + bw / 2., self.high + bw / 2., bw))
         # catch weird cases
         elif low is not None and high is not None:
             if low > high:
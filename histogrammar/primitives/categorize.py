@@ -19,8 +19,10 @@ import numbers
 import numpy as np
 
 from histogrammar.defs import Container, Factory, identity, JsonFormatException, ContainerException
+from histogrammar.estimate import NODE_BYTES, cost, cardinality
+from histogrammar.sql import number
 from histogrammar.util import n_dim, datatype, serializable, inheritdoc, maybeAdd, floatToJson, hasKeys, numeq, \
-    basestring
+    basestring, _npMemo
 from histogrammar.primitives.count import Count
 
 
@@ -135,6 +137,11 @@ class Categorize(Factory, Container):
     def zero(self):
         return Categorize(self.quantity, self.value)
 
+    def _zeroClone(self):
+        out = self._shallowClone()
+        out.bins = {}
+        return out
+
     @inheritdoc(Container)
     def __add__(self, other):
         if isinstance(other, Categorize):
@@ -275,62 +282,96 @@ class Categorize(Factory, Container):
                 self.bins[key] = self.value.copy()
             self.bins[key]._clingUpdate(obj, ("func", ["getValues", key]))
 
+    def _numbaGenerateCode(self, inputFields, inputFieldNames, derivedFieldExprs, globalCode, initCode, initPrefix,
+                           initIndent, fillCode, fillPrefix, fillIndent, weightVars, weightVarStack, tmpVarTypes):
+        raise NotImplementedError("no Numba implementation of Categorize (string-valued keys)")
+
+    def _numbaStorageSize(self):
+        raise NotImplementedError("no Numba implementation of Categorize (string-valued keys)")
+
     def _c99StructName(self):
         return "Cz" + self.value._c99StructName()
 
-    def _numpy(self, data, weights, shape):
-        q = self.quantity(data)
-        if isinstance(q, (list, tuple)):
-            q = np.array(q)
-        self._checkNPQuantity(q, shape)
+    def _numpy(self, data, weights, shape, memo):
+        # categories are shared by every Categorize on the same quantity within a fill
+        uniques, inverse = _npMemo(memo, ("Categorize", self.quantity._memoKey()),
+                                   lambda: self._npCategories(data, memo))
+        self._checkNPQuantity(inverse, shape)
 
-        if isinstance(weights, (float, int)) and weights == 1:
-            all_weights_one = True
-        elif isinstance(weights, np.ndarray) and np.all(weights == 1):
-            all_weights_one = True
-        else:
-            all_weights_one = False
         self._checkNPWeights(weights, shape)
-        weights = self._makeNPWeights(weights, shape)
-        newentries = weights.sum()
-
-        subweights = weights.copy()
-        subweights[weights < 0.0] = 0.0
-
-        if self.n_dim == 1 and all_weights_one and isinstance(self.value, Count):
-            # special case of filling single array where all weights are 1
-            uniques, counts = np.unique(q, return_counts=True)
-
+        if isinstance(weights, np.ndarray):
+            all_weights_one = np.all(weights == 1)
+        else:
+            all_weights_one = weights == 1
+        newentries = self._npWeightsSum(weights, shape)
+
+        if isinstance(self.value, Count) and self.n_dim == 1 and (
+                all_weights_one or (not isinstance(weights, np.ndarray) and self.value.transform is identity)):
+            # special case of filling single array where all weights are the same
+            counts = np.bincount(inverse, minlength=len(uniques))
+            if not all_weights_one:
+                counts = counts * weights
+
+            # new bins are cloned from one template (see Container._zeroClone)
+            template = self.value.zero()
             for c, x in zip(counts, uniques):
                 if isinstance(x, (basestring, bool)):
                     pass
                 elif x is None or np.isnan(x):
                     x = 'NaN'
                 if x not in self.bins:
-                    self.bins[x] = self.value.zero()
-                self.bins[x]._numpy(None, c, [None])
+                    self.bins[x] = template._zeroClone()
+                self.bins[x]._numpy(None, c, [None], {})
         else:
-            # all other cases ...
-            selection = np.empty(q.shape, dtype=bool)
-            uniques, inverse = np.unique(q, return_inverse=True)
-
+            # all other cases: each category is filled with only its own rows (see Container._npFillRows)
             # no possibility of exception from here on out (for rollback)
-            for i, x in enumerate(uniques):
+            template = self.value.zero()
+            for x, rows in zip(uniques, self._npPartition(inverse, len(uniques))):
                 if isinstance(x, (basestring, bool)):
                     pass
                 elif x is None or np.isnan(x):
                     x = 'NaN'
                 if x not in self.bins:
-                    self.bins[x] = self.value.zero()
+                    self.bins[x] = template._zeroClone()
 
-                # passing on the full array seems faster for one- AND multi-dim histograms
-                np.not_equal(inverse, i, selection)
-                subweights[:] = weights
-                subweights[selection] = 0.0
-                self.bins[x]._numpy(data, subweights, shape)
+                self._npFillRows(self.bins[x], data, weights, rows, shape, memo)
 
         self.entries += float(newentries)
 
+    def _npCategories(self, data, memo):
+        q = self._npQuantity(data, memo)
+        if isinstance(q, (list, tuple)):
+            q = np.array(q)
+        self._checkNPQuantity(q, [None])
+        return np.unique(q, return_inverse=True)
+
+    def _estimate(self, rows, cardinalities):
+        bins, assumed = cardinality(self, cardinalities, rows)
+        strategy = "{0:.0f} categories{1}".format(bins, " (assumed)" if assumed else "")
+        bytes = NODE_BYTES + 100 * bins
+        if isinstance(self.value, Count) and self.n_dim == 1:
+            return cost("numpy.bincount, " + strategy, 2, sort=True, calls=bins, bytes=bytes,
+                        children=[(self.value, bins, 0, 0.0)])
+        return cost("partition into " + strategy, 2, sort=True, bytes=bytes,
+                    children=[(self.value, bins, bins, rows / bins if bins > 0 else 0.0)])
+
+    def _sql(self, query, weight):
+        category = query.key(self.quantity.asSQL())
+        entries = query.aggregate("SUM({0})".format(weight))
+        fillValue = self.value._sql(query, weight)
+
+        def fill(container, keys, aggregates):
+            n = number(aggregates[entries])
+            container.entries += n
+            if n > 0.0:
+                x = keys[category]
+                if x is None or (isinstance(x, float) and math.isnan(x)):
+                    x = "NaN"
+                if x not in container.bins:
+                    container.bins[x] = container.value.zero()
+                fillValue(container.bins[x], keys, aggregates)
+        return fill
+
     def _sparksql(self, jvm, converter):
         return converter.Categorize(self.quantity.asSparkSQL(), self.value._sparksql(jvm, converter))
 
@@ -339,6 +380,13 @@ class Categorize(Factory, Container):
         """List of sub-aggregators, to make it possible to walk the tree."""
         return [self.value] + list(self.bins.values())
 
+    @property
+    def _filledChildren(self):
+        return list(self.bins.values())
+
+    def _reduceColumns(self, protocol):
+        return self._reduceColumnsOf(protocol, "bins", list(self.bins.keys()), list(self.bins.values()))
+
     @inheritdoc(Container)
     def toJsonFragment(self, suppressName):
         if isinstance(self.value, Container):
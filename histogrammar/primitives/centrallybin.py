@@ -20,6 +20,7 @@ import numbers
 import struct
 
 from histogrammar.defs import Container, Factory, identity, JsonFormatException, ContainerException
+from histogrammar.estimate import cost
 from histogrammar.util import n_dim, datatype, serializable, inheritdoc, maybeAdd, floatToJson, hasKeys, numeq, \
     floatToC99, basestring, xrange
 from histogrammar.primitives.count import Count
@@ -475,6 +476,80 @@ class CentrallyBin(Factory, Container):
             self.bins[i][1]._clingUpdate(obj, ("func", ["getValues", i]))
         self.nanflow._clingUpdate(obj, ("var", "nanflow"))
 
+    def _numbaGenerateCode(self, inputFields, inputFieldNames, derivedFieldExprs, globalCode, initCode, initPrefix,
+                           initIndent, fillCode, fillPrefix, fillIndent, weightVars, weightVarStack, tmpVarTypes):
+        normexpr = self._numbaQuantityExpr(inputFields, inputFieldNames, derivedFieldExprs, None)
+        q = "q_" + str(len(tmpVarTypes))
+        tmpVarTypes[q] = "float64"
+        midpoints = "midpoints_" + str(len(tmpVarTypes))
+        tmpVarTypes[midpoints] = "float64[:]"
+        bin = "bin_" + str(len(tmpVarTypes))
+        tmpVarTypes[bin] = "int64"
+        offset = "offset_" + str(len(tmpVarTypes))
+        tmpVarTypes[offset] = "int64"
+
+        valuesStart = 1 + self.nanflow._numbaStorageSize()
+        valueSize = self.bins[0][1]._numbaStorageSize()
+
+        # the closest center is the number of midpoints between centers that are less than or equal to q
+        globalCode.append("{0} = np.array([{1}], dtype=np.float64)".format(
+            midpoints, ", ".join(self._numbaConstant((x1 + x2)/2.0)
+                                 for (x1, _), (x2, _) in zip(self.bins[:-1], self.bins[1:]))))
+
+        initCode.append(" " * initIndent + "heap[{0}] = 0.0".format(initPrefix))
+        fillCode.append(" " * fillIndent + "{0} = {1}".format(q, normexpr))
+        fillCode.append(" " * fillIndent + "heap[{0}] += {1}".format(fillPrefix, weightVarStack[-1]))
+
+        fillCode.append(" " * fillIndent + "if math.isnan({0}):".format(q))
+        self.nanflow._numbaGenerateCode(inputFields,
+                                        inputFieldNames,
+                                        derivedFieldExprs,
+                                        globalCode,
+                                        initCode,
+                                        self._numbaExpandPrefix(initPrefix, 1),
+                                        initIndent,
+                                        fillCode,
+                                        self._numbaExpandPrefix(fillPrefix, 1),
+                                        fillIndent + 4,
+                                        weightVars,
+                                        weightVarStack,
+                                        tmpVarTypes)
+
+        initCode.append(" " * initIndent + "for {0} in range({1}):".format(bin, len(self.bins)))
+        initCode.append(" " * (initIndent + 4) + "{0} = {1} + {2} * {3}".format(
+            offset, self._numbaExpandPrefix(initPrefix, valuesStart), bin, valueSize))
+
+        fillCode.append(" " * fillIndent + "else:")
+        fillCode.append(" " * (fillIndent + 4) + "{0} = np.searchsorted({1}, {2}, side=\"right\")".format(
+            bin, midpoints, q))
+        fillCode.append(" " * (fillIndent + 4) + "{0} = {1} + {2} * {3}".format(
+            offset, self._numbaExpandPrefix(fillPrefix, valuesStart), bin, valueSize))
+
+        self.bins[0][1]._numbaGenerateCode(inputFields,
+                                           inputFieldNames,
+                                           derivedFieldExprs,
+                                           globalCode,
+                                           initCode,
+                                           offset,
+                                           initIndent + 4,
+                                           fillCode,
+                                           offset,
+                                           fillIndent + 4,
+                                           weightVars,
+                                           weightVarStack,
+                                           tmpVarTypes)
+
+    def _numbaStorageSize(self):
+        return 1 + self.nanflow._numbaStorageSize() + len(self.bins) * self.bins[0][1]._numbaStorageSize()
+
+    def _numbaUpdate(self, heap, dynamic, offset):
+        self.entries += float(heap[offset])
+        self.nanflow._numbaUpdate(heap, dynamic, offset + 1)
+        offset += 1 + self.nanflow._numbaStorageSize()
+        valueSize = self.bins[0][1]._numbaStorageSize()
+        for i, (center, sub) in enumerate(self.bins):
+            sub._numbaUpdate(heap, dynamic, offset + i * valueSize)
+
     def _c99StructName(self):
         return "Cb" + str(len(self.bins)) + self.bins[0][1]._c99StructName() + self.nanflow._c99StructName()
 
@@ -670,65 +745,57 @@ class CentrallyBin(Factory, Container):
 
         return data
 
-    def _numpy(self, data, weights, shape):
-        q = self.quantity(data)
+    def _numpy(self, data, weights, shape, memo):
+        q = self._npQuantity(data, memo)
         self._checkNPQuantity(q, shape)
         self._checkNPWeights(weights, shape)
-        weights = self._makeNPWeights(weights, shape)
-        newentries = weights.sum()
+        newentries = self._npWeightsSum(weights, shape)
 
         import numpy
 
+        # each sub-aggregator is filled with only the rows that belong to it (see Container._npFillRows)
+        q = numpy.array(q, dtype=numpy.float64)
         selection = numpy.isnan(q)
-        numpy.bitwise_not(selection, selection)
-        subweights = weights.copy()
-        subweights[selection] = 0.0
-        self.nanflow._numpy(data, subweights, shape)
+        self._npFillSelected(self.nanflow, data, weights, selection, shape, memo)
 
         # avoid nan warning in calculations by flinging the nans elsewhere
-        numpy.bitwise_not(selection, selection)
-        q = numpy.array(q, dtype=numpy.float64)
+        valid = numpy.bitwise_not(selection)
         q[selection] = 0.0
-        weights = weights.copy()
-        weights[selection] = 0.0
+
+        # bins are bounded by the midpoints between neighboring centers
+        edges = [(c1 + c2)/2.0 for (c1, v1), (c2, v2) in zip(self.bins[:-1], self.bins[1:])]
 
         if all(isinstance(v, Count) and v.transform is identity for c, v in self.bins) and numpy.all(
                 numpy.isfinite(q)) and numpy.all(numpy.isfinite(weights)):
 
-            h, _ = numpy.histogram(q, [float("-inf")] + [(c1 + c2)/2.0 for (c1, v1), (c2, v2)
-                                                         in zip(self.bins[:-1], self.bins[1:])] + [float("inf")],
-                                   weights=weights)
+            if isinstance(weights, numpy.ndarray):
+                h, _ = numpy.histogram(q[valid], [float("-inf")] + edges + [float("inf")], weights=weights[valid])
+            else:
+                h, _ = numpy.histogram(q[valid], [float("-inf")] + edges + [float("inf")])
+                h = h * weights
 
             for hi, (c, v) in zip(h, self.bins):
                 v.fill(None, float(hi))
 
         else:
-            selection = numpy.empty(q.shape, dtype=bool)
-            selection2 = numpy.empty(q.shape, dtype=bool)
+            index = numpy.searchsorted(numpy.array(edges), q, side="right")
+            index[selection] = -1
 
-            for index in xrange(len(self.bins)):
-                if index == 0:
-                    high = (self.bins[index][0] + self.bins[index + 1][0])/2.0
-                    numpy.greater_equal(q, high, selection)
-
-                elif index == len(self.bins) - 1:
-                    low = (self.bins[index - 1][0] + self.bins[index][0])/2.0
-                    numpy.less(q, low, selection)
-
-                else:
-                    low = (self.bins[index - 1][0] + self.bins[index][0])/2.0
-                    high = (self.bins[index][0] + self.bins[index + 1][0])/2.0
-                    numpy.less(q, low, selection)
-                    numpy.greater_equal(q, high, selection2)
-                    numpy.bitwise_or(selection, selection2, selection)
-
-                subweights[:] = weights
-                subweights[selection] = 0.0
-                self.bins[index][1]._numpy(data, subweights, shape)
+            for (c, v), rows in zip(self.bins, self._npPartition(index, len(self.bins))):
+                self._npFillRows(v, data, weights, rows, shape, memo)
 
         # no possibility of exception from here on out (for rollback)
         self.entries += float(newentries)
 
+    def _estimate(self, rows, cardinalities):
+        num = len(self.bins)
+        flows = [(self.nanflow, 1, 1, 0.0)]
+        if all(isinstance(v, Count) and v.transform is identity for c, v in self.bins):
+            return cost("numpy.histogram", 4, calls=num, children=flows + [(self.bins[0][1], num, 0, 0.0)])
+        filled = min(float(num), rows)
+        return cost("partition into {0} bins".format(num), 4, sort=True,
+                    children=flows + [(self.bins[0][1], num, filled, rows / filled if filled > 0 else 0.0)])
+
     def _sparksql(self, jvm, converter):
         return converter.CentrallyBin([c for c, v in self.bins], self.quantity.asSparkSQL(
         ), self.bins[0][1]._sparksql(jvm, converter), self.nanflow._sparksql(jvm, converter))
@@ -738,6 +805,9 @@ class CentrallyBin(Factory, Container):
         """List of sub-aggregators, to make it possible to walk the tree."""
         return [self.nanflow] + [v for c, v in self.bins]
 
+    def _reduceColumns(self, protocol):
+        return self._reduceColumnsOf(protocol, "bins", [c for c, v in self.bins], [v for c, v in self.bins])
+
     @inheritdoc(Container)
     def toJsonFragment(self, suppressName):
         if getattr(self.bins[0][1], "quantity", None) is not None:
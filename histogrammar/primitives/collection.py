@@ -121,6 +121,38 @@ class Collection(object):
 
         storageStructs[self._c99StructName()] = self._c99Struct()
 
+    def _numbaGenerateCode(self, inputFields, inputFieldNames, derivedFieldExprs, globalCode, initCode, initPrefix,
+                           initIndent, fillCode, fillPrefix, fillIndent, weightVars, weightVarStack, tmpVarTypes):
+        initCode.append(" " * initIndent + "heap[{0}] = 0.0".format(initPrefix))
+        fillCode.append(" " * fillIndent + "heap[{0}] += {1}".format(fillPrefix, weightVarStack[-1]))
+
+        start = 1
+        for k, v in sorted(self.pairs.items()):
+            v._numbaGenerateCode(inputFields,
+                                 inputFieldNames,
+                                 derivedFieldExprs,
+                                 globalCode,
+                                 initCode,
+                                 self._numbaExpandPrefix(initPrefix, start),
+                                 initIndent,
+                                 fillCode,
+                                 self._numbaExpandPrefix(fillPrefix, start),
+                                 fillIndent,
+                                 weightVars,
+                                 weightVarStack,
+                                 tmpVarTypes)
+            start += v._numbaStorageSize()
+
+    def _numbaStorageSize(self):
+        return 1 + sum(v._numbaStorageSize() for v in self.pairs.values())
+
+    def _numbaUpdate(self, heap, dynamic, offset):
+        self.entries += float(heap[offset])
+        offset += 1
+        for k, v in sorted(self.pairs.items()):
+            v._numbaUpdate(heap, dynamic, offset)
+            offset += v._numbaStorageSize()
+
     def _clingUpdate(self, filler, *extractorPrefix):
         obj = self._clingExpandPrefix(filler, *extractorPrefix)
         self.entries += obj.entries
@@ -482,13 +514,12 @@ class Label(Factory, Container, Collection):
             # no possibility of exception from here on out (for rollback)
             self.entries += weight
 
-    def _numpy(self, data, weights, shape):
+    def _numpy(self, data, weights, shape, memo):
         if shape[0] is not None:
             self._checkNPWeights(weights, shape)
-            weights = self._makeNPWeights(weights, shape)
 
         for x in self.values:
-            x._numpy(data, weights, shape)
+            x._numpy(data, weights, shape, memo)
 
         # no possibility of exception from here on out (for rollback)
         import numpy
@@ -721,13 +752,12 @@ class UntypedLabel(Factory, Container, Collection):
             # no possibility of exception from here on out (for rollback)
             self.entries += weight
 
-    def _numpy(self, data, weights, shape):
+    def _numpy(self, data, weights, shape, memo):
         if shape[0] is not None:
             self._checkNPWeights(weights, shape)
-            weights = self._makeNPWeights(weights, shape)
 
         for x in self.values:
-            x._numpy(data, weights, shape)
+            x._numpy(data, weights, shape, memo)
 
         # no possibility of exception from here on out (for rollback)
         import numpy
@@ -957,13 +987,12 @@ class Index(Factory, Container, Collection):
             # no possibility of exception from here on out (for rollback)
             self.entries += weight
 
-    def _numpy(self, data, weights, shape):
+    def _numpy(self, data, weights, shape, memo):
         if shape[0] is not None:
             self._checkNPWeights(weights, shape)
-            weights = self._makeNPWeights(weights, shape)
 
         for x in self.values:
-            x._numpy(data, weights, shape)
+            x._numpy(data, weights, shape, memo)
 
         # no possibility of exception from here on out (for rollback)
         import numpy
@@ -1201,13 +1230,12 @@ class Branch(Factory, Container, Collection):
             # no possibility of exception from here on out (for rollback)
             self.entries += weight
 
-    def _numpy(self, data, weights, shape):
+    def _numpy(self, data, weights, shape, memo):
         if shape[0] is not None:
             self._checkNPWeights(weights, shape)
-            weights = self._makeNPWeights(weights, shape)
 
         for x in self.values:
-            x._numpy(data, weights, shape)
+            x._numpy(data, weights, shape, memo)
 
         # no possibility of exception from here on out (for rollback)
         import numpy
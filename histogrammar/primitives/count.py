@@ -19,6 +19,7 @@ import numbers
 import struct
 
 from histogrammar.defs import Container, Factory, identity, JsonFormatException, ContainerException
+from histogrammar.sql import number
 from histogrammar.util import n_dim, datatype, serializable, inheritdoc, floatToJson, numeq
 
 
@@ -37,6 +38,8 @@ class Count(Factory, Container):
     the *weights* (always double), not *data* (any type).
     """
 
+    _pickleFields = ("entries",)
+
     @staticmethod
     def ed(entries):
         """Create a Count that is only capable of being added.
@@ -74,6 +77,10 @@ class Count(Factory, Container):
     def zero(self):
         return Count(self.transform)
 
+    def _zeroClone(self):
+        # Count isn't specialized, so its constructor is already the fast path
+        return self.zero()
+
     @inheritdoc(Container)
     def __add__(self, other):
         if isinstance(other, Count):
@@ -149,6 +156,21 @@ class Count(Factory, Container):
     def _clingUpdate(self, filler, *extractorPrefix):
         self.entries += self._clingExpandPrefix(filler, *extractorPrefix)
 
+    def _numbaGenerateCode(self, inputFields, inputFieldNames, derivedFieldExprs, globalCode, initCode, initPrefix,
+                           initIndent, fillCode, fillPrefix, fillIndent, weightVars, weightVarStack, tmpVarTypes):
+        initCode.append(" " * initIndent + "heap[{0}] = 0.0".format(initPrefix))
+        if self.transform is not identity:
+            normexpr = self._numbaQuantityExpr(inputFields, inputFieldNames, derivedFieldExprs, weightVarStack[-1])
+            fillCode.append(" " * fillIndent + "heap[{0}] += {1}".format(fillPrefix, normexpr))
+        else:
+            fillCode.append(" " * fillIndent + "heap[{0}] += {1}".format(fillPrefix, weightVarStack[-1]))
+
+    def _numbaStorageSize(self):
+        return 1
+
+    def _numbaUpdate(self, heap, dynamic, offset):
+        self.entries += float(heap[offset])
+
     def _c99StorageType(self):
         return "double"
 
@@ -207,7 +229,7 @@ class Count(Factory, Container):
     def _cudaStorageType(self):
         return "float"
 
-    def _numpy(self, _, weights, shape):
+    def _numpy(self, _, weights, shape, memo):
         import numpy
         if isinstance(weights, numpy.ndarray):
             assert len(weights.shape) == 1
@@ -217,7 +239,8 @@ class Count(Factory, Container):
             if self.transform is identity:
                 self.entries += float(weights.sum())
             else:
-                t = self.transform(weights)
+                # weights are scratch arrays that parents refill in place: bypass CachedFcn's last-call cache
+                t = self.transform._call(weights)
                 assert len(t.shape) == 1
                 if shape[0] is not None:
                     assert t.shape[0] == shape[0]
@@ -227,10 +250,11 @@ class Count(Factory, Container):
             if self.transform is identity:
                 self.entries += weights * shape[0]
             else:
-                t = self.transform(numpy.array([weights]))
+                # every one of the shape[0] rows has the same weight, so transform it once
+                t = self.transform._call(numpy.array([weights]))
                 assert len(t.shape) == 1
                 assert t.shape[0] == 1
-                self.entries += float(t[0])
+                self.entries += float(t[0]) * shape[0]
 
         elif isinstance(weights, (int, float, numpy.number)):
             if self.transform is identity:
@@ -241,6 +265,15 @@ class Count(Factory, Container):
         else:
             raise ValueError("cannot use Numpy to fill an isolated Count (unless the weights are given as an array)")
 
+    def _sql(self, query, weight):
+        if self.transform is not identity:
+            raise NotImplementedError("a Count with a transform cannot be filled by SQL")
+        entries = query.aggregate("SUM({0})".format(weight))
+
+        def fill(container, keys, aggregates):
+            container.entries += number(aggregates[entries])
+        return fill
+
     def _sparksql(self, jvm, converter):
         return converter.Count()   # TODO: handle transform
 
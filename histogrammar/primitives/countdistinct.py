@@ -0,0 +1,329 @@
+#!/usr/bin/env python
+
+# Copyright 2016 DIANA-HEP
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import math
+import numbers
+import numpy as np
+
+from histogrammar.defs import Container, Factory, identity, JsonFormatException, ContainerException
+from histogrammar.estimate import NODE_BYTES, cost
+from histogrammar.util import n_dim, datatype, serializable, inheritdoc, maybeAdd, floatToJson, hasKeys, numeq, \
+    basestring
+
+
+def _mix64(h):
+    """The splitmix64 finalizer, applied in place to an array of uint64 (multiplication wraps around)."""
+    h ^= h >> np.uint64(30)
+    h *= np.uint64(0xbf58476d1ce4e5b9)
+    h ^= h >> np.uint64(27)
+    h *= np.uint64(0x94d049bb133111eb)
+    h ^= h >> np.uint64(31)
+    return h
+
+
+def _hashes(q):
+    """64-bit hashes of an array of numbers or strings, the same in every process (unlike Python's ``hash``).
+
+    Numbers are hashed by their value as float64 (so ``1``, ``1.0`` and ``True`` are the same), strings by their
+    characters (so ``str`` and ``bytes``, and arrays of any width, agree). ``None`` is a missing value: NaN among
+    numbers and "NaN" among strings.
+    """
+    q = np.asarray(q)
+    if q.dtype.kind == "O":
+        values = q.reshape(-1).tolist()
+        if all(x is None or isinstance(x, numbers.Real) for x in values):
+            q = np.array([np.nan if x is None else x for x in values], dtype=np.float64)
+        else:
+            q = np.array(["NaN" if x is None or (isinstance(x, float) and math.isnan(x)) else x for x in values])
+    if q.ndim != 1:
+        q = q.reshape(-1)
+
+    if q.dtype.kind in "US":
+        # one column per character (code point or byte); the NUL padding of shorter strings is skipped
+        codes = np.ascontiguousarray(q).view(np.uint32 if q.dtype.kind == "U" else np.uint8)
+        codes = codes.reshape(len(q), -1) if len(q) > 0 else codes.reshape(0, 0)
+        h = np.full(len(q), 0x2545f4914f6cdd1d, dtype=np.uint64)
+        for j in range(codes.shape[1]):
+            c = codes[:, j].astype(np.uint64)
+            h = np.where(c != 0, _mix64(h ^ c), h)
+        return h
+
+    elif q.dtype.kind in "biufmM":
+        if q.dtype.kind in "mM":
+            q = q.view(np.int64)
+        x = q.astype(np.float64)
+        # +0.0 and -0.0 are the same value; all NaNs are the same value
+        x = np.where(x == 0.0, 0.0, x)
+        x[np.isnan(x)] = np.nan
+        return _mix64(x.view(np.uint64) ^ np.uint64(0x9e3779b97f4a7c15))
+
+    else:
+        raise TypeError("function return value ({0}) must be numbers or strings".format(q.dtype))
+
+
+def _bitLength(w):
+    """Number of significant bits of each element of an array of uint64 (0 for 0), computed exactly."""
+    def bitLength32(x):
+        x = x.astype(np.float64)
+        return np.where(x > 0.0, np.floor(np.log2(np.maximum(x, 1.0))) + 1.0, 0.0)
+    high = w >> np.uint64(32)
+    return np.where(high > 0, 32.0 + bitLength32(high), bitLength32(w & np.uint64(0xffffffff))).astype(np.int64)
+
+
+class CountDistinct(Factory, Container):
+    """Estimate the number of distinct values of a given quantity with a HyperLogLog sketch.
+
+    Unlike :doc:`Categorize <histogrammar.primitives.categorize.Categorize>` or
+    :doc:`Bag <histogrammar.primitives.bag.Bag>`, the memory used does not depend on the number of distinct values:
+    it is ``2**precision`` one-byte registers, and the relative error of the estimate is about
+    ``1.04 / sqrt(2**precision)`` (1.6% for the default precision of 12). Adding two CountDistincts gives the estimate
+    for the union of their data, so it can be used as a sub-aggregator, such as distinct users per time bin.
+
+    The quantity may be numbers or strings; all data with positive weight count, whatever their weight.
+    """
+
+    @staticmethod
+    def ed(entries, precision, registers):
+        """Create a CountDistinct that is only capable of being added.
+
+        Parameters:
+            entries (float): the number of entries.
+            precision (int): the base-2 logarithm of the number of registers.
+            registers (array or list of int): the HyperLogLog registers.
+        """
+        if not isinstance(entries, numbers.Real) and entries not in ("nan", "inf", "-inf"):
+            raise TypeError("entries ({0}) must be a number".format(entries))
+        if entries < 0.0:
+            raise ValueError("entries ({0}) cannot be negative".format(entries))
+        out = CountDistinct(None, precision)
+        if len(registers) != len(out.registers):
+            raise ValueError("registers must have 2**precision ({0}) elements, not {1}".format(
+                len(out.registers), len(registers)))
+        out.entries = float(entries)
+        out.registers = np.array(registers, dtype=np.uint8)
+        return out.specialize()
+
+    @staticmethod
+    def ing(quantity, precision=12):
+        """Synonym for ``__init__``."""
+        return CountDistinct(quantity, precision)
+
+    def __init__(self, quantity=identity, precision=12):
+        """Create a CountDistinct that is capable of being filled and added.
+
+        Parameters:
+            quantity (function returning float or str): computes the quantity of interest from the data.
+            precision (int): the base-2 logarithm of the number of registers, between 4 and 18.
+
+        Other parameters:
+            entries (float): the number of entries, initially 0.0.
+            registers (numpy array of uint8): the HyperLogLog registers, initially all 0.
+        """
+        if not isinstance(precision, numbers.Integral) or not 4 <= precision <= 18:
+            raise ValueError("precision ({0}) must be an integer between 4 and 18".format(precision))
+        self.quantity = serializable(identity(quantity) if isinstance(quantity, str) else quantity)
+        self.precision = int(precision)
+        self.entries = 0.0
+        self.registers = np.zeros(1 << self.precision, dtype=np.uint8)
+        super(CountDistinct, self).__init__()
+        self.specialize()
+
+    @property
+    def distinct(self):
+        """Estimated number of distinct values."""
+        m = float(len(self.registers))
+        alpha = 0.7213 / (1.0 + 1.079 / m)
+        estimate = alpha * m * m / float(np.ldexp(1.0, -self.registers.astype(np.int32)).sum())
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if estimate <= 2.5 * m and zeros > 0:
+            # small-range correction (linear counting)
+            estimate = m * math.log(m / zeros)
+        return estimate
+
+    @inheritdoc(Container)
+    def zero(self):
+        return CountDistinct(self.quantity, self.precision)
+
+    @inheritdoc(Container)
+    def __add__(self, other):
+        if isinstance(other, CountDistinct):
+            if self.precision != other.precision:
+                raise ContainerException("cannot add CountDistinct because precision differs ({0} vs {1})".format(
+                    self.precision, other.precision))
+            out = CountDistinct(self.quantity, self.precision)
+            out.entries = self.entries + other.entries
+            out.registers = np.maximum(self.registers, other.registers)
+            return out.specialize()
+        else:
+            raise ContainerException("cannot add {0} and {1}".format(self.name, other.name))
+
+    @inheritdoc(Container)
+    def __iadd__(self, other):
+        if isinstance(other, CountDistinct):
+            if self.precision != other.precision:
+                raise ContainerException("cannot add CountDistinct because precision differs ({0} vs {1})".format(
+                    self.precision, other.precision))
+            self.entries += other.entries
+            np.maximum(self.registers, other.registers, out=self.registers)
+            return self
+        else:
+            raise ContainerException("cannot add {0} and {1}".format(self.name, other.name))
+
+    @inheritdoc(Container)
+    def __mul__(self, factor):
+        if math.isnan(factor) or factor <= 0.0:
+            return self.zero()
+        else:
+            # weights do not change which values were seen
+            out = self.zero()
+            out.entries = factor * self.entries
+            out.registers = self.registers.copy()
+            return out.specialize()
+
+    @inheritdoc(Container)
+    def __rmul__(self, factor):
+        return self.__mul__(factor)
+
+    def _update(self, hashes):
+        # the first precision bits pick the register, which keeps the longest run of leading zeros (plus one) seen
+        # in the rest of the bits
+        index = (hashes >> np.uint64(64 - self.precision)).astype(np.intp)
+        rest = hashes & np.uint64((1 << (64 - self.precision)) - 1)
+        rank = (64 - self.precision + 1) - _bitLength(rest)
+        np.maximum.at(self.registers, index, rank.astype(np.uint8))
+
+    @inheritdoc(Container)
+    def fill(self, datum, weight=1.0):
+        self._checkForCrossReferences()
+
+        if weight > 0.0:
+            q = self.quantity(datum)
+            if not isinstance(q, (basestring, bytes, numbers.Real)) and q is not None:
+                raise TypeError("function return value ({0}) must be a number or a string".format(q))
+            hashes = _hashes([q])
+
+            # no possibility of exception from here on out (for rollback)
+            self._update(hashes)
+            self.entries += weight
+
+    def _cppGenerateCode(self, parser, generator, inputFieldNames, inputFieldTypes, derivedFieldTypes,
+                         derivedFieldExprs, storageStructs, initCode, initPrefix, initIndent, fillCode, fillPrefix,
+                         fillIndent, weightVars, weightVarStack, tmpVarTypes):
+        raise NotImplementedError("no C++ implementation of CountDistinct")
+
+    def _c99GenerateCode(self, parser, generator, inputFieldNames, inputFieldTypes, derivedFieldTypes,
+                         derivedFieldExprs, storageStructs, initCode, initPrefix, initIndent, fillCode, fillPrefix,
+                         fillIndent, weightVars, weightVarStack, tmpVarTypes):
+        raise NotImplementedError("no C99-compliant implementation of CountDistinct")
+
+    def _numbaGenerateCode(self, inputFields, inputFieldNames, derivedFieldExprs, globalCode, initCode, initPrefix,
+                           initIndent, fillCode, fillPrefix, fillIndent, weightVars, weightVarStack, tmpVarTypes):
+        raise NotImplementedError("no Numba implementation of CountDistinct")
+
+    def _numbaStorageSize(self):
+        raise NotImplementedError("no Numba implementation of CountDistinct")
+
+    def _numpy(self, data, weights, shape, memo):
+        q = self._npQuantity(data, memo)
+        if isinstance(q, (list, tuple)):
+            q = np.array(q)
+        self._checkNPQuantity(q, shape)
+        self._checkNPWeights(weights, shape)
+        newentries = self._npWeightsSum(weights, shape)
+
+        if isinstance(weights, np.ndarray):
+            hashes = _hashes(q[weights > 0.0])
+        elif weights > 0.0:
+            hashes = _hashes(q)
+        else:
+            hashes = _hashes(q[:0])
+
+        # no possibility of exception from here on out (for rollback)
+        self._update(hashes)
+        self.entries += float(newentries)
+
+    def _estimate(self, rows, cardinalities):
+        return cost("hash into {0} registers".format(len(self.registers)), 6, bytes=NODE_BYTES + len(self.registers))
+
+    def _sparksql(self, jvm, converter):
+        raise NotImplementedError("no SparkSQL implementation of CountDistinct")
+
+    @property
+    def children(self):
+        """List of sub-aggregators, to make it possible to walk the tree."""
+        return []
+
+    @inheritdoc(Container)
+    def toJsonFragment(self, suppressName):
+        return maybeAdd({"entries": floatToJson(self.entries),
+                         "precision": self.precision,
+                         "registers": self.registers.tobytes().hex()},
+                        name=(None if suppressName else self.quantity.name))
+
+    @staticmethod
+    @inheritdoc(Factory)
+    def fromJsonFragment(json, nameFromParent):
+        if isinstance(json, dict) and hasKeys(json.keys(), ["entries", "precision", "registers"], ["name"]):
+            if json["entries"] in ("nan", "inf", "-inf") or isinstance(json["entries"], numbers.Real):
+                entries = float(json["entries"])
+            else:
+                raise JsonFormatException(json["entries"], "CountDistinct.entries")
+
+            if isinstance(json["precision"], numbers.Integral):
+                precision = json["precision"]
+            else:
+                raise JsonFormatException(json["precision"], "CountDistinct.precision")
+
+            if isinstance(json.get("name", None), basestring):
+                name = json["name"]
+            elif json.get("name", None) is None:
+                name = None
+            else:
+                raise JsonFormatException(json["name"], "CountDistinct.name")
+
+            try:
+                registers = np.frombuffer(bytes.fromhex(json["registers"]), dtype=np.uint8)
+            except (TypeError, ValueError):
+                raise JsonFormatException(json["registers"], "CountDistinct.registers")
+
+            out = CountDistinct.ed(entries, precision, registers)
+            out.quantity.name = nameFromParent if name is None else name
+            return out.specialize()
+
+        else:
+            raise JsonFormatException(json, "CountDistinct")
+
+    def __repr__(self):
+        return "<CountDistinct distinct={0} precision={1}>".format(self.distinct, self.precision)
+
+    def __eq__(self, other):
+        return isinstance(other, CountDistinct) and numeq(self.entries, other.entries) and \
+            self.quantity == other.quantity and self.precision == other.precision and \
+            np.array_equal(self.registers, other.registers)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((self.entries, self.quantity, self.precision, self.registers.tobytes()))
+
+
+# extra properties: number of dimensions and datatypes of sub-hists
+CountDistinct.n_dim = n_dim
+CountDistinct.datatype = datatype
+
+# register extra methods such as plotting
+Factory.register(CountDistinct)
@@ -20,6 +20,7 @@ import numbers
 import struct
 
 from histogrammar.defs import Container, Factory, identity, JsonFormatException, ContainerException
+from histogrammar.sql import number
 from histogrammar.util import n_dim, datatype, serializable, inheritdoc, maybeAdd, floatToJson, hasKeys, numeq, \
     basestring
 
@@ -35,6 +36,8 @@ class Deviate(Factory, Container):
     *Univeristy of Cambridge Computing Service,* 2009.
     """
 
+    _pickleFields = ("entries", "mean", "varianceTimesEntries")
+
     @staticmethod
     def ed(entries, mean, variance):
         """Create a Deviate that is only capable of being added.
@@ -268,6 +271,73 @@ class Deviate(Factory, Container):
         self.mean = mean
         self.varianceTimesEntries = varianceTimesEntries
 
+    def _numbaGenerateCode(self, inputFields, inputFieldNames, derivedFieldExprs, globalCode, initCode, initPrefix,
+                           initIndent, fillCode, fillPrefix, fillIndent, weightVars, weightVarStack, tmpVarTypes):
+        initCode.append(" " * initIndent + "heap[{0}] = 0.0".format(initPrefix))
+        initCode.append(" " * initIndent + "heap[{0}] = 0.0".format(self._numbaExpandPrefix(initPrefix, 1)))
+        initCode.append(" " * initIndent + "heap[{0}] = 0.0".format(self._numbaExpandPrefix(initPrefix, 2)))
+
+        normexpr = self._numbaQuantityExpr(inputFields, inputFieldNames, derivedFieldExprs, None)
+        q = "q_" + str(len(tmpVarTypes))
+        tmpVarTypes[q] = "float64"
+        delta = "delta_" + str(len(tmpVarTypes))
+        tmpVarTypes[delta] = "float64"
+
+        fillCode.append("""{indent}{q} = {normexpr}
+{indent}if {entries} == 0.0:
+{indent}    {mean} = {q}
+{indent}    {varianceTimesEntries} = 0.0
+{indent}{entries} += {weight}
+{indent}if math.isnan({mean}) or math.isnan({q}):
+{indent}    {mean} = math.nan
+{indent}    {varianceTimesEntries} = math.nan
+{indent}elif math.isinf({mean}) or math.isinf({q}):
+{indent}    if math.isinf({mean}) and math.isinf({q}) and {mean} * {q} < 0.0:
+{indent}        {mean} = math.nan
+{indent}    elif math.isinf({q}):
+{indent}        {mean} = {q}
+{indent}    if math.isinf({entries}) or math.isnan({entries}):
+{indent}        {mean} = math.nan
+{indent}    {varianceTimesEntries} = math.nan
+{indent}else:
+{indent}    {delta} = {q} - {mean}
+{indent}    {mean} += {delta} * {weight} / {entries}
+{indent}    {varianceTimesEntries} += {weight} * {delta} * ({q} - {mean})""".format(
+            indent=" " * fillIndent,
+            q=q,
+            delta=delta,
+            normexpr=normexpr,
+            entries="heap[{0}]".format(fillPrefix),
+            mean="heap[{0}]".format(self._numbaExpandPrefix(fillPrefix, 1)),
+            varianceTimesEntries="heap[{0}]".format(self._numbaExpandPrefix(fillPrefix, 2)),
+            weight=weightVarStack[-1]))
+
+    def _numbaStorageSize(self):
+        return 3
+
+    def _numbaUpdate(self, heap, dynamic, offset):
+        otherEntries = float(heap[offset])
+        otherMean = float(heap[offset + 1])
+        otherVarianceTimesEntries = float(heap[offset + 2])
+
+        entries = self.entries + otherEntries
+        if self.entries == 0.0:
+            mean = otherMean
+            varianceTimesEntries = otherVarianceTimesEntries
+        elif otherEntries == 0.0:
+            mean = self.mean
+            varianceTimesEntries = self.varianceTimesEntries
+        else:
+            mean = (self.entries*self.mean + otherEntries * otherMean) / (self.entries + otherEntries)
+            varianceTimesEntries = self.varianceTimesEntries + otherVarianceTimesEntries + \
+                self.entries * self.mean * self.mean + otherEntries * otherMean * otherMean - \
+                2.0 * mean * (self.entries * self.mean + otherEntries * otherMean) + \
+                mean * mean * entries
+
+        self.entries = entries
+        self.mean = mean
+        self.varianceTimesEntries = varianceTimesEntries
+
     def _c99StructName(self):
         return "Dv"
 
@@ -426,11 +496,10 @@ class Deviate(Factory, Container):
         self.variance = variance
         return data[struct.calcsize(format):]
 
-    def _numpy(self, data, weights, shape):
-        q = self.quantity(data)
+    def _numpy(self, data, weights, shape, memo):
+        q = self._npQuantity(data, memo)
         self._checkNPQuantity(q, shape)
         self._checkNPWeights(weights, shape)
-        weights = self._makeNPWeights(weights, shape)
 
         # no possibility of exception from here on out (for rollback)
         ca, ma, sa = self.entries, self.mean, self.varianceTimesEntries
@@ -439,11 +508,17 @@ class Deviate(Factory, Container):
             sa = 0.0
 
         import numpy
-        selection = weights > 0.0
-        q = q[selection]
-        weights = weights[selection]
-
-        self.entries += float(weights.sum())
+        if isinstance(weights, numpy.ndarray):
+            selection = weights > 0.0
+            q = q[selection]
+            weights = weights[selection]
+            self.entries += float(weights.sum())
+        elif weights > 0.0 and len(q) > 0:
+            # a scalar weight drops out of the weighted averages
+            self.entries += float(weights * len(q))
+            weights = None
+        else:
+            return
         ca_plus_cb = self.entries
 
         if math.isinf(ca_plus_cb):
@@ -458,6 +533,24 @@ class Deviate(Factory, Container):
             self.varianceTimesEntries = float(sa + sb + ca*ma*ma + cb*mb*mb - 2.0 *
                                               self.mean*(ca*ma + cb*mb) + self.mean*self.mean*ca_plus_cb)
 
+    def _sql(self, query, weight):
+        q = self.quantity.asSQL()
+        entries = query.aggregate("SUM({0})".format(weight))
+        # the mean and variance are over the rows with a quantity
+        sumw = query.aggregate("SUM(CASE WHEN {0} IS NULL THEN 0 ELSE {1} END)".format(q, weight))
+        sumwq = query.aggregate("SUM({0} * {1})".format(weight, q))
+        sumwqq = query.aggregate("SUM({0} * {1} * {1})".format(weight, q))
+
+        def fill(container, keys, aggregates):
+            w = number(aggregates[sumw])
+            if w > 0.0:
+                mean = number(aggregates[sumwq]) / w
+                variance = max(number(aggregates[sumwqq]) / w - mean * mean, 0.0)
+            else:
+                mean = variance = float("nan")
+            container += Deviate.ed(number(aggregates[entries]), mean, variance)
+        return fill
+
     def _sparksql(self, jvm, converter):
         return converter.Deviate(self.quantity.asSparkSQL())
 
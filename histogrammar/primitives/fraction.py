@@ -261,6 +261,54 @@ class Fraction(Factory, Container):
         self.numerator._clingUpdate(obj, ("var", "numerator"))
         self.denominator._clingUpdate(obj, ("var", "denominator"))
 
+    def _numbaGenerateCode(self, inputFields, inputFieldNames, derivedFieldExprs, globalCode, initCode, initPrefix,
+                           initIndent, fillCode, fillPrefix, fillIndent, weightVars, weightVarStack, tmpVarTypes):
+        initCode.append(" " * initIndent + "heap[{0}] = 0.0".format(initPrefix))
+
+        normexpr = self._numbaQuantityExpr(inputFields, inputFieldNames, derivedFieldExprs, None)
+        denominatorStart = 1 + self.numerator._numbaStorageSize()
+
+        fillCode.append(" " * fillIndent + "heap[{0}] += {1}".format(fillPrefix, weightVarStack[-1]))
+        self.denominator._numbaGenerateCode(inputFields,
+                                            inputFieldNames,
+                                            derivedFieldExprs,
+                                            globalCode,
+                                            initCode,
+                                            self._numbaExpandPrefix(initPrefix, denominatorStart),
+                                            initIndent,
+                                            fillCode,
+                                            self._numbaExpandPrefix(fillPrefix, denominatorStart),
+                                            fillIndent,
+                                            weightVars,
+                                            weightVarStack,
+                                            tmpVarTypes)
+
+        weightVars.append("weight_" + str(len(weightVars)))
+        weightVarStack = weightVarStack + (weightVars[-1],)
+        fillCode.append(" " * fillIndent + "{0} = {1} * {2}".format(weightVarStack[-1], weightVarStack[-2], normexpr))
+        fillCode.append(" " * fillIndent + "if {0} > 0.0:".format(weightVarStack[-1]))
+        self.numerator._numbaGenerateCode(inputFields,
+                                          inputFieldNames,
+                                          derivedFieldExprs,
+                                          globalCode,
+                                          initCode,
+                                          self._numbaExpandPrefix(initPrefix, 1),
+                                          initIndent,
+                                          fillCode,
+                                          self._numbaExpandPrefix(fillPrefix, 1),
+                                          fillIndent + 4,
+                                          weightVars,
+                                          weightVarStack,
+                                          tmpVarTypes)
+
+    def _numbaStorageSize(self):
+        return 1 + self.numerator._numbaStorageSize() + self.denominator._numbaStorageSize()
+
+    def _numbaUpdate(self, heap, dynamic, offset):
+        self.entries += float(heap[offset])
+        self.numerator._numbaUpdate(heap, dynamic, offset + 1)
+        self.denominator._numbaUpdate(heap, dynamic, offset + 1 + self.numerator._numbaStorageSize())
+
     def _c99StructName(self):
         return "Fr" + self.denominator._c99StructName()
 
@@ -403,22 +451,26 @@ class Fraction(Factory, Container):
         data = self.numerator._cudaUnpackAndFill(data, bigendian, alignment)
         return data
 
-    def _numpy(self, data, weights, shape):
-        w = self.quantity(data)
+    def _numpy(self, data, weights, shape, memo):
+        w = self._npQuantity(data, memo)
         self._checkNPQuantity(w, shape)
         self._checkNPWeights(weights, shape)
-        weights = self._makeNPWeights(weights, shape)
 
         import numpy
-        w = w * weights
-        w[numpy.isnan(w)] = 0.0
-        w[w < 0.0] = 0.0
+        if not isinstance(weights, numpy.ndarray) and weights > 0.0 and getattr(w, "dtype", None) == numpy.bool_:
+            # a boolean cut with a scalar weight just selects rows
+            self._npFillSelected(self.numerator, data, weights, w, shape, memo)
+        else:
+            w = numpy.multiply(w, weights, dtype=numpy.float64)
+            w[numpy.isnan(w)] = 0.0
+            w[w < 0.0] = 0.0
 
-        self.numerator._numpy(data, w, shape)
-        self.denominator._numpy(data, weights, shape)
+            # only the rows that pass the cut are passed on (see Container._npFillRows)
+            self._npFillRows(self.numerator, data, w, numpy.flatnonzero(w), shape, memo)
+        self.denominator._numpy(data, weights, shape, memo)
 
         # no possibility of exception from here on out (for rollback)
-        self.entries += float(weights.sum())
+        self.entries += self._npWeightsSum(weights, shape)
 
     def _sparksql(self, jvm, converter):
         return converter.Fraction(self.quantity.asSparkSQL(), self.numerator._sparksql(jvm, converter))
@@ -21,6 +21,7 @@ import struct
 import bisect
 
 from histogrammar.defs import Container, Factory, identity, JsonFormatException, ContainerException
+from histogrammar.estimate import cost
 from histogrammar.util import n_dim, datatype, serializable, inheritdoc, maybeAdd, floatToJson, hasKeys, numeq, \
     floatToC99, basestring, xrange
 from histogrammar.primitives.count import Count
@@ -428,6 +429,78 @@ class IrregularlyBin(Factory, Container):
             self.bins[i][1]._clingUpdate(obj, ("func", ["getValues", i]))
         self.nanflow._clingUpdate(obj, ("var", "nanflow"))
 
+    def _numbaGenerateCode(self, inputFields, inputFieldNames, derivedFieldExprs, globalCode, initCode, initPrefix,
+                           initIndent, fillCode, fillPrefix, fillIndent, weightVars, weightVarStack, tmpVarTypes):
+        normexpr = self._numbaQuantityExpr(inputFields, inputFieldNames, derivedFieldExprs, None)
+        q = "q_" + str(len(tmpVarTypes))
+        tmpVarTypes[q] = "float64"
+        edges = "edges_" + str(len(tmpVarTypes))
+        tmpVarTypes[edges] = "float64[:]"
+        bin = "bin_" + str(len(tmpVarTypes))
+        tmpVarTypes[bin] = "int64"
+        offset = "offset_" + str(len(tmpVarTypes))
+        tmpVarTypes[offset] = "int64"
+
+        valuesStart = 1 + self.nanflow._numbaStorageSize()
+        valueSize = self.bins[0][1]._numbaStorageSize()
+
+        globalCode.append("{0} = np.array([{1}], dtype=np.float64)".format(
+            edges, ", ".join(self._numbaConstant(low) for low, sub in self.bins)))
+
+        initCode.append(" " * initIndent + "heap[{0}] = 0.0".format(initPrefix))
+        fillCode.append(" " * fillIndent + "{0} = {1}".format(q, normexpr))
+        fillCode.append(" " * fillIndent + "heap[{0}] += {1}".format(fillPrefix, weightVarStack[-1]))
+
+        fillCode.append(" " * fillIndent + "if math.isnan({0}):".format(q))
+        self.nanflow._numbaGenerateCode(inputFields,
+                                        inputFieldNames,
+                                        derivedFieldExprs,
+                                        globalCode,
+                                        initCode,
+                                        self._numbaExpandPrefix(initPrefix, 1),
+                                        initIndent,
+                                        fillCode,
+                                        self._numbaExpandPrefix(fillPrefix, 1),
+                                        fillIndent + 4,
+                                        weightVars,
+                                        weightVarStack,
+                                        tmpVarTypes)
+
+        initCode.append(" " * initIndent + "for {0} in range({1}):".format(bin, len(self.bins)))
+        initCode.append(" " * (initIndent + 4) + "{0} = {1} + {2} * {3}".format(
+            offset, self._numbaExpandPrefix(initPrefix, valuesStart), bin, valueSize))
+
+        fillCode.append(" " * fillIndent + "else:")
+        fillCode.append(" " * (fillIndent + 4) + "{0} = np.searchsorted({1}, {2}, side=\"right\") - 1".format(
+            bin, edges, q))
+        fillCode.append(" " * (fillIndent + 4) + "{0} = {1} + {2} * {3}".format(
+            offset, self._numbaExpandPrefix(fillPrefix, valuesStart), bin, valueSize))
+
+        self.bins[0][1]._numbaGenerateCode(inputFields,
+                                           inputFieldNames,
+                                           derivedFieldExprs,
+                                           globalCode,
+                                           initCode,
+                                           offset,
+                                           initIndent + 4,
+                                           fillCode,
+                                           offset,
+                                           fillIndent + 4,
+                                           weightVars,
+                                           weightVarStack,
+                                           tmpVarTypes)
+
+    def _numbaStorageSize(self):
+        return 1 + self.nanflow._numbaStorageSize() + len(self.bins) * self.bins[0][1]._numbaStorageSize()
+
+    def _numbaUpdate(self, heap, dynamic, offset):
+        self.entries += float(heap[offset])
+        self.nanflow._numbaUpdate(heap, dynamic, offset + 1)
+        offset += 1 + self.nanflow._numbaStorageSize()
+        valueSize = self.bins[0][1]._numbaStorageSize()
+        for i, (low, sub) in enumerate(self.bins):
+            sub._numbaUpdate(heap, dynamic, offset + i * valueSize)
+
     def _c99StructName(self):
         return "Ir" + str(len(self.bins)) + self.bins[0][1]._c99StructName() + self.nanflow._c99StructName()
 
@@ -624,48 +697,38 @@ class IrregularlyBin(Factory, Container):
 
         return data
 
-    def _numpy(self, data, weights, shape):
-        q = self.quantity(data)
+    def _numpy(self, data, weights, shape, memo):
+        q = self._npQuantity(data, memo)
         self._checkNPQuantity(q, shape)
         self._checkNPWeights(weights, shape)
-        weights = self._makeNPWeights(weights, shape)
-        newentries = weights.sum()
+        newentries = self._npWeightsSum(weights, shape)
 
         import numpy
 
-        selection = numpy.isnan(q)
-        numpy.bitwise_not(selection, selection)
-        subweights = weights.copy()
-        subweights[selection] = 0.0
-        self.nanflow._numpy(data, subweights, shape)
-
-        # avoid nan warning in calculations by flinging the nans elsewhere
-        numpy.bitwise_not(selection, selection)
+        # each sub-aggregator is filled with only the rows that belong to it (see Container._npFillRows)
         q = numpy.array(q, dtype=numpy.float64)
-        q[selection] = float("-inf")
-        weights = weights.copy()
-        weights[selection] = 0.0
+        selection = numpy.isnan(q)
+        self._npFillSelected(self.nanflow, data, weights, selection, shape, memo)
 
         # FIXME: the case of all Counts could be optimized with numpy.histogram (see CentrallyBin for an example)
 
-        selection = numpy.empty(q.shape, dtype=bool)
-        selection2 = numpy.empty(q.shape, dtype=bool)
-        subweights = weights.copy()
-        for (low, sub), (high, _) in zip(self.bins, self.bins[1:] + ((float("nan"), None),)):
-            numpy.greater_equal(q, low, selection)
-            numpy.greater_equal(q, high, selection2)
-            numpy.bitwise_not(selection2, selection2)
-            numpy.bitwise_and(selection, selection2, selection)
-            numpy.bitwise_not(selection, selection)
-
-            subweights[:] = weights
-            subweights[selection] = 0.0
+        # each bin runs from its low edge up to the next bin's low edge
+        index = numpy.searchsorted(numpy.array([low for low, sub in self.bins]), q, side="right") - 1
+        index[selection] = -1
 
-            sub._numpy(data, subweights, shape)
+        for (low, sub), rows in zip(self.bins, self._npPartition(index, len(self.bins))):
+            self._npFillRows(sub, data, weights, rows, shape, memo)
 
         # no possibility of exception from here on out (for rollback)
         self.entries += float(newentries)
 
+    def _estimate(self, rows, cardinalities):
+        num = len(self.bins)
+        filled = min(float(num), rows)
+        return cost("partition into {0} bins".format(num), 4, sort=True,
+                    children=[(self.nanflow, 1, 1, 0.0),
+                              (self.bins[0][1], num, filled, rows / filled if filled > 0 else 0.0)])
+
     def _sparksql(self, jvm, converter):
         return converter.IrregularlyBin([e for e, v in self.bins[1:]], self.quantity.asSparkSQL(
         ), self.bins[0][1]._sparksql(jvm, converter), self.nanflow._sparksql(jvm, converter))
@@ -675,6 +738,9 @@ class IrregularlyBin(Factory, Container):
         """List of sub-aggregators, to make it possible to walk the tree."""
         return [self.nanflow] + self.values
 
+    def _reduceColumns(self, protocol):
+        return self._reduceColumnsOf(protocol, "bins", [k for k, v in self.bins], [v for k, v in self.bins])
+
     @inheritdoc(Container)
     def toJsonFragment(self, suppressName):
         if getattr(self.bins[0][1], "quantity", None) is not None:
@@ -20,6 +20,7 @@ import numbers
 import struct
 
 from histogrammar.defs import Container, Factory, identity, JsonFormatException, ContainerException
+from histogrammar.sql import extremum, number
 from histogrammar.util import n_dim, datatype, serializable, inheritdoc, maybeAdd, floatToJson, hasKeys, numeq, \
     basestring, minplus, maxplus
 
@@ -27,6 +28,8 @@ from histogrammar.util import n_dim, datatype, serializable, inheritdoc, maybeAd
 class Minimize(Factory, Container):
     """Find the minimum value of a given quantity. If no data are observed, the result is NaN."""
 
+    _pickleFields = ("entries", "min")
+
     @staticmethod
     def ed(entries, min):
         """Create a Minimize that is only capable of being added.
@@ -161,6 +164,28 @@ class Minimize(Factory, Container):
         self.entries = self.entries + obj.entries
         self.min = minplus(self.min, obj.min)
 
+    def _numbaGenerateCode(self, inputFields, inputFieldNames, derivedFieldExprs, globalCode, initCode, initPrefix,
+                           initIndent, fillCode, fillPrefix, fillIndent, weightVars, weightVarStack, tmpVarTypes):
+        initCode.append(" " * initIndent + "heap[{0}] = 0.0".format(initPrefix))
+        initCode.append(" " * initIndent + "heap[{0}] = math.nan".format(self._numbaExpandPrefix(initPrefix, 1)))
+
+        normexpr = self._numbaQuantityExpr(inputFields, inputFieldNames, derivedFieldExprs, None)
+        q = "q_" + str(len(tmpVarTypes))
+        tmpVarTypes[q] = "float64"
+
+        fillCode.append(" " * fillIndent + "{0} = {1}".format(q, normexpr))
+        fillCode.append(" " * fillIndent + "heap[{0}] += {1}".format(fillPrefix, weightVarStack[-1]))
+        fillCode.append(" " * fillIndent + "if math.isnan({min}) or {q} < {min}:".format(
+            min="heap[{0}]".format(self._numbaExpandPrefix(fillPrefix, 1)), q=q))
+        fillCode.append(" " * fillIndent + "    heap[{0}] = {1}".format(self._numbaExpandPrefix(fillPrefix, 1), q))
+
+    def _numbaStorageSize(self):
+        return 2
+
+    def _numbaUpdate(self, heap, dynamic, offset):
+        self.entries += float(heap[offset])
+        self.min = minplus(self.min, float(heap[offset + 1]))
+
     def _c99StructName(self):
         return "Mn"
 
@@ -264,20 +289,22 @@ class Minimize(Factory, Container):
         self.min = minplus(self.min, objmin)
         return data[struct.calcsize(format):]
 
-    def _numpy(self, data, weights, shape):
-        q = self.quantity(data)
+    def _numpy(self, data, weights, shape, memo):
+        q = self._npQuantity(data, memo)
         self._checkNPQuantity(q, shape)
         self._checkNPWeights(weights, shape)
-        weights = self._makeNPWeights(weights, shape)
 
         # no possibility of exception from here on out (for rollback)
         import numpy
         selection = numpy.isnan(q)
         numpy.bitwise_not(selection, selection)
-        numpy.bitwise_and(selection, weights > 0.0, selection)
+        if isinstance(weights, numpy.ndarray):
+            numpy.bitwise_and(selection, weights > 0.0, selection)
+        elif not weights > 0.0:
+            selection[:] = False
         q = q[selection]
 
-        self.entries += float(weights.sum())
+        self.entries += self._npWeightsSum(weights, shape)
 
         if math.isnan(self.min):
             if q.shape[0] > 0:
@@ -286,6 +313,15 @@ class Minimize(Factory, Container):
             if q.shape[0] > 0:
                 self.min = min(self.min, float(q.min()))
 
+    def _sql(self, query, weight):
+        entries = query.aggregate("SUM({0})".format(weight))
+        least = query.aggregate("MIN(CASE WHEN {0} > 0 THEN {1} END)".format(weight, self.quantity.asSQL()))
+
+        def fill(container, keys, aggregates):
+            container.entries += number(aggregates[entries])
+            container.min = minplus(container.min, extremum(aggregates[least]))
+        return fill
+
     def _sparksql(self, jvm, converter):
         return converter.Minimize(self.quantity.asSparkSQL())
 
@@ -347,6 +383,8 @@ Factory.register(Minimize)
 class Maximize(Factory, Container):
     """Find the maximum value of a given quantity. If no data are observed, the result is NaN."""
 
+    _pickleFields = ("entries", "max")
+
     @staticmethod
     def ed(entries, max):
         """Create a Maximize that is only capable of being added.
@@ -476,6 +514,28 @@ class Maximize(Factory, Container):
         self.entries = self.entries + obj.entries
         self.max = maxplus(self.max, obj.max)
 
+    def _numbaGenerateCode(self, inputFields, inputFieldNames, derivedFieldExprs, globalCode, initCode, initPrefix,
+                           initIndent, fillCode, fillPrefix, fillIndent, weightVars, weightVarStack, tmpVarTypes):
+        initCode.append(" " * initIndent + "heap[{0}] = 0.0".format(initPrefix))
+        initCode.append(" " * initIndent + "heap[{0}] = math.nan".format(self._numbaExpandPrefix(initPrefix, 1)))
+
+        normexpr = self._numbaQuantityExpr(inputFields, inputFieldNames, derivedFieldExprs, None)
+        q = "q_" + str(len(tmpVarTypes))
+        tmpVarTypes[q] = "float64"
+
+        fillCode.append(" " * fillIndent + "{0} = {1}".format(q, normexpr))
+        fillCode.append(" " * fillIndent + "heap[{0}] += {1}".format(fillPrefix, weightVarStack[-1]))
+        fillCode.append(" " * fillIndent + "if math.isnan({max}) or {q} > {max}:".format(
+            max="heap[{0}]".format(self._numbaExpandPrefix(fillPrefix, 1)), q=q))
+        fillCode.append(" " * fillIndent + "    heap[{0}] = {1}".format(self._numbaExpandPrefix(fillPrefix, 1), q))
+
+    def _numbaStorageSize(self):
+        return 2
+
+    def _numbaUpdate(self, heap, dynamic, offset):
+        self.entries += float(heap[offset])
+        self.max = maxplus(self.max, float(heap[offset + 1]))
+
     def _c99StructName(self):
         return "Mx"
 
@@ -579,20 +639,22 @@ class Maximize(Factory, Container):
         self.max = maxplus(self.max, objmax)
         return data[struct.calcsize(format):]
 
-    def _numpy(self, data, weights, shape):
-        q = self.quantity(data)
+    def _numpy(self, data, weights, shape, memo):
+        q = self._npQuantity(data, memo)
         self._checkNPQuantity(q, shape)
         self._checkNPWeights(weights, shape)
-        weights = self._makeNPWeights(weights, shape)
 
         # no possibility of exception from here on out (for rollback)
         import numpy
         selection = numpy.isnan(q)
         numpy.bitwise_not(selection, selection)
-        numpy.bitwise_and(selection, weights > 0.0, selection)
+        if isinstance(weights, numpy.ndarray):
+            numpy.bitwise_and(selection, weights > 0.0, selection)
+        elif not weights > 0.0:
+            selection[:] = False
         q = q[selection]
 
-        self.entries += float(weights.sum())
+        self.entries += self._npWeightsSum(weights, shape)
 
         if math.isnan(self.max):
             if q.shape[0] > 0:
@@ -601,6 +663,15 @@ class Maximize(Factory, Container):
             if q.shape[0] > 0:
                 self.max = max(self.max, float(q.max()))
 
+    def _sql(self, query, weight):
+        entries = query.aggregate("SUM({0})".format(weight))
+        greatest = query.aggregate("MAX(CASE WHEN {0} > 0 THEN {1} END)".format(weight, self.quantity.asSQL()))
+
+        def fill(container, keys, aggregates):
+            container.entries += number(aggregates[entries])
+            container.max = maxplus(container.max, extremum(aggregates[greatest]))
+        return fill
+
     def _sparksql(self, jvm, converter):
         return converter.Maximize(self.quantity.asSparkSQL())
 
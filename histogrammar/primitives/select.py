@@ -20,6 +20,7 @@ import numbers
 import struct
 
 from histogrammar.defs import Container, Factory, identity, JsonFormatException, ContainerException
+from histogrammar.sql import number
 from histogrammar.util import n_dim, datatype, serializable, inheritdoc, maybeAdd, floatToJson, hasKeys, numeq, \
     basestring
 from histogrammar.primitives.count import Count
@@ -211,6 +212,39 @@ class Select(Factory, Container):
         self.entries += obj.entries
         self.cut._clingUpdate(obj, ("var", "cut"))
 
+    def _numbaGenerateCode(self, inputFields, inputFieldNames, derivedFieldExprs, globalCode, initCode, initPrefix,
+                           initIndent, fillCode, fillPrefix, fillIndent, weightVars, weightVarStack, tmpVarTypes):
+        initCode.append(" " * initIndent + "heap[{0}] = 0.0".format(initPrefix))
+
+        normexpr = self._numbaQuantityExpr(inputFields, inputFieldNames, derivedFieldExprs, None)
+
+        weightVars.append("weight_" + str(len(weightVars)))
+        weightVarStack = weightVarStack + (weightVars[-1],)
+        fillCode.append(" " * fillIndent + "{0} = {1} * {2}".format(weightVarStack[-1], weightVarStack[-2], normexpr))
+        fillCode.append(" " * fillIndent + "heap[{0}] += {1}".format(fillPrefix, weightVarStack[-2]))
+        fillCode.append(" " * fillIndent + "if {0} > 0.0:".format(weightVarStack[-1]))
+
+        self.cut._numbaGenerateCode(inputFields,
+                                    inputFieldNames,
+                                    derivedFieldExprs,
+                                    globalCode,
+                                    initCode,
+                                    self._numbaExpandPrefix(initPrefix, 1),
+                                    initIndent,
+                                    fillCode,
+                                    self._numbaExpandPrefix(fillPrefix, 1),
+                                    fillIndent + 4,
+                                    weightVars,
+                                    weightVarStack,
+                                    tmpVarTypes)
+
+    def _numbaStorageSize(self):
+        return 1 + self.cut._numbaStorageSize()
+
+    def _numbaUpdate(self, heap, dynamic, offset):
+        self.entries += float(heap[offset])
+        self.cut._numbaUpdate(heap, dynamic, offset + 1)
+
     def _c99StructName(self):
         return "Se" + self.cut._c99StructName()
 
@@ -309,21 +343,34 @@ class Select(Factory, Container):
         data = self.cut._cudaUnpackAndFill(data, bigendian, alignment)
         return data
 
-    def _numpy(self, data, weights, shape):
-        w = self.quantity(data)
+    def _numpy(self, data, weights, shape, memo):
+        w = self._npQuantity(data, memo)
         self._checkNPQuantity(w, shape)
         self._checkNPWeights(weights, shape)
-        weights = self._makeNPWeights(weights, shape)
 
         import numpy
-        w = w * weights
-        w[numpy.isnan(w)] = 0.0
-        w[w < 0.0] = 0.0
+        if not isinstance(weights, numpy.ndarray) and weights > 0.0 and getattr(w, "dtype", None) == numpy.bool_:
+            # a boolean cut with a scalar weight just selects rows
+            self._npFillSelected(self.cut, data, weights, w, shape, memo)
+        else:
+            w = numpy.multiply(w, weights, dtype=numpy.float64)
+            w[numpy.isnan(w)] = 0.0
+            w[w < 0.0] = 0.0
 
-        self.cut._numpy(data, w, shape)
+            # only the rows that pass the cut are passed on (see Container._npFillRows)
+            self._npFillRows(self.cut, data, w, numpy.flatnonzero(w), shape, memo)
 
         # no possibility of exception from here on out (for rollback)
-        self.entries += float(weights.sum())
+        self.entries += self._npWeightsSum(weights, shape)
+
+    def _sql(self, query, weight):
+        entries = query.aggregate("SUM({0})".format(weight))
+        fillCut = self.cut._sql(query, query.cut(self.quantity.asSQL(), weight))
+
+        def fill(container, keys, aggregates):
+            container.entries += number(aggregates[entries])
+            fillCut(container.cut, keys, aggregates)
+        return fill
 
     def _sparksql(self, jvm, converter):
         return converter.Select(self.quantity.asSparkSQL(), self.cut._sparksql(jvm, converter))
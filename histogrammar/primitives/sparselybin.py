@@ -17,16 +17,22 @@
 import numpy as np
 import math
 import numbers
+import threading
 
 from histogrammar.defs import Container, Factory, identity, JsonFormatException, ContainerException
+from histogrammar.estimate import NODE_BYTES, cost, cardinality
+from histogrammar.sql import number
 from histogrammar.util import n_dim, datatype, serializable, inheritdoc, maybeAdd, floatToJson, hasKeys, numeq, \
-    basestring, long
+    basestring, long, xrange, _npMemo
 from histogrammar.primitives.count import Count
 
 LONG_NAN = -9223372036854775808
 LONG_MINUSINF = -9223372036854775807
 LONG_PLUSINF = 9223372036854775807
 
+# spill functions are called one at a time, also from the worker clones of a fillnumpy with n_threads > 1
+_spillLock = threading.Lock()
+
 
 class SparselyBin(Factory, Container):
     """Split a quantity into equally spaced bins, creating them whenever their ``entries`` would be non-zero.
@@ -36,7 +42,10 @@ class SparselyBin(Factory, Container):
     Use this when you have a distribution of known scale (bin width) but unknown domain (lowest and highest bin index).
 
     Unlike fixed-domain binning, this aggregator has the potential to use unlimited memory. A large number
-    of *distinct* outliers can generate many unwanted bins.
+    of *distinct* outliers can generate many unwanted bins. With ``maxBins``, the bins are merged pairwise
+    (``binWidth`` doubles, see ``coarsen``) whenever there are more of them than that. With ``window``, only the
+    bins of the last ``window`` bin widths (up to the highest bin filled so far) are kept, as on a time axis of a
+    monitoring stream.
 
     Like fixed-domain binning, the bins are indexed by integers, though they are 64-bit and may be negative.
     Bin indexes below ``-(2**63 - 1)`` are put in the ``-(2**63 - 1)`` are bin and indexes above ``(2**63 - 1)``
@@ -82,11 +91,12 @@ class SparselyBin(Factory, Container):
         return out.specialize()
 
     @staticmethod
-    def ing(binWidth, quantity, value=Count(), nanflow=Count(), origin=0.0):
+    def ing(binWidth, quantity, value=Count(), nanflow=Count(), origin=0.0, maxBins=None, window=None, spill=None):
         """Synonym for ``__init__``."""
-        return SparselyBin(binWidth, quantity, value, nanflow, origin)
+        return SparselyBin(binWidth, quantity, value, nanflow, origin, maxBins, window, spill)
 
-    def __init__(self, binWidth, quantity=identity, value=Count(), nanflow=Count(), origin=0.0):
+    def __init__(self, binWidth, quantity=identity, value=Count(), nanflow=Count(), origin=0.0, maxBins=None,
+                 window=None, spill=None):
         """Create a SparselyBin that is capable of being filled and added.
 
         Parameters:
@@ -96,6 +106,17 @@ class SparselyBin(Factory, Container):
             nanflow (:doc:`Container <histogrammar.defs.Container>`): a sub-aggregator to use for data whose quantity
                 is NaN.
             origin (float): the left edge of the bin whose index is 0.
+            maxBins (int or None): if not None, the most bins to keep: when a fill or an addition leaves more, adjacent
+                bins are merged by doubling ``binWidth`` until there are at most ``maxBins`` (or the bins cannot be
+                merged any further).
+            window (int or None): if not None, the number of bins to keep, counting down from the highest bin index
+                filled so far: older bins are evicted as higher ones are filled, and their entries are subtracted from
+                ``entries``. Data that arrive for a bin that has already been evicted are evicted right away.
+            spill (function or None): called as ``spill(index, container)`` with each evicted bin, e.g. to write it to
+                storage. It can be called more than once for the same index if late data arrive for it. With
+                ``fill.numpy(..., n_threads=n)``, it is called from the worker threads (one call at a time).
+
+        ``spill`` is not part of the JSON representation.
 
         Other parameters:
             entries (float): the number of entries, initially 0.0.
@@ -112,8 +133,19 @@ class SparselyBin(Factory, Container):
             raise TypeError("origin ({0}) must be a number".format(origin))
         if binWidth <= 0.0:
             raise ValueError("binWidth ({0}) must be greater than zero".format(binWidth))
+        if maxBins is not None and (not isinstance(maxBins, (int, long)) or maxBins < 1):
+            raise ValueError("maxBins ({0}) must be a positive integer or None".format(maxBins))
+        if window is not None and (not isinstance(window, (int, long)) or window < 1):
+            raise ValueError("window ({0}) must be a positive integer or None".format(window))
+        if spill is not None and not callable(spill):
+            raise TypeError("spill ({0}) must be a function or None".format(spill))
 
         self.binWidth = float(binWidth)
+        self.maxBins = maxBins
+        self.window = window
+        self.spill = spill
+        # the highest bin index filled so far (the top of the window)
+        self._highest = None
         self.entries = 0.0
         self.quantity = serializable(identity(quantity) if isinstance(quantity, str) else quantity)
         self.value = value
@@ -129,7 +161,7 @@ class SparselyBin(Factory, Container):
 
     def histogram(self):
         """Return a plain histogram by converting all sub-aggregator values into Counts"""
-        out = SparselyBin(self.binWidth, self.quantity, Count(), self.nanflow.copy(), self.origin)
+        out = SparselyBin(self.binWidth, self.quantity, Count(), self.nanflow.copy(), self.origin, self.maxBins)
         out.entries = float(self.entries)
         out.contentType = "Count"
         for i, v in self.bins.items():
@@ -138,33 +170,46 @@ class SparselyBin(Factory, Container):
 
     @inheritdoc(Container)
     def zero(self):
-        return SparselyBin(self.binWidth, self.quantity, self.value, self.nanflow.zero(), self.origin)
+        return SparselyBin(self.binWidth, self.quantity, self.value, self.nanflow.zero(), self.origin, self.maxBins,
+                           self.window, self.spill)
+
+    def _zeroClone(self):
+        out = self._shallowClone()
+        out.bins = {}
+        out._highest = None
+        out.nanflow = self.nanflow._zeroClone()
+        return out
 
     @inheritdoc(Container)
     def __add__(self, other):
         if isinstance(other, SparselyBin):
-            if self.binWidth != other.binWidth:
-                raise ContainerException(
-                    "cannot add SparselyBins because binWidth differs ({0} vs {1})".format(
-                        self.binWidth, other.binWidth))
-            if self.origin != other.origin:
-                raise ContainerException(
-                    "cannot add SparselyBins because origin differs ({0} vs {1})".format(
-                        self.origin, other.origin))
+            factor = self._coarseningFactor(other)
+            if factor > 1 and self.binWidth < other.binWidth:
+                return self._coarsened(factor, other.binWidth) + other
+            elif factor > 1:
+                return self + other._coarsened(factor, self.binWidth)
 
             out = SparselyBin(
                 self.binWidth,
                 self.quantity,
                 self.value.copy() if self.value is not None else None,
                 self.nanflow + other.nanflow,
-                self.origin)
+                self.origin,
+                self.maxBins if self.maxBins is not None else other.maxBins,
+                self.window if self.window is not None else other.window,
+                self.spill if self.spill is not None else other.spill)
             out.entries = self.entries + other.entries
+            # bins on only one side are shared, not copied: coarsening and eviction don't modify bins (see copy)
             out.bins = self.bins.copy()
             for i, v in other.bins.items():
                 if i in out.bins:
                     out.bins[i] = out.bins[i] + v
                 else:
                     out.bins[i] = v
+            highests = [x._highest for x in (self, other) if x._highest is not None]
+            out._highest = max(highests) if len(highests) > 0 else None
+            out._slide(list(out.bins))
+            out._limitBins()
             return out.specialize()
 
         else:
@@ -173,14 +218,12 @@ class SparselyBin(Factory, Container):
     @inheritdoc(Container)
     def __iadd__(self, other):
         if isinstance(other, SparselyBin):
-            if self.binWidth != other.binWidth:
-                raise ContainerException(
-                    "cannot add SparselyBins because binWidth differs ({0} vs {1})".format(
-                        self.binWidth, other.binWidth))
-            if self.origin != other.origin:
-                raise ContainerException(
-                    "cannot add SparselyBins because origin differs ({0} vs {1})".format(
-                        self.origin, other.origin))
+            factor = self._coarseningFactor(other)
+            if factor > 1 and self.binWidth < other.binWidth:
+                self.coarsen(factor)
+                self.binWidth = other.binWidth
+            elif factor > 1:
+                other = other._coarsened(factor, self.binWidth)
             self.entries += other.entries
             for i, v in other.bins.items():
                 if i in self.bins:
@@ -188,10 +231,102 @@ class SparselyBin(Factory, Container):
                 else:
                     self.bins[i] = v.copy()
             self.nanflow += other.nanflow
+            self._slide(list(other.bins))
+            self._limitBins()
             return self
         else:
             raise ContainerException("cannot add {0} and {1}".format(self.name, other.name))
 
+    def _coarseningFactor(self, other):
+        # SparselyBins with the same origin can be added if one binWidth is a multiple of the other: the bins of the
+        # finer one are merged by this factor first
+        if self.origin != other.origin:
+            raise ContainerException(
+                "cannot add SparselyBins because origin differs ({0} vs {1})".format(
+                    self.origin, other.origin))
+        if self.binWidth == other.binWidth:
+            return 1
+        fine, coarse = sorted([self.binWidth, other.binWidth])
+        factor = int(round(coarse / fine))
+        if factor < 2 or abs(fine * factor - coarse) > 1e-12 * coarse:
+            raise ContainerException(
+                "cannot add SparselyBins because binWidth differs ({0} vs {1})".format(
+                    self.binWidth, other.binWidth))
+        return factor
+
+    @inheritdoc(Container)
+    def copy(self):
+        out = self + self.zero()
+        out.bins = dict((i, v.copy()) for i, v in out.bins.items())
+        return out
+
+    def _coarsened(self, factor, binWidth):
+        # coarsen replaces the bins it merges, so the bins of self are not modified
+        out = self._shallowClone()
+        out.bins = self.bins.copy()
+        out.coarsen(factor)
+        out.binWidth = binWidth
+        return out
+
+    def coarsen(self, factor=2):
+        """Merge every ``factor`` adjacent bins into one, in place.
+
+        ``binWidth`` is multiplied by ``factor`` and the bins stay aligned to ``origin``: bin ``i`` goes into bin
+        ``i // factor``. The result can be added to a SparselyBin of the same origin whose ``binWidth`` is a multiple
+        of the old one. (Doubling, the default, is what ``maxBins`` does and keeps ``binWidth`` exact.) The overflow
+        bins of infinite quantities stay where they are.
+        """
+        if not isinstance(factor, (int, long)) or factor < 1:
+            raise ValueError("factor ({0}) must be a positive integer".format(factor))
+        bins = {}
+        for i, v in self.bins.items():
+            if i != LONG_MINUSINF and i != LONG_PLUSINF:
+                i = i // factor
+            if i in bins:
+                # a new bin, not +=, since v may be shared with another SparselyBin (see __add__)
+                bins[i] = bins[i] + v
+            else:
+                bins[i] = v
+        self.bins = bins
+        self.binWidth *= factor
+        if self._highest is not None:
+            self._highest //= factor
+
+    def _slide(self, indexes):
+        # move the window up to the highest of the bin indexes that were just filled, evicting the bins below it
+        # (including any of these indexes that arrived late); the cost is in the number of bins evicted
+        if self.window is None or len(indexes) == 0:
+            return
+        indexes = np.asarray(indexes, dtype=np.int64)
+        indexes = indexes[(indexes != LONG_NAN) & (indexes != LONG_PLUSINF)]
+        if len(indexes) == 0:
+            return
+        highest = int(indexes.max())
+        stale = set()
+        if self._highest is None or highest - self._highest > len(self.bins):
+            stale.update(i for i in self.bins if i <= highest - self.window)
+        elif highest > self._highest:
+            stale.update(i for i in xrange(self._highest - self.window + 1, highest - self.window + 1)
+                         if i in self.bins)
+        self._highest = highest if self._highest is None else max(self._highest, highest)
+        stale.update(int(i) for i in np.unique(indexes[indexes <= self._highest - self.window]) if i in self.bins)
+        for i in sorted(stale):
+            self._evict(i)
+
+    def _evict(self, index):
+        value = self.bins.pop(index)
+        self.entries -= value.entries
+        if self.spill is not None:
+            with _spillLock:
+                self.spill(index, value)
+
+    def _limitBins(self):
+        # bins -1 and 0 (and the overflow bins) are never merged, since they are on either side of the origin
+        if self.maxBins is not None:
+            while len(self.bins) > self.maxBins and any(
+                    i not in (-1, 0, LONG_MINUSINF, LONG_PLUSINF) for i in self.bins):
+                self.coarsen(2)
+
     @inheritdoc(Container)
     def __mul__(self, factor):
         if math.isnan(factor) or factor <= 0.0:
@@ -330,6 +465,9 @@ class SparselyBin(Factory, Container):
                 self.bins[b].fill(datum, weight)
             # no possibility of exception from here on out (for rollback)
             self.entries += weight
+            if not self.nan(q):
+                self._slide([b])
+            self._limitBins()
 
     def _cppGenerateCode(self, parser, generator, inputFieldNames, inputFieldTypes, derivedFieldTypes,
                          derivedFieldExprs, storageStructs, initCode, initPrefix, initIndent, fillCode, fillPrefix,
@@ -452,85 +590,227 @@ class SparselyBin(Factory, Container):
 
         self.nanflow._clingUpdate(obj, ("var", "nanflow"))
 
+    def _numbaGenerateCode(self, inputFields, inputFieldNames, derivedFieldExprs, globalCode, initCode, initPrefix,
+                           initIndent, fillCode, fillPrefix, fillIndent, weightVars, weightVarStack, tmpVarTypes):
+        normexpr = self._numbaQuantityExpr(inputFields, inputFieldNames, derivedFieldExprs, None)
+        q = "q_" + str(len(tmpVarTypes))
+        tmpVarTypes[q] = "float64"
+        softbin = "softbin_" + str(len(tmpVarTypes))
+        tmpVarTypes[softbin] = "float64"
+        key = "key_" + str(len(tmpVarTypes))
+        tmpVarTypes[key] = "int64"
+        offset = "offset_" + str(len(tmpVarTypes))
+        tmpVarTypes[offset] = "int64"
+
+        initCode.append(" " * initIndent + "heap[{0}] = 0.0".format(initPrefix))
+        fillCode.append(" " * fillIndent + "{0} = {1}".format(q, normexpr))
+        fillCode.append(" " * fillIndent + "heap[{0}] += {1}".format(fillPrefix, weightVarStack[-1]))
+
+        fillCode.append(" " * fillIndent + "if math.isnan({0}):".format(q))
+        self.nanflow._numbaGenerateCode(inputFields,
+                                        inputFieldNames,
+                                        derivedFieldExprs,
+                                        globalCode,
+                                        initCode,
+                                        self._numbaExpandPrefix(initPrefix, 1),
+                                        initIndent,
+                                        fillCode,
+                                        self._numbaExpandPrefix(fillPrefix, 1),
+                                        fillIndent + 4,
+                                        weightVars,
+                                        weightVarStack,
+                                        tmpVarTypes)
+
+        # bins are allocated at the top of the heap the first time they're seen; their initialization code is
+        # generated into the fill loop, right after the allocation
+        valueInitCode = []
+        valueFillCode = []
+        self.value._numbaGenerateCode(inputFields,
+                                      inputFieldNames,
+                                      derivedFieldExprs,
+                                      globalCode,
+                                      valueInitCode,
+                                      offset,
+                                      fillIndent + 8,
+                                      valueFillCode,
+                                      offset,
+                                      fillIndent + 4,
+                                      weightVars,
+                                      weightVarStack,
+                                      tmpVarTypes)
+
+        fillCode.append("""{indent}else:
+{indent}    {softbin} = ({q} - {origin}) / {binWidth}
+{indent}    if {softbin} <= {LONG_MINUSINF}:
+{indent}        {key} = {LONG_MINUSINF}
+{indent}    elif {softbin} >= {LONG_PLUSINF}:
+{indent}        {key} = {LONG_PLUSINF}
+{indent}    else:
+{indent}        {key} = int(math.floor({softbin}))
+{indent}    if (np.int64({owner}), {key}) in index:
+{indent}        {offset} = index[(np.int64({owner}), {key})]
+{indent}    else:
+{indent}        {offset} = top
+{indent}        top += {size}
+{indent}        if top > heap.shape[0]:
+{indent}            grown = np.zeros(max(2 * heap.shape[0], top))
+{indent}            grown[:heap.shape[0]] = heap
+{indent}            heap = grown
+{indent}        index[(np.int64({owner}), {key})] = {offset}""".format(
+            indent=" " * fillIndent,
+            q=q,
+            softbin=softbin,
+            key=key,
+            offset=offset,
+            owner=fillPrefix,
+            size=self.value._numbaStorageSize(),
+            origin=self._numbaConstant(self.origin),
+            binWidth=self._numbaConstant(self.binWidth),
+            LONG_MINUSINF=LONG_MINUSINF,
+            LONG_PLUSINF=LONG_PLUSINF))
+        fillCode.extend(valueInitCode)
+        fillCode.extend(valueFillCode)
+
+    def _numbaStorageSize(self):
+        return 1 + self.nanflow._numbaStorageSize()
+
+    def _numbaUpdate(self, heap, dynamic, offset):
+        self.entries += float(heap[offset])
+        for key, valueOffset in dynamic.get(offset, ()):
+            if key not in self.bins:
+                self.bins[key] = self.value.zero()
+            self.bins[key]._numbaUpdate(heap, dynamic, valueOffset)
+        self.nanflow._numbaUpdate(heap, dynamic, offset + 1)
+
     def _c99StructName(self):
         return "Sb" + self.value._c99StructName() + self.nanflow._c99StructName()
 
-    def _numpy(self, data, weights, shape):
-        q = self.quantity(data)
+    def _numpy(self, data, weights, shape, memo):
+        # bin indices are shared by every SparselyBin with the same quantity and binning within a fill
+        nans, q = _npMemo(memo, ("SparselyBin", self.quantity._memoKey(), self.origin, self.binWidth),
+                          lambda: self._npBinIndices(data, memo))
         self._checkNPQuantity(q, shape)
 
-        if isinstance(weights, (float, int)) and weights == 1:
-            all_weights_one = True
-        elif isinstance(weights, np.ndarray) and np.all(weights == 1):
-            all_weights_one = True
-        else:
-            all_weights_one = False
         self._checkNPWeights(weights, shape)
-        weights = self._makeNPWeights(weights, shape)
-        newentries = weights.sum()
-
-        selection = np.isnan(q)
-        np.bitwise_not(selection, selection)  # invert selection
-        subweights = weights.copy()
-        subweights[selection] = 0.0
-        self.nanflow._numpy(data, subweights, shape)
-        subweights[:] = weights
-
-        # switch to float here like in bin.py else numpy throws
-        # TypeError on trivial integer cases such as:
-        # >>> q = np.array([1,2,3,4])
-        # >>> np.divide(q,1,q)
-        # >>> np.floor(q,q)
-        q = np.array(q, dtype=np.float64)
-        neginfs = np.isneginf(q)
-        posinfs = np.isposinf(q)
-
-        np.subtract(q, self.origin, q)
-        np.divide(q, self.binWidth, q)
-        np.floor(q, q)
-        q = np.array(q, dtype=np.int64)
-        q[neginfs] = LONG_MINUSINF
-        q[posinfs] = LONG_PLUSINF
+        if isinstance(weights, np.ndarray):
+            all_weights_one = np.all(weights == 1)
+            positive = weights > 0.0
+        else:
+            all_weights_one = weights == 1
+            positive = None
+        newentries = self._npWeightsSum(weights, shape)
 
-        selected = q[weights > 0.0]
+        # each sub-aggregator is filled with only the rows that belong to it (see Container._npFillRows)
+        self._npFillSelected(self.nanflow, data, weights, nans, shape, memo)
 
-        # used below. bit expensive, so do here once
-        n_dim = self.n_dim
+        if positive is None:
+            selected = q if weights > 0.0 else q[:0]
+        else:
+            selected = q[positive]
 
-        if n_dim == 1 and all_weights_one and isinstance(self.value, Count):
-            # special case: filling single array where all weights are 1
+        if isinstance(self.value, Count) and self.n_dim == 1 and (
+                all_weights_one or (positive is None and self.value.transform is identity)):
+            # special case: filling single array where all weights are the same
             # (use fast np.unique that returns counts)
             uniques, counts = np.unique(selected, return_counts=True)
+            if not all_weights_one:
+                counts = counts * weights
+            filledIndexes = uniques
+            # new bins are cloned from one template (see Container._zeroClone)
+            template = self.value.zero()
             for c, index in zip(counts, uniques):
                 if index != LONG_NAN:
                     bin = self.bins.get(index)
                     if bin is None:
-                        bin = self.value.zero()
+                        bin = template._zeroClone()
                         self.bins[index] = bin
                     # pass counts directly to Count object
-                    self.bins[index]._numpy(None, c, [None])
-        else:
+                    self.bins[index]._numpy(None, c, [None], {})
+        elif len(selected) > 0:
             # all other cases ...
-            selection = np.empty(q.shape, dtype=bool)
-            for index in np.unique(selected):
-                if index != LONG_NAN:
+            # one stable sort groups the rows by key, each group in ascending row order
+            order = np.argsort(q, kind="stable")
+            keys = q[order]
+            starts = np.flatnonzero(np.concatenate(([True], keys[1:] != keys[:-1])))
+            bounds = np.append(starts, len(keys))
+            # only keys with a positive weight are filled, but then with all of their rows
+            if positive is None:
+                filled = np.ones(len(starts), dtype=bool)
+            else:
+                filled = np.add.reduceat(positive[order], starts) > 0
+            filledIndexes = keys[starts][filled]
+            template = self.value.zero()
+            for i, index in enumerate(keys[starts]):
+                if filled[i] and index != LONG_NAN:
                     bin = self.bins.get(index)
                     if bin is None:
-                        bin = self.value.zero()
+                        bin = template._zeroClone()
                         self.bins[index] = bin
-                    if n_dim == 1:
-                        # passing on the full array is faster for one-dim histograms
-                        np.not_equal(q, index, selection)
-                        subweights[:] = weights
-                        subweights[selection] = 0.0
-                        self.bins[index]._numpy(data, subweights, shape)
-                    else:
-                        # in practice passing on sliced arrays is faster for multi-dim histograms
-                        np.equal(q, index, selection)
-                        self.bins[index]._numpy(data[selection], subweights[selection], [np.sum(selection)])
+                    self._npFillRows(bin, data, weights, order[bounds[i]:bounds[i + 1]], shape, memo)
+
+        else:
+            filledIndexes = []
 
         # no possibility of exception from here on out (for rollback)
         self.entries += float(newentries)
+        self._slide(filledIndexes)
+        self._limitBins()
+
+    def _npBinIndices(self, data, memo):
+        q = self._npQuantity(data, memo)
+        self._checkNPQuantity(q, [None])
+        nans = np.isnan(q)
+
+        # switch to float here like in bin.py else numpy throws
+        # TypeError on trivial integer cases such as:
+        # >>> q = np.array([1,2,3,4])
+        # >>> np.divide(q,1,q)
+        # >>> np.floor(q,q)
+        q = np.array(q, dtype=np.float64)
+        neginfs = np.isneginf(q)
+        posinfs = np.isposinf(q)
+
+        np.subtract(q, self.origin, q)
+        np.divide(q, self.binWidth, q)
+        np.floor(q, q)
+        q = np.array(q, dtype=np.int64)
+        q[neginfs] = LONG_MINUSINF
+        q[posinfs] = LONG_PLUSINF
+        return nans, q
+
+    def _estimate(self, rows, cardinalities):
+        bins, assumed = cardinality(self, cardinalities, rows)
+        if self.maxBins is not None:
+            bins = min(bins, float(self.maxBins))
+        strategy = "{0:.0f} bins{1}".format(bins, " (assumed)" if assumed else "")
+        flows = [(self.nanflow, 1, 1, 0.0)]
+        bytes = NODE_BYTES + 100 * bins
+        if isinstance(self.value, Count) and self.n_dim == 1:
+            return cost("numpy.unique, " + strategy, 8, sort=True, calls=bins, bytes=bytes,
+                        children=flows + [(self.value, bins, 0, 0.0)])
+        return cost("partition into " + strategy, 8, sort=True, bytes=bytes,
+                    children=flows + [(self.value, bins, bins, rows / bins if bins > 0 else 0.0)])
+
+    def _sql(self, query, weight):
+        # the bin index of a NULL quantity is NULL: the nanflow
+        index = query.key(query.floor("(({0} - {1}) / {2})".format(
+            self.quantity.asSQL(), query.literal(self.origin), query.literal(self.binWidth))))
+        entries = query.aggregate("SUM({0})".format(weight))
+        fillValue = self.value._sql(query, weight)
+        fillNanflow = self.nanflow._sql(query, weight)
+
+        def fill(container, keys, aggregates):
+            n = number(aggregates[entries])
+            container.entries += n
+            i = keys[index]
+            if i is None:
+                fillNanflow(container.nanflow, keys, aggregates)
+            elif n > 0.0:
+                i = int(i)
+                if i not in container.bins:
+                    container.bins[i] = container.value.zero()
+                fillValue(container.bins[i], keys, aggregates)
+        return fill
 
     def _sparksql(self, jvm, converter):
         return converter.SparselyBin(self.binWidth, self.quantity.asSparkSQL(), self.value._sparksql(
@@ -541,6 +821,13 @@ class SparselyBin(Factory, Container):
         """List of sub-aggregators, to make it possible to walk the tree."""
         return [self.value, self.nanflow] + list(self.bins.values())
 
+    @property
+    def _filledChildren(self):
+        return [self.nanflow] + list(self.bins.values())
+
+    def _reduceColumns(self, protocol):
+        return self._reduceColumnsOf(protocol, "bins", list(self.bins.keys()), list(self.bins.values()))
+
     @inheritdoc(Container)
     def toJsonFragment(self, suppressName):
         if isinstance(self.value, Container):
@@ -576,14 +863,16 @@ class SparselyBin(Factory, Container):
             "nanflow": self.nanflow.toJsonFragment(False),
             "origin": self.origin,
         }, **{"name": None if suppressName else self.quantity.name,
-              "bins:name": binsName})
+              "bins:name": binsName,
+              "maxBins": self.maxBins,
+              "window": self.window})
 
     @staticmethod
     @inheritdoc(Factory)
     def fromJsonFragment(json, nameFromParent):
         if isinstance(json, dict) and hasKeys(
                 json.keys(), ["binWidth", "entries", "bins:type", "bins", "nanflow:type", "nanflow", "origin"],
-                ["name", "bins:name"]):
+                ["name", "bins:name", "maxBins", "window"]):
             if json["binWidth"] in ("nan", "inf", "-inf") or isinstance(json["binWidth"], numbers.Real):
                 binWidth = float(json["binWidth"])
             else:
@@ -634,8 +923,18 @@ class SparselyBin(Factory, Container):
             else:
                 raise JsonFormatException(json, "SparselyBin.origin")
 
+            for key in "maxBins", "window":
+                if json.get(key, None) is not None and (not isinstance(json[key], (int, long)) or json[key] < 1):
+                    raise JsonFormatException(json[key], "SparselyBin." + key)
+
             out = SparselyBin.ed(binWidth, entries, json["bins:type"], bins, nanflow, origin)
             out.quantity.name = nameFromParent if name is None else name
+            out.maxBins = json.get("maxBins", None)
+            out.window = json.get("window", None)
+            if out.window is not None:
+                # the top of the window is the highest bin filled, which is never evicted
+                filled = [i for i in bins if i != LONG_NAN and i != LONG_PLUSINF]
+                out._highest = max(filled) if len(filled) > 0 else None
             return out.specialize()
 
         else:
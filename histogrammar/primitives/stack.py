@@ -20,6 +20,7 @@ import numbers
 import struct
 
 from histogrammar.defs import Container, Factory, identity, JsonFormatException, ContainerException
+from histogrammar.estimate import cost
 from histogrammar.util import n_dim, datatype, serializable, inheritdoc, maybeAdd, floatToJson, hasKeys, numeq, \
     basestring, xrange, floatToC99
 from histogrammar.primitives.count import Count
@@ -309,6 +310,78 @@ class Stack(Factory, Container):
             self.bins[i][1]._clingUpdate(obj, ("func", ["getValues", i]))
         self.nanflow._clingUpdate(obj, ("var", "nanflow"))
 
+    def _numbaGenerateCode(self, inputFields, inputFieldNames, derivedFieldExprs, globalCode, initCode, initPrefix,
+                           initIndent, fillCode, fillPrefix, fillIndent, weightVars, weightVarStack, tmpVarTypes):
+        normexpr = self._numbaQuantityExpr(inputFields, inputFieldNames, derivedFieldExprs, None)
+        q = "q_" + str(len(tmpVarTypes))
+        tmpVarTypes[q] = "float64"
+        thresholds = "thresholds_" + str(len(tmpVarTypes))
+        tmpVarTypes[thresholds] = "float64[:]"
+        bin = "bin_" + str(len(tmpVarTypes))
+        tmpVarTypes[bin] = "int64"
+        offset = "offset_" + str(len(tmpVarTypes))
+        tmpVarTypes[offset] = "int64"
+
+        valuesStart = 1 + self.nanflow._numbaStorageSize()
+        valueSize = self.bins[0][1]._numbaStorageSize()
+
+        globalCode.append("{0} = np.array([{1}], dtype=np.float64)".format(
+            thresholds, ", ".join(self._numbaConstant(threshold) for threshold, sub in self.bins)))
+
+        initCode.append(" " * initIndent + "heap[{0}] = 0.0".format(initPrefix))
+        fillCode.append(" " * fillIndent + "{0} = {1}".format(q, normexpr))
+        fillCode.append(" " * fillIndent + "heap[{0}] += {1}".format(fillPrefix, weightVarStack[-1]))
+
+        fillCode.append(" " * fillIndent + "if math.isnan({0}):".format(q))
+        self.nanflow._numbaGenerateCode(inputFields,
+                                        inputFieldNames,
+                                        derivedFieldExprs,
+                                        globalCode,
+                                        initCode,
+                                        self._numbaExpandPrefix(initPrefix, 1),
+                                        initIndent,
+                                        fillCode,
+                                        self._numbaExpandPrefix(fillPrefix, 1),
+                                        fillIndent + 4,
+                                        weightVars,
+                                        weightVarStack,
+                                        tmpVarTypes)
+
+        initCode.append(" " * initIndent + "for {0} in range({1}):".format(bin, len(self.bins)))
+        initCode.append(" " * (initIndent + 4) + "{0} = {1} + {2} * {3}".format(
+            offset, self._numbaExpandPrefix(initPrefix, valuesStart), bin, valueSize))
+
+        fillCode.append(" " * fillIndent + "else:")
+        fillCode.append(" " * (fillIndent + 4) + "for {0} in range({1}):".format(bin, len(self.bins)))
+        fillCode.append(" " * (fillIndent + 8) + "if {0} >= {1}[{2}]:".format(q, thresholds, bin))
+        fillCode.append(" " * (fillIndent + 12) + "{0} = {1} + {2} * {3}".format(
+            offset, self._numbaExpandPrefix(fillPrefix, valuesStart), bin, valueSize))
+
+        self.bins[0][1]._numbaGenerateCode(inputFields,
+                                           inputFieldNames,
+                                           derivedFieldExprs,
+                                           globalCode,
+                                           initCode,
+                                           offset,
+                                           initIndent + 4,
+                                           fillCode,
+                                           offset,
+                                           fillIndent + 12,
+                                           weightVars,
+                                           weightVarStack,
+                                           tmpVarTypes)
+
+    def _numbaStorageSize(self):
+        return 1 + self.nanflow._numbaStorageSize() + len(self.bins) * self.bins[0][1]._numbaStorageSize()
+
+    def _numbaUpdate(self, heap, dynamic, offset):
+        self.entries += float(heap[offset])
+        self.nanflow._numbaUpdate(heap, dynamic, offset + 1)
+        offset += 1 + self.nanflow._numbaStorageSize()
+        valueSize = self.bins[0][1]._numbaStorageSize()
+        for i, (threshold, sub) in enumerate(self.bins):
+            sub._numbaUpdate(heap, dynamic, offset + i * valueSize)
+
     def _c99StructName(self):
         return "Sk" + str(len(self.bins)) + self.bins[0][1]._c99StructName() + self.nanflow._c99StructName()
 
@@ -505,39 +578,38 @@ class Stack(Factory, Container):
 
         return data
 
-    def _numpy(self, data, weights, shape):
-        q = self.quantity(data)
+    def _numpy(self, data, weights, shape, memo):
+        q = self._npQuantity(data, memo)
         self._checkNPQuantity(q, shape)
         self._checkNPWeights(weights, shape)
-        weights = self._makeNPWeights(weights, shape)
-        newentries = weights.sum()
+        newentries = self._npWeightsSum(weights, shape)
 
         import numpy
 
+        # each sub-aggregator is filled with only the rows that belong to it (see Container._npFillRows)
+        q = numpy.array(q, dtype=numpy.float64)
         selection = numpy.isnan(q)
-        numpy.bitwise_not(selection, selection)
-        subweights = weights.copy()
-        subweights[selection] = 0.0
-        self.nanflow._numpy(data, subweights, shape)
+        self._npFillSelected(self.nanflow, data, weights, selection, shape, memo)
 
         # avoid nan warning in calculations by flinging the nans elsewhere
-        numpy.bitwise_not(selection, selection)
-        q = numpy.array(q, dtype=numpy.float64)
+        valid = numpy.bitwise_not(selection)
         q[selection] = float("-inf")
-        weights = weights.copy()
-        weights[selection] = 0.0
 
-        selection = numpy.empty(q.shape, dtype=bool)
         for threshold, sub in self.bins:
-            numpy.less(q, threshold, selection)
-            subweights[:] = weights
-            subweights[selection] = 0.0
+            numpy.greater_equal(q, threshold, selection)
+            numpy.bitwise_and(selection, valid, selection)
 
-            sub._numpy(data, subweights, shape)
+            self._npFillSelected(sub, data, weights, selection, shape, memo)
 
         # no possibility of exception from here on out (for rollback)
         self.entries += float(newentries)
 
+    def _estimate(self, rows, cardinalities):
+        # the first threshold takes all rows, the last the fewest: on average, a bin has (num + 1) / (2 num) of them
+        num = len(self.bins)
+        return cost("{0} cumulative selections".format(num), 3 + 2 * num,
+                    children=[(self.nanflow, 1, 1, 0.0), (self.bins[0][1], num, num, rows * (num + 1) / (2.0 * num))])
+
     def _sparksql(self, jvm, converter):
         return converter.Stack([e for e, v in self.bins[1:]], self.quantity.asSparkSQL(),
                                self.bins[0][1]._sparksql(jvm, converter), self.nanflow._sparksql(jvm, converter))
@@ -547,6 +619,9 @@ class Stack(Factory, Container):
         """List of sub-aggregators, to make it possible to walk the tree."""
         return [self.nanflow] + self.values
 
+    def _reduceColumns(self, protocol):
+        return self._reduceColumnsOf(protocol, "bins", [k for k, v in self.bins], [v for k, v in self.bins])
+
     @inheritdoc(Container)
     def toJsonFragment(self, suppressName):
         if getattr(self.bins[0][1], "quantity", None) is not None:
@@ -20,6 +20,7 @@ import numbers
 import struct
 
 from histogrammar.defs import Container, Factory, identity, JsonFormatException, ContainerException
+from histogrammar.sql import number
 from histogrammar.util import n_dim, datatype, serializable, inheritdoc, maybeAdd, floatToJson, hasKeys, numeq, \
     basestring
 
@@ -32,6 +33,8 @@ class Sum(Factory, Container):
     both positive and negative quantities (weights are always non-negative).
     """
 
+    _pickleFields = ("entries", "sum")
+
     @staticmethod
     def ed(entries, sum):
         """Create a Sum that is only capable of being added.
@@ -156,6 +159,23 @@ class Sum(Factory, Container):
         self.entries += obj.entries
         self.sum += obj.sum
 
+    def _numbaGenerateCode(self, inputFields, inputFieldNames, derivedFieldExprs, globalCode, initCode, initPrefix,
+                           initIndent, fillCode, fillPrefix, fillIndent, weightVars, weightVarStack, tmpVarTypes):
+        initCode.append(" " * initIndent + "heap[{0}] = 0.0".format(initPrefix))
+        initCode.append(" " * initIndent + "heap[{0}] = 0.0".format(self._numbaExpandPrefix(initPrefix, 1)))
+
+        normexpr = self._numbaQuantityExpr(inputFields, inputFieldNames, derivedFieldExprs, None)
+        fillCode.append(" " * fillIndent + "heap[{0}] += {1}".format(fillPrefix, weightVarStack[-1]))
+        fillCode.append(" " * fillIndent + "heap[{0}] += {1} * {2}".format(
+            self._numbaExpandPrefix(fillPrefix, 1), normexpr, weightVarStack[-1]))
+
+    def _numbaStorageSize(self):
+        return 2
+
+    def _numbaUpdate(self, heap, dynamic, offset):
+        self.entries += float(heap[offset])
+        self.sum += float(heap[offset + 1])
+
     def _c99StructName(self):
         return "Sm"
 
@@ -236,24 +256,36 @@ class Sum(Factory, Container):
         self.sum += sum
         return data[struct.calcsize(format):]
 
-    def _numpy(self, data, weights, shape):
-        q = self.quantity(data)
+    def _numpy(self, data, weights, shape, memo):
+        q = self._npQuantity(data, memo)
         self._checkNPQuantity(q, shape)
         self._checkNPWeights(weights, shape)
-        weights = self._makeNPWeights(weights, shape)
 
         # no possibility of exception from here on out (for rollback)
-        self.entries += float(weights.sum())
+        self.entries += self._npWeightsSum(weights, shape)
 
         import numpy
-        selection = numpy.isnan(q)
-        numpy.bitwise_not(selection, selection)
-        numpy.bitwise_and(selection, weights > 0.0, selection)
-        q = q[selection]
-        weights = weights[selection]
-        q = q * weights
-
-        self.sum += float(q.sum())
+        if isinstance(weights, numpy.ndarray):
+            selection = numpy.isnan(q)
+            numpy.bitwise_not(selection, selection)
+            numpy.bitwise_and(selection, weights > 0.0, selection)
+            q = q[selection]
+            weights = weights[selection]
+            q = q * weights
+
+            self.sum += float(q.sum())
+
+        elif weights > 0.0:
+            self.sum += float(weights * numpy.nansum(q))
+
+    def _sql(self, query, weight):
+        entries = query.aggregate("SUM({0})".format(weight))
+        total = query.aggregate("SUM({0} * {1})".format(weight, self.quantity.asSQL()))
+
+        def fill(container, keys, aggregates):
+            container.entries += number(aggregates[entries])
+            container.sum += number(aggregates[total])
+        return fill
 
     def _sparksql(self, jvm, converter):
         return converter.Sum(self.quantity.asSparkSQL())
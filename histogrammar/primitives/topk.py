@@ -0,0 +1,538 @@
+#!/usr/bin/env python
+
+# Copyright 2016 DIANA-HEP
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import math
+import numbers
+import numpy as np
+
+from histogrammar.defs import Container, Factory, identity, JsonFormatException, ContainerException
+from histogrammar.estimate import NODE_BYTES, cost, cardinality
+from histogrammar.util import n_dim, datatype, serializable, inheritdoc, maybeAdd, floatToJson, hasKeys, numeq, \
+    basestring, _npMemo
+from histogrammar.primitives.count import Count
+
+
+class TopK(Factory, Container):
+    """Split a given quantity by its categorical value like :doc:`Categorize <histogrammar.primitives.categorize.Categorize>`, but only keep the ``capacity`` heaviest categories.
+
+    The categories to keep are chosen with the Space-Saving algorithm (Metwally, Agrawal and El Abbadi), so memory is
+    bounded for any number of *distinct* categories. Data in categories that are not kept go into ``other``.
+
+    For each kept category, ``counts`` is an upper bound on its total weight and ``counts - errors`` is a lower bound,
+    which is the weight that its sub-aggregator has seen. A category that is not kept has a total weight of at most
+    the smallest of the ``counts``. Two TopKs are merged the same way (Agarwal et al., "Mergeable Summaries"), so the
+    result of adding them does not depend on how the data were split.
+    """  # noqa
+
+    @staticmethod
+    def ed(entries, capacity, contentType, bins, counts, errors, other):
+        """Create a TopK that is only capable of being added.
+
+        Parameters:
+            entries (float): the number of entries.
+            capacity (int): the maximum number of categories to keep.
+            contentType (str): the value's sub-aggregator type (must be provided to determine type for the case when
+            `bins` is empty).
+            bins (dict from str to :doc:`Container <histogrammar.defs.Container>`): the kept categories and their
+            values.
+            counts (dict from str to float): upper bound on the total weight of each kept category.
+            errors (dict from str to float): maximum overestimate of each of the ``counts``.
+            other (:doc:`Container <histogrammar.defs.Container>`): the data of all categories that are not kept.
+        """
+        if not isinstance(entries, numbers.Real) and entries not in ("nan", "inf", "-inf"):
+            raise TypeError("entries ({0}) must be a number".format(entries))
+        if not isinstance(capacity, numbers.Integral) or capacity < 1:
+            raise TypeError("capacity ({0}) must be a positive integer".format(capacity))
+        if not isinstance(contentType, basestring):
+            raise TypeError("contentType ({0}) must be a string".format(contentType))
+        if not all(isinstance(v, Container) for v in bins.values()):
+            raise TypeError("bins ({0}) must be a dict from categories to Containers".format(bins))
+        if set(counts) != set(bins) or set(errors) != set(bins):
+            raise ValueError("counts ({0}) and errors ({1}) must have the same keys as bins".format(counts, errors))
+        if not isinstance(other, Container):
+            raise TypeError("other ({0}) must be a Container".format(other))
+        if entries < 0.0:
+            raise ValueError("entries ({0}) cannot be negative".format(entries))
+
+        out = TopK(capacity, None, None)
+        out.entries = float(entries)
+        out.bins = bins
+        out.counts = dict((k, float(v)) for k, v in counts.items())
+        out.errors = dict((k, float(v)) for k, v in errors.items())
+        out.other = other
+        out.contentType = contentType
+        return out.specialize()
+
+    @staticmethod
+    def ing(capacity, quantity, value=Count()):
+        """Synonym for ``__init__``."""
+        return TopK(capacity, quantity, value)
+
+    def __init__(self, capacity, quantity=identity, value=Count()):
+        """Create a TopK that is capable of being filled and added.
+
+        Parameters:
+            capacity (int): the maximum number of categories to keep; this fixes the memory used.
+            quantity (function returning str or bool): computes the quantity of interest from the data.
+            value (:doc:`Container <histogrammar.defs.Container>`): generates sub-aggregators to put in each kept
+            category and in ``other``.
+
+        Other Parameters:
+            entries (float): the number of entries, initially 0.0.
+            bins (dict from str to :doc:`Container <histogrammar.defs.Container>`): the kept categories.
+            counts (dict from str to float): upper bound on the total weight of each kept category.
+            errors (dict from str to float): maximum overestimate of each of the ``counts``.
+            other (:doc:`Container <histogrammar.defs.Container>`): the data of all categories that are not kept.
+        """
+        if not isinstance(capacity, numbers.Integral) or capacity < 1:
+            raise TypeError("capacity ({0}) must be a positive integer".format(capacity))
+        if value is not None and not isinstance(value, Container):
+            raise TypeError("value ({0}) must be None or a Container".format(value))
+        self.entries = 0.0
+        self.capacity = int(capacity)
+        self.quantity = serializable(identity(quantity) if isinstance(quantity, str) else quantity)
+        self.value = value
+        self.bins = {}
+        self.counts = {}
+        self.errors = {}
+        if value is not None:
+            self.other = value.zero()
+            self.contentType = value.name
+        else:
+            self.other = None
+            self.contentType = "Count"
+        super(TopK, self).__init__()
+        self.specialize()
+
+    @property
+    def size(self):
+        """Number of kept ``bins``."""
+        return len(self.bins)
+
+    @property
+    def keys(self):
+        """Iterable over the keys of the ``bins``."""
+        return self.bins.keys()
+
+    @property
+    def values(self):
+        """Iterable over the values of the ``bins``."""
+        return list(self.bins.values())
+
+    @property
+    def keySet(self):
+        """Set of keys among the ``bins``."""
+        return set(self.bins.keys())
+
+    @property
+    def full(self):
+        """True if ``capacity`` categories are kept, so that a new category has to replace one of them."""
+        return len(self.bins) >= self.capacity
+
+    @property
+    def minCount(self):
+        """Upper bound on the total weight of any category that is not kept (0.0 while not ``full``)."""
+        return min(self.counts.values()) if self.full else 0.0
+
+    def __call__(self, x):
+        """Attempt to get key ``x``, throwing an exception if it does not exist."""
+        return self.bins[x]
+
+    def get(self, x):
+        """Attempt to get key ``x``, returning ``None`` if it does not exist."""
+        return self.bins.get(x)
+
+    def getOrElse(self, x, default):
+        """Attempt to get key ``x``, returning an alternative if it does not exist."""
+        return self.bins.get(x, default)
+
+    @inheritdoc(Container)
+    def zero(self):
+        out = TopK(self.capacity, self.quantity, self.value)
+        if self.value is None:
+            out.other = self.other.zero()
+            out.contentType = self.contentType
+        return out
+
+    @inheritdoc(Container)
+    def __add__(self, other):
+        if isinstance(other, TopK):
+            out = self.zero()
+            out += self
+            out += other
+            return out.specialize()
+        else:
+            raise ContainerException("cannot add {0} and {1}".format(self.name, other.name))
+
+    @inheritdoc(Container)
+    def __iadd__(self, other):
+        if isinstance(other, TopK):
+            if self.capacity != other.capacity:
+                raise ContainerException("cannot add TopK because capacity differs ({0} vs {1})".format(
+                    self.capacity, other.capacity))
+            kept, counts, errors = self._merge(other.counts, other.errors, other.minCount)
+
+            # no possibility of exception from here on out (for rollback)
+            self._evict(kept)
+            for k, v in other.bins.items():
+                if k not in kept:
+                    self.other += v
+                elif k in self.bins:
+                    self.bins[k] += v
+                else:
+                    self.bins[k] = v.copy()
+            self.other += other.other
+            self.counts = counts
+            self.errors = errors
+            self.entries += other.entries
+            return self
+        else:
+            raise ContainerException("cannot add {0} and {1}".format(self.name, other.name))
+
+    @inheritdoc(Container)
+    def __mul__(self, factor):
+        if math.isnan(factor) or factor <= 0.0:
+            return self.zero()
+        else:
+            out = self.zero()
+            out.entries = factor * self.entries
+            for k, v in self.bins.items():
+                out.bins[k] = v * factor
+                out.counts[k] = factor * self.counts[k]
+                out.errors[k] = factor * self.errors[k]
+            out.other = self.other * factor
+            return out.specialize()
+
+    @inheritdoc(Container)
+    def __rmul__(self, factor):
+        return self.__mul__(factor)
+
+    def _merge(self, counts, errors, minCount):
+        """Space-Saving merge of this summary with another one, given as its ``counts``, ``errors`` and ``minCount``.
+
+        A category that is missing from one of the summaries may have had up to that summary's ``minCount`` of weight
+        in it, which is added to both its count and its error. Returns the kept categories (the ``capacity`` largest
+        counts) with their new counts and errors; nothing is changed.
+        """
+        selfMin = self.minCount
+        merged = {}
+        for k in list(self.counts) + [k for k in counts if k not in self.counts]:
+            merged[k] = (self.counts.get(k, selfMin) + counts.get(k, minCount),
+                         self.errors.get(k, selfMin) + errors.get(k, minCount))
+        # stable sort: ties are broken in favor of categories that were already kept
+        kept = sorted(merged, key=lambda k: -merged[k][0])[:self.capacity]
+        return set(kept), dict((k, merged[k][0]) for k in kept), dict((k, merged[k][1]) for k in kept)
+
+    def _evict(self, kept):
+        """Move the data of every kept category that is not in ``kept`` into ``other``."""
+        for k in [k for k in self.bins if k not in kept]:
+            self.other += self.bins.pop(k)
+            del self.counts[k]
+            del self.errors[k]
+
+    @staticmethod
+    def _category(x):
+        if isinstance(x, (basestring, bool)):
+            return x
+        elif x is None or np.isnan(x):
+            return 'NaN'
+        else:
+            raise TypeError("function return value ({0}) must be a string or bool".format(x))
+
+    @inheritdoc(Container)
+    def fill(self, datum, weight=1.0):
+        self._checkForCrossReferences()
+
+        if weight > 0.0:
+            q = self._category(self.quantity(datum))
+
+            if q in self.bins:
+                self.bins[q].fill(datum, weight)
+                self.counts[q] += weight
+            elif not self.full:
+                self.bins[q] = self.value.zero()
+                self.bins[q].fill(datum, weight)
+                self.counts[q] = weight
+                self.errors[q] = 0.0
+            else:
+                # Space-Saving: the new category replaces the one with the smallest count and inherits that count
+                bin = self.value.zero()
+                bin.fill(datum, weight)
+                victim = min(self.counts, key=self.counts.get)
+                count = self.counts[victim]
+                self.other += self.bins.pop(victim)
+                del self.counts[victim]
+                del self.errors[victim]
+                self.bins[q] = bin
+                self.counts[q] = count + weight
+                self.errors[q] = count
+
+            # no possibility of exception from here on out (for rollback)
+            self.entries += weight
+
+    def _cppGenerateCode(self, parser, generator, inputFieldNames, inputFieldTypes, derivedFieldTypes,
+                         derivedFieldExprs, storageStructs, initCode, initPrefix, initIndent, fillCode, fillPrefix,
+                         fillIndent, weightVars, weightVarStack, tmpVarTypes):
+        raise NotImplementedError("no C++ implementation of TopK")
+
+    def _c99GenerateCode(self, parser, generator, inputFieldNames, inputFieldTypes, derivedFieldTypes,
+                         derivedFieldExprs, storageStructs, initCode, initPrefix, initIndent, fillCode, fillPrefix,
+                         fillIndent, weightVars, weightVarStack, tmpVarTypes):
+        raise NotImplementedError("no C99-compliant implementation of TopK")
+
+    def _numbaGenerateCode(self, inputFields, inputFieldNames, derivedFieldExprs, globalCode, initCode, initPrefix,
+                           initIndent, fillCode, fillPrefix, fillIndent, weightVars, weightVarStack, tmpVarTypes):
+        raise NotImplementedError("no Numba implementation of TopK (string-valued keys)")
+
+    def _numbaStorageSize(self):
+        raise NotImplementedError("no Numba implementation of TopK (string-valued keys)")
+
+    def _numpy(self, data, weights, shape, memo):
+        # categories are shared by every Categorize and TopK on the same quantity within a fill
+        uniques, inverse = _npMemo(memo, ("Categorize", self.quantity._memoKey()),
+                                   lambda: self._npCategories(data, memo))
+        self._checkNPQuantity(inverse, shape)
+
+        self._checkNPWeights(weights, shape)
+        newentries = self._npWeightsSum(weights, shape)
+
+        # the batch is summarized exactly: the total positive weight of each of its categories
+        if isinstance(weights, np.ndarray):
+            sums = np.bincount(inverse, weights=np.where(weights > 0.0, weights, 0.0), minlength=len(uniques))
+        else:
+            sums = np.bincount(inverse, minlength=len(uniques)) * (weights if weights > 0.0 else 0.0)
+        keys = [self._category(x) for x in uniques.tolist()]
+        batch = {}
+        for k, s in zip(keys, sums.tolist()):
+            if s > 0.0:
+                batch[k] = batch.get(k, 0.0) + s
+        kept, counts, errors = self._merge(batch, dict((k, 0.0) for k in batch), 0.0)
+
+        # no possibility of exception from here on out (for rollback)
+        self._evict(kept)
+        template = self.value.zero()
+        rowsByKey = {}
+        for k, rows in zip(keys, self._npPartition(inverse, len(uniques))):
+            rowsByKey.setdefault(k if k in kept else None, []).append(rows)
+        for k, rows in rowsByKey.items():
+            rows = rows[0] if len(rows) == 1 else np.sort(np.concatenate(rows))
+            if k is None:
+                self._npFillRows(self.other, data, weights, rows, shape, memo)
+            else:
+                if k not in self.bins:
+                    self.bins[k] = template._zeroClone()
+                self._npFillRows(self.bins[k], data, weights, rows, shape, memo)
+        self.counts = counts
+        self.errors = errors
+
+        self.entries += float(newentries)
+
+    def _npCategories(self, data, memo):
+        q = self._npQuantity(data, memo)
+        if isinstance(q, (list, tuple)):
+            q = np.array(q)
+        self._checkNPQuantity(q, [None])
+        return np.unique(q, return_inverse=True)
+
+    def _estimate(self, rows, cardinalities):
+        categories, assumed = cardinality(self, cardinalities, rows)
+        bins = min(categories, float(self.capacity))
+        # the categories that are not kept all go to other
+        other = rows * (categories - bins) / categories if categories > 0 else 0.0
+        each = (rows - other) / bins if bins > 0 else 0.0
+        return cost("top {0:.0f} of {1:.0f} categories{2}".format(bins, categories, " (assumed)" if assumed else ""),
+                    3, sort=True, bytes=NODE_BYTES + 200 * bins,
+                    children=[(self.other, 1, 1 if other > 0 else 0, other), (self.value, bins, bins, each)])
+
+    def _sparksql(self, jvm, converter):
+        raise NotImplementedError("no SparkSQL implementation of TopK")
+
+    @property
+    def children(self):
+        """List of sub-aggregators, to make it possible to walk the tree."""
+        return ([] if self.value is None else [self.value]) + [self.other] + list(self.bins.values())
+
+    @property
+    def _filledChildren(self):
+        return [self.other] + list(self.bins.values())
+
+    @inheritdoc(Container)
+    def toJsonFragment(self, suppressName):
+        if getattr(self.other, "quantity", None) is not None:
+            binsName = self.other.quantity.name
+        elif getattr(self.other, "quantityName", None) is not None:
+            binsName = self.other.quantityName
+        else:
+            binsName = None
+
+        return maybeAdd({
+            # for json serialization all keys need to be strings, else json libs throws TypeError
+            "entries": floatToJson(self.entries),
+            "capacity": self.capacity,
+            "bins:type": self.other.name,
+            "bins": dict((str(k), v.toJsonFragment(True)) for k, v in self.bins.items()),
+            "counts": dict((str(k), floatToJson(v)) for k, v in self.counts.items()),
+            "errors": dict((str(k), floatToJson(v)) for k, v in self.errors.items()),
+            "other": self.other.toJsonFragment(True),
+        }, **{"name": None if suppressName else self.quantity.name,
+              "bins:name": binsName})
+
+    @staticmethod
+    @inheritdoc(Factory)
+    def fromJsonFragment(json, nameFromParent):
+        if isinstance(json, dict) and hasKeys(json.keys(), ["entries", "capacity", "bins:type", "bins", "counts",
+                                                            "errors", "other"], ["name", "bins:name"]):
+            if json["entries"] in ("nan", "inf", "-inf") or isinstance(json["entries"], numbers.Real):
+                entries = float(json["entries"])
+            else:
+                raise JsonFormatException(json, "TopK.entries")
+
+            if isinstance(json["capacity"], numbers.Integral):
+                capacity = json["capacity"]
+            else:
+                raise JsonFormatException(json, "TopK.capacity")
+
+            if isinstance(json.get("name", None), basestring):
+                name = json["name"]
+            elif json.get("name", None) is None:
+                name = None
+            else:
+                raise JsonFormatException(json["name"], "TopK.name")
+
+            if isinstance(json["bins:type"], basestring):
+                contentType = json["bins:type"]
+                factory = Factory.registered[contentType]
+            else:
+                raise JsonFormatException(json, "TopK.bins:type")
+
+            if isinstance(json.get("bins:name", None), basestring):
+                dataName = json["bins:name"]
+            elif json.get("bins:name", None) is None:
+                dataName = None
+            else:
+                raise JsonFormatException(json["bins:name"], "TopK.bins:name")
+
+            if isinstance(json["bins"], dict):
+                bins = dict((k, factory.fromJsonFragment(v, dataName)) for k, v in json["bins"].items())
+            else:
+                raise JsonFormatException(json, "TopK.bins")
+
+            weightMaps = {}
+            for field in "counts", "errors":
+                if isinstance(json[field], dict) and all(
+                        x in ("nan", "inf", "-inf") or isinstance(x, numbers.Real) for x in json[field].values()):
+                    weightMaps[field] = dict((k, float(x)) for k, x in json[field].items())
+                else:
+                    raise JsonFormatException(json, "TopK." + field)
+
+            other = factory.fromJsonFragment(json["other"], dataName)
+
+            out = TopK.ed(entries, capacity, contentType, bins, weightMaps["counts"], weightMaps["errors"], other)
+            out.quantity.name = nameFromParent if name is None else name
+            return out.specialize()
+
+        else:
+            raise JsonFormatException(json, "TopK")
+
+    def __repr__(self):
+        return "<TopK values={0} size={1} capacity={2}>".format(self.other.name, self.size, self.capacity)
+
+    def __eq__(self, other):
+        return isinstance(other, TopK) and numeq(self.entries, other.entries) and \
+            self.quantity == other.quantity and self.capacity == other.capacity and self.bins == other.bins and \
+            self.other == other.other and self.counts.keys() == other.counts.keys() and \
+            all(numeq(v, other.counts[k]) and numeq(self.errors[k], other.errors[k]) for k, v in self.counts.items())
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((self.entries, self.quantity, self.capacity, tuple(sorted(self.bins.items())), self.other))
+
+    @property
+    def n_bins(self):
+        """Get number of bins, consistent with SparselyBin and Categorize """
+        return self.size
+
+    def bin_entries(self, labels=[]):
+        """
+        Returns bin values
+
+        :param list labels: get entries for list of selected labels. When empty return for all labels found.
+        :returns: array of bin-entries
+        :rtype: numpy.array
+        """
+        if len(labels) == 0:
+            return np.array([self.bins[i].entries for i in self.bins])
+        entries = [self.bins[lab].entries if lab in self.bins else 0.0 for lab in labels]
+        return np.array(entries)
+
+    def bin_labels(self, max_length=-1):
+        """
+        Returns bin labels
+
+        :param int max_length: maximum length of a label. Default is full length.
+        :returns: array of labels
+        :rtype: numpy.array
+        """
+        if max_length == -1:
+            return np.array(list(self.bins.keys()))
+
+        labels = []
+        for i, key in enumerate(self.bins.keys()):
+            try:
+                label = str(key)
+                if max_length > 0:
+                    label = label[:max_length]
+            except BaseException:
+                label = 'bin_%d' % i
+            labels.append(label)
+        return np.array(labels)
+
+    def bin_centers(self, max_length=-1):
+        """
+        Returns bin labels
+
+        Compatible function call with Bin and SparselyBin
+
+        :param int max_length: maximum length of a label. Default if full length.
+        :returns: array of labels
+        :rtype: numpy.array
+        """
+        return self.bin_labels(max_length)
+
+    def _center_from_key(self, bin_key):
+        return bin_key
+
+    @property
+    def mpv(self):
+        """Return bin-label of most probable value
+        """
+        bin_entries = self.bin_entries()
+        bin_labels = self.bin_labels()
+
+        # if two max elements are equal, this will return the element with the lowest index.
+        max_idx = max(enumerate(bin_entries), key=lambda x: x[1])[0]
+        bl = bin_labels[max_idx]
+        return bl
+
+
+# extra properties: number of dimensions and datatypes of sub-hists
+TopK.n_dim = n_dim
+TopK.datatype = datatype
+
+# register extra methods such as plotting
+Factory.register(TopK)
@@ -0,0 +1,272 @@
+#!/usr/bin/env python
+
+# Copyright 2016 DIANA-HEP
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Per-container statistics of fills, for finding the expensive parts of a tree of aggregators.
+
+::
+
+    with profile() as prof:
+        hist.fill.numpy(df)
+    print(prof.table())
+
+Within the block, every ``fill`` and ``fillnumpy`` records, for each node of the tree (identified by its path from
+the root, such as ``"Categorize(category)/Bin(x)/Count"``), how often it was called, how many rows it saw and passed
+on to its sub-aggregators, its wall time (with and without the sub-aggregators), the time spent evaluating its
+quantity and, with ``memory=True``, the memory it allocated (using ``tracemalloc``).
+
+The fill methods are only wrapped while a profile is open, so fills outside of one cost exactly what they did. The
+wrappers are installed on the classes, for the whole process, but only fills made by the thread that opened the
+profile are recorded: fills in other threads pass straight through (at the cost of one extra call). This includes
+the worker threads of ``fillnumpy(n_threads=...)``, whose time is recorded only as part of the top-level node. With
+``memory=True``, allocations are traced in all threads, so other threads filling at the same time add to the bytes
+of the nodes that are recorded.
+"""
+
+import threading
+import time
+
+from histogrammar.defs import Container
+from histogrammar.util import CachedFcn, FillMethod, UserFcn, _pathLabel
+
+_state = threading.local()
+_active = []
+
+# the statistics of a node, in report order
+FIELDS = ("calls", "rows", "rowsToChildren", "time", "selfTime", "quantityTime", "bytesAllocated", "bytesRetained")
+
+
+class _Frame(object):
+    __slots__ = ("node", "path", "start", "rows", "childRows", "childTime", "quantityTime", "memory", "peak")
+
+    def __init__(self, node, path):
+        self.node = node
+        self.path = path
+        self.rows = 0
+        self.childRows = 0
+        self.childTime = 0.0
+        self.quantityTime = 0.0
+        self.memory = None
+        self.peak = 0
+
+
+def _subclasses(cls):
+    out = [cls]
+    for sub in cls.__subclasses__():
+        out.extend(x for x in _subclasses(sub) if x not in out)
+    return out
+
+
+class FillProfile(object):
+    """Statistics of the fills within a ``with`` block, by node path (see ``profile``).
+
+    Parameters:
+        memory (bool): if True, also record the memory allocated by each node with ``tracemalloc`` (which makes the
+            fills several times slower).
+
+        callback (callable or None): if not None, called at the end of each top-level fill with the records of that
+            fill alone (a list of dicts, as in ``report``), for sending them on to a metrics system.
+    """
+
+    def __init__(self, memory=False, callback=None):
+        self.memory = memory
+        self.callback = callback
+        self.stats = {}
+        self._lock = threading.Lock()
+        self._patched = []
+        self._startedTracing = False
+        self._thread = None
+
+    def __enter__(self):
+        if len(_active) > 0:
+            raise RuntimeError("fill profiles cannot be nested")
+        if self.memory:
+            import tracemalloc
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._startedTracing = True
+        _active.append(self)
+        self._thread = threading.get_ident()
+        for cls in _subclasses(Container):
+            for method in ("fill", "_numpy"):
+                if method in cls.__dict__:
+                    self._patch(cls, method, self._wrapFill(cls.__dict__[method], method == "_numpy"))
+        self._patch(FillMethod, "__call__", self._wrapFillMethod(FillMethod.__dict__["__call__"]))
+        for cls in (UserFcn, CachedFcn):
+            self._patch(cls, "__call__", self._wrapQuantity(cls.__dict__["__call__"]))
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        for cls, method, original in reversed(self._patched):
+            setattr(cls, method, original)
+        del self._patched[:]
+        _active.remove(self)
+        if self._startedTracing:
+            import tracemalloc
+            tracemalloc.stop()
+            self._startedTracing = False
+
+    def _patch(self, cls, method, wrapper):
+        self._patched.append((cls, method, cls.__dict__[method]))
+        setattr(cls, method, wrapper)
+
+    def _wrapFill(self, fcn, isNumpy):
+        profile = self
+
+        def wrapper(node, *args, **kwds):
+            frame = profile._enter(node)
+            if frame is None:
+                return fcn(node, *args, **kwds)
+            try:
+                return fcn(node, *args, **kwds)
+            finally:
+                if isNumpy:
+                    shape = args[2] if len(args) > 2 else kwds.get("shape")
+                    frame.rows = shape[0] if shape is not None and shape[0] is not None else 0
+                else:
+                    frame.rows = 1
+                profile._exit(frame)
+
+        wrapper.__name__ = fcn.__name__
+        wrapper.__doc__ = fcn.__doc__
+        return wrapper
+
+    def _wrapFillMethod(self, fcn):
+        profile = self
+
+        # specialized containers hold their fill method in a FillMethod, out of reach of the class-level wrapper
+        def wrapper(method, *args, **kwds):
+            frame = profile._enter(method.container)
+            if frame is None:
+                return fcn(method, *args, **kwds)
+            try:
+                return fcn(method, *args, **kwds)
+            finally:
+                frame.rows = 1
+                profile._exit(frame)
+
+        return wrapper
+
+    def _wrapQuantity(self, fcn):
+        def wrapper(userFcn, *args, **kwds):
+            stack = getattr(_state, "stack", None)
+            if not stack or getattr(_state, "inQuantity", False):
+                return fcn(userFcn, *args, **kwds)
+            _state.inQuantity = True
+            start = time.perf_counter()
+            try:
+                return fcn(userFcn, *args, **kwds)
+            finally:
+                stack[-1].quantityTime += time.perf_counter() - start
+                _state.inQuantity = False
+
+        return wrapper
+
+    def _enter(self, node):
+        if threading.get_ident() != self._thread:
+            # a fill in another thread than the one that opened the profile
+            return None
+        stack = getattr(_state, "stack", None)
+        if stack is None:
+            stack = _state.stack = []
+        elif len(stack) > 0 and stack[-1].node is node:
+            # the same fill, reached through a second wrapper
+            return None
+        label = _pathLabel(node)
+        frame = _Frame(node, label if len(stack) == 0 else stack[-1].path + "/" + label)
+        if self.memory:
+            import tracemalloc
+            current, peak = tracemalloc.get_traced_memory()
+            if len(stack) > 0:
+                stack[-1].peak = max(stack[-1].peak, peak)
+            if hasattr(tracemalloc, "reset_peak"):
+                tracemalloc.reset_peak()
+            frame.memory = current
+        stack.append(frame)
+        frame.start = time.perf_counter()
+        return frame
+
+    def _exit(self, frame):
+        elapsed = time.perf_counter() - frame.start
+        stack = _state.stack
+        stack.pop()
+        allocated = retained = None
+        if self.memory:
+            import tracemalloc
+            current, peak = tracemalloc.get_traced_memory()
+            frame.peak = max(frame.peak, peak)
+            retained = current - frame.memory
+            if hasattr(tracemalloc, "reset_peak"):
+                allocated = frame.peak - frame.memory
+        if len(stack) > 0:
+            parent = stack[-1]
+            parent.childRows += frame.rows
+            parent.childTime += elapsed
+            parent.peak = max(parent.peak, frame.peak)
+
+        values = (1, frame.rows, frame.childRows, elapsed, elapsed - frame.childTime, frame.quantityTime,
+                  allocated, retained)
+        with self._lock:
+            _accumulate(self.stats, frame.path, values)
+        if self.callback is not None:
+            fill = getattr(_state, "fill", None)
+            if fill is None:
+                fill = _state.fill = {}
+            _accumulate(fill, frame.path, values)
+            if len(stack) == 0:
+                _state.fill = None
+                self.callback(_records(fill))
+
+    def report(self):
+        """The statistics of each node path as a list of dicts with a ``"path"`` and the ``FIELDS``.
+
+        Times are in seconds, summed over all calls, and nodes are sorted by path, so that each is followed by its
+        sub-aggregators. Memory is ``None`` unless the profile was opened with ``memory=True`` (and the allocated
+        bytes need Python 3.9 or later).
+        """
+        with self._lock:
+            return _records(self.stats)
+
+    def table(self):
+        """The ``report`` as a text table, one line per node path, indented by depth."""
+        lines = ["{0:<48s} {1:>7s} {2:>11s} {3:>11s} {4:>9s} {5:>9s} {6:>9s} {7:>12s}".format(
+            "node", "calls", "rows", "to children", "time", "self", "quantity", "allocated")]
+        for record in self.report():
+            parts = record["path"].split("/")
+            allocated = record["bytesAllocated"]
+            lines.append("{0:<48s} {1:>7d} {2:>11d} {3:>11d} {4:>9.4f} {5:>9.4f} {6:>9.4f} {7:>12s}".format(
+                "  " * (len(parts) - 1) + parts[-1], record["calls"], record["rows"], record["rowsToChildren"],
+                record["time"], record["selfTime"], record["quantityTime"],
+                "" if allocated is None else str(allocated)))
+        return "\n".join(lines)
+
+
+def _accumulate(stats, path, values):
+    old = stats.get(path)
+    if old is None:
+        stats[path] = list(values)
+    else:
+        for i, value in enumerate(values):
+            if value is not None:
+                old[i] = value if old[i] is None else old[i] + value
+
+
+def _records(stats):
+    return [dict(zip(FIELDS, stats[path]), path=path) for path in sorted(stats, key=lambda path: path.split("/"))]
+
+
+def profile(memory=False, callback=None):
+    """Open a ``FillProfile`` for the fills in a ``with`` block (see ``FillProfile`` for the parameters)."""
+    return FillProfile(memory, callback)
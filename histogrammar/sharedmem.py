@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+
+# Copyright 2016 DIANA-HEP
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import math
+import sys
+
+from histogrammar.defs import ContainerException, identity
+from histogrammar.primitives.bin import Bin
+from histogrammar.primitives.categorize import Categorize
+from histogrammar.primitives.count import Count
+from histogrammar.primitives.sparselybin import SparselyBin
+
+
+class SharedHistogram(object):
+    """Counts of a one-dimensional histogram kept in shared memory, to be filled by several worker processes.
+
+    The bins of a ``Bin``, ``SparselyBin`` (within a fixed range of bin indexes) or ``Categorize`` (with a fixed set
+    of categories) of ``Counts`` are laid out as one row of a ``multiprocessing.shared_memory`` array per worker
+    (which needs Python 3.8 or later).
+    Each worker only adds to its own row, so no locking is needed, and the parent process adds the rows up in place
+    to get the histogram, without pickling anything back. Only these flat histograms are supported: trees with other
+    sub-aggregators, or with several levels of binning, are filled in each worker and added up as containers.
+
+    The process that creates a SharedHistogram owns its shared memory; a SharedHistogram pickles as a reference to it,
+    which attaches to the same memory when it is unpickled, e.g. in a worker process. Every process calls ``close``
+    when it is done with it, and the owner calls ``unlink`` (or leaves a ``with`` block) to release it, after the
+    workers are done. On Python before 3.13, workers must be started by the owner (as by ``multiprocessing``), so that
+    they share its resource tracker.
+
+    ::
+
+        shared = SharedHistogram(Bin(100, 0.0, 1.0, "x"), 4)
+        with multiprocessing.Pool(4) as pool:
+            pool.starmap(fillChunk, [(shared, i) for i in range(4)])   # calls shared.fill(i, chunk)
+        histogram = shared.toContainer()
+        shared.unlink()
+    """
+
+    def __init__(self, template, workers, keys=None):
+        """Create the shared memory for ``workers`` worker processes.
+
+        Parameters:
+            template (:doc:`Bin <histogrammar.primitives.bin.Bin>`, :doc:`SparselyBin <histogrammar.primitives.sparselybin.SparselyBin>` or :doc:`Categorize <histogrammar.primitives.categorize.Categorize>`): binning and quantity of the histogram, with plain ``Count`` sub-aggregators.
+            workers (int): number of worker rows.
+            keys (tuple or list): for ``SparselyBin``, the (first, last) bin indexes that can be filled; for ``Categorize``, the categories that can be filled.
+        """  # noqa
+        if sys.version_info < (3, 8):
+            raise NotImplementedError("SharedHistogram needs multiprocessing.shared_memory (Python 3.8 or later)")
+        if not isinstance(workers, int) or workers < 1:
+            raise ValueError("workers ({0}) must be a positive integer".format(workers))
+        self.template = template.zero()
+        self.workers = workers
+        self.keys = self._checkKeys(self.template, keys)
+        self.numCells = self._numCells()
+        self._create()
+
+    def _create(self):
+        from multiprocessing import shared_memory
+
+        # one row per worker; the last cell of each row holds the row's total weight (entries)
+        self._shm = shared_memory.SharedMemory(create=True, size=8 * self.workers * (self.numCells + 1))
+        self._owner = True
+        self._map()
+        self.array[:] = 0.0
+
+    def _attach(self, name):
+        from multiprocessing import shared_memory
+
+        if sys.version_info >= (3, 13):
+            # only the owner tracks the memory, so that it is not released when a worker exits
+            self._shm = shared_memory.SharedMemory(name=name, track=False)
+        else:
+            # registered again with the owner's resource tracker, which releases it only if the owner doesn't
+            self._shm = shared_memory.SharedMemory(name=name)
+        self._owner = False
+        self._map()
+
+    def _map(self):
+        import numpy
+        self.array = numpy.ndarray((self.workers, self.numCells + 1), dtype=numpy.float64, buffer=self._shm.buf)
+
+    @staticmethod
+    def _checkKeys(template, keys):
+        if not all(isinstance(x, Count) and x.transform is identity for x in template.children):
+            raise ContainerException("SharedHistogram sub-aggregators must be Counts without a transform")
+        if isinstance(template, Bin):
+            return None
+        elif isinstance(template, SparselyBin):
+            if keys is None or len(keys) != 2 or keys[0] > keys[1]:
+                raise ValueError("SparselyBin needs keys=(first, last) bin indexes")
+            return (int(keys[0]), int(keys[1]))
+        elif isinstance(template, Categorize):
+            if keys is None or len(keys) == 0:
+                raise ValueError("Categorize needs keys=[categories]")
+            return list(keys)
+        else:
+            raise ContainerException("SharedHistogram only supports Bin, SparselyBin and Categorize, not {0}".format(
+                template.name))
+
+    def _numCells(self):
+        if isinstance(self.template, Bin):
+            # values, underflow, overflow, nanflow
+            return self.template.num + 3
+        elif isinstance(self.template, SparselyBin):
+            # bins, nanflow
+            return self.keys[1] - self.keys[0] + 2
+        else:
+            return len(self.keys)
+
+    def __getstate__(self):
+        return {"template": self.template, "workers": self.workers, "keys": self.keys, "numCells": self.numCells,
+                "name": self._shm.name}
+
+    def __setstate__(self, state):
+        self.template = state["template"]
+        self.workers = state["workers"]
+        self.keys = state["keys"]
+        self.numCells = state["numCells"]
+        self._attach(state["name"])
+
+    def _cells(self, q):
+        import numpy
+        if isinstance(self.template, Categorize):
+            uniques, inverse = numpy.unique(q, return_inverse=True)
+            lookup = dict((k, i) for i, k in enumerate(self.keys))
+            cells = numpy.empty(len(uniques), dtype=numpy.int64)
+            for i, x in enumerate(uniques):
+                if not isinstance(x, str) and (x is None or (isinstance(x, float) and math.isnan(x))):
+                    x = "NaN"
+                if x not in lookup:
+                    raise ValueError("category {0} is not one of the keys of this SharedHistogram".format(repr(x)))
+                cells[i] = lookup[x]
+            return cells[inverse]
+
+        q = numpy.array(q, dtype=numpy.float64)
+        nans = numpy.isnan(q)
+        q[nans] = 0.0
+        if isinstance(self.template, Bin):
+            h = self.template
+            cells = h._npBins(q)
+            cells[q < h.low] = h.num
+            cells[q >= h.high] = h.num + 1
+            cells[nans] = h.num + 2
+        else:
+            h = self.template
+            cells = numpy.floor((q - h.origin) / h.binWidth) - self.keys[0]
+            if not numpy.all((cells >= 0) & (cells <= self.keys[1] - self.keys[0]) | nans):
+                raise ValueError("bin index out of the range {0} of this SharedHistogram".format(self.keys))
+            cells[nans] = self.numCells - 1
+        return numpy.array(cells, dtype=numpy.int64)
+
+    def fill(self, worker, data, weights=1.0):
+        """Add the rows of ``data`` to the row of worker number ``worker`` (like ``fill.numpy``).
+
+        Only one process may fill a given worker row at a time.
+        """
+        import numpy
+        cells = self._cells(self.template.quantity(data))
+        row = self.array[worker]
+        if isinstance(weights, numpy.ndarray):
+            row[:-1] += numpy.bincount(cells, weights=weights, minlength=self.numCells)
+            row[-1] += weights.sum()
+        else:
+            row[:-1] += numpy.bincount(cells, minlength=self.numCells) * weights
+            row[-1] += weights * len(cells)
+
+    def reset(self):
+        """Set all counts of all workers back to zero."""
+        self.array[:] = 0.0
+
+    def toContainer(self):
+        """The histogram that all workers filled together, as an ordinary container."""
+        totals = self.array.sum(axis=0)
+        out = self.template.zero()
+        out.entries = float(totals[-1])
+        if isinstance(out, Bin):
+            for value, x in zip(out.values, totals):
+                value.entries = float(x)
+            out.underflow.entries = float(totals[out.num])
+            out.overflow.entries = float(totals[out.num + 1])
+            out.nanflow.entries = float(totals[out.num + 2])
+        elif isinstance(out, SparselyBin):
+            for i in totals[:-2].nonzero()[0]:
+                out.bins[self.keys[0] + int(i)] = out.value.zero()
+                out.bins[self.keys[0] + int(i)].entries = float(totals[i])
+            out.nanflow.entries = float(totals[-2])
+        else:
+            for i in totals[:-1].nonzero()[0]:
+                out.bins[self.keys[i]] = out.value.zero()
+                out.bins[self.keys[i]].entries = float(totals[i])
+        return out
+
+    def close(self):
+        """Release this process's view of the shared memory."""
+        self.array = None
+        self._shm.close()
+
+    def unlink(self):
+        """Release the shared memory itself (only in the process that created it; elsewhere, the same as close)."""
+        self.close()
+        if self._owner:
+            self._owner = False
+            self._shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.unlink()
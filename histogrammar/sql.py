@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+
+# Copyright 2016 DIANA-HEP
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Filling a tree of aggregators in an SQL database, with one ``GROUP BY`` query (see ``Container.fillsql``).
+
+Each primitive that can be filled this way has an ``_sql(query, weight)`` method, the counterpart of ``_sparksql``:
+it adds the grouping keys of its binning (such as ``floor((x - origin)/binWidth)`` for a ``SparselyBin``) and the
+sums, minima and maxima it needs to an ``SQLQuery`` and returns a function that loads one result row into a container
+of its type. All keys of the tree are grouped together, so every result row is a cell of all binnings at once and
+each aggregator adds up the cells that belong to it.
+
+Quantities, the weights and the ``where`` condition are SQL expressions (strings), which are put into the query as
+they are: they must come from a trusted source. The weight is the SQL counterpart of the weight of ``fill``: rows with
+a weight that is not positive are left out. NULL quantities go into the ``nanflow`` of a binning (or the ``"NaN"``
+category) and are left out of sums, means and extrema. The cut of a ``Select`` multiplies the weight, as in ``fill``;
+in ANSI SQL, conditions are booleans and can't be multiplied, so there the cut must be a condition.
+"""
+
+from histogrammar.util import basestring
+
+# dialects that need a workaround, by the module of their DB-API connection; anything else is ANSI SQL
+DIALECTS = {"sqlite3": "sqlite"}
+
+
+def dialectOf(connection):
+    """SQL dialect of a DB-API connection: ``"sqlite"`` or ``"ansi"``."""
+    return DIALECTS.get(type(connection).__module__.split(".")[0], "ansi")
+
+
+class SQLQuery(object):
+    """Keys and aggregates of a ``GROUP BY`` query, collected from a tree of aggregators.
+
+    Identical keys and aggregates (such as the sum of weights of sub-aggregators with the same weight) are computed
+    once: ``key`` and ``aggregate`` return the index of the expression in the keys and aggregates of a result row.
+    """
+
+    def __init__(self, dialect="ansi"):
+        self.dialect = dialect
+        self.keys = []
+        self.aggregates = []
+
+    def key(self, expr):
+        if expr not in self.keys:
+            self.keys.append(expr)
+        return self.keys.index(expr)
+
+    def aggregate(self, expr):
+        if expr not in self.aggregates:
+            self.aggregates.append(expr)
+        return self.aggregates.index(expr)
+
+    def floor(self, expr):
+        """The integer part of ``expr``, rounded down (SQLite has no ``FLOOR``)."""
+        if self.dialect == "sqlite":
+            return "(CAST({0} AS INTEGER) - (CASE WHEN {0} < CAST({0} AS INTEGER) THEN 1 ELSE 0 END))".format(expr)
+        return "CAST(FLOOR({0}) AS BIGINT)".format(expr)
+
+    def cut(self, expr, weight):
+        """The weight ``weight`` of the rows that pass the cut ``expr`` (zero where the cut is not positive)."""
+        if self.dialect == "sqlite":
+            # conditions are the numbers 0 and 1, so a cut can also be a fraction
+            return positive("{0} * {1}".format(expr, weight))
+        return "(CASE WHEN {0} THEN {1} ELSE 0 END)".format(expr, weight)
+
+    def literal(self, x):
+        return repr(float(x))
+
+    def select(self, table, where=None):
+        """The ``SELECT`` statement: the aggregates first, then the keys."""
+        out = "SELECT {0} FROM {1}".format(", ".join(self.aggregates + self.keys), table)
+        if where is not None:
+            out += " WHERE " + where
+        if len(self.keys) > 0:
+            out += " GROUP BY " + ", ".join(self.keys)
+        return out
+
+
+def positive(weight):
+    """The SQL weight ``weight``, with rows that are not positive set to zero."""
+    return "(CASE WHEN {0} > 0 THEN {0} ELSE 0 END)".format(weight)
+
+
+def number(x):
+    """An aggregate of a result row as a float (the sum of no values is NULL)."""
+    return 0.0 if x is None else float(x)
+
+
+def extremum(x):
+    """A ``MIN`` or ``MAX`` of a result row as a float (of no values: NaN)."""
+    return float("nan") if x is None else float(x)
+
+
+def compileQuery(container, dialect="ansi", weights=None):
+    """The ``SQLQuery`` for filling ``container`` and the function that loads one of its result rows."""
+    query = SQLQuery(dialect)
+    weight = "1" if weights is None else positive("(" + weights + ")")
+    return query, container._sql(query, weight)
+
+
+def fillsql(container, connection, table, weights=None, where=None, dialect=None):
+    """Fill a zero copy of ``container`` by one query on ``table`` through ``connection`` and return it."""
+    if weights is not None and not isinstance(weights, basestring):
+        raise TypeError("weights ({0}) must be an SQL expression (string)".format(weights))
+    query, load = compileQuery(container, dialect or dialectOf(connection), weights)
+    delta = container.zero()
+    numAggregates = len(query.aggregates)
+
+    cursor = connection.cursor()
+    try:
+        cursor.execute(query.select(table, where))
+        for row in cursor.fetchall():
+            load(delta, row[numAggregates:], row[:numAggregates])
+    finally:
+        cursor.close()
+    return delta
+
@@ -19,7 +19,7 @@ import math
 import types
 import sys
 
-import histogrammar.pycparser.c_ast
+import histogrammar
 
 # Definitions for python 2/3 compatability
 if sys.version_info[0] > 2:
@@ -44,30 +44,33 @@ class FillMethod(object):
         self.fill = fill
         self.root = container.fillroot
         self.pycuda = container.fillpycuda
+        self.jit = container.filljit
         self.numpy = container.fillnumpy
         self.sparksql = container.fillsparksql
+        self.sql = container.fillsql
 
     def __call__(self, *args, **kwds):
         return self.fill(*args, **kwds)
 
 
 class PlotMethod(object):
+    # front-ends are looked up when first used, since most containers (e.g. bin contents) are never plotted
+    frontends = ("root", "bokeh", "matplotlib")
+
     def __init__(self, container, plot):
         self.container = container
         self.plot = plot
 
-        try:
-            self.root = container.plotroot
-        except (AttributeError, KeyError):
-            pass
-        try:
-            self.bokeh = container.plotbokeh
-        except (AttributeError, KeyError):
-            pass
-        try:
-            self.matplotlib = container.plotmatplotlib
-        except (AttributeError, KeyError):
-            pass
+    def __getattr__(self, name):
+        if name in PlotMethod.frontends and "container" in self.__dict__:
+            try:
+                method = getattr(self.container, "plot" + name)
+            except (AttributeError, KeyError):
+                pass
+            else:
+                setattr(self, name, method)
+                return method
+        raise AttributeError(name)
 
     def __call__(self, *args, **kwds):
         return self.plot(*args, **kwds)
@@ -219,6 +222,28 @@ def rangeToJson(x):
 
 # function tools
 
+def _npMemo(memo, key, compute, sliceable=False):
+    """Return ``compute()``, evaluated at most once per ``key`` for the rows that ``memo`` belongs to.
+
+    A memo is a dict that ``fillnumpy`` creates for the rows it fills and passes down the ``_numpy`` calls along with
+    them; a memo is only ever used with the rows it was created for. The rows that a parent hands to a sub-aggregator
+    get a new memo, ``{None: (parent memo, row index)}`` (see ``Container._npFillRows``), which is dropped when the
+    sub-aggregator has been filled. If ``sliceable``, the result has one entry per row, and a result that a parent memo
+    already holds is sliced to these rows rather than computed again.
+    """
+    if key not in memo:
+        out = _npMemoSliced(memo, key) if sliceable else None
+        memo[key] = compute() if out is None else out
+    return memo[key]
+
+
+def _npMemoSliced(memo, key):
+    if None not in memo:
+        return None
+    parent, rows = memo[None]
+    out = parent[key] if key in parent else _npMemoSliced(parent, key)
+    return out[rows] if getattr(out, "ndim", 0) >= 1 else None
+
 
 class UserFcn(object):
     """Base trait for user functions.
@@ -275,80 +300,146 @@ class UserFcn(object):
             raise TypeError(
                 "function name must be a string, not {0} (perhaps your arguments are reversed)".format(name))
 
-    def asSparkSQL(self):
-        from pyspark.sql.column import Column
-        if isinstance(self.expr, Column):
-            return self.expr._jc
-        else:
-            raise TypeError("UserFcn is not a SparkSQL Column: " + repr(self))
+    # arrays at least this long are evaluated with numexpr, if it is installed and the expression allows it
+    numexprMinSize = 65536
 
-    def __call__(self, *args, **kwds):
-        if not hasattr(self, "fcn"):
-            if isinstance(self.expr, types.FunctionType):
-                self.fcn = self.expr
+    def _compileString(self):
+        """Compile a string expression once into a function of the datum.
 
-            elif isinstance(self.expr, basestring):
-                c = compile(self.expr, "<string>", "eval")
+        Only the names that the expression references are bound: math functions, numpy and this module's globals
+        are resolved up front, and fields of the datum are looked up by name on each call, rather than copying
+        every column of a DataFrame (or every item of a dict) into a fresh namespace.
+        """
+        import ast
+        import builtins
 
-                # close over this state
-                varname = [None]
+        c = compile(self.expr, "<string>", "eval")
 
-                try:
-                    import numpy
-                except ImportError:
-                    numpy = None
-                try:
-                    import pandas
-                except ImportError:
-                    pandas = None
+        def allnames(code):
+            out = set(code.co_names)
+            for const in code.co_consts:
+                if isinstance(const, types.CodeType):
+                    out.update(allnames(const))
+            return out
 
-                def function(datum):
-                    context = dict(globals())
+        names = allnames(c)
 
-                    # fill the namespace with math.* functions
-                    context.update(math.__dict__)
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+
+        # the namespace is, in increasing order of precedence: this module, math.*, numpy, fields of the datum
+        known = dict(globals())
+        known.update(math.__dict__)
+        if numpy is not None:
+            known["numpy"] = numpy
+            known["np"] = numpy
+        base = dict((n, known[n]) for n in names if n in known)
+        base["__builtins__"] = builtins
+
+        # single-argument functions bind the datum to the one unrecognized name (only discover it once)
+        unknown = set(c.co_names) - set(known)
+        if len(unknown) > 1:
+            varname = NameError("more than one unrecognized variable names in single-argument function: {0}".format(
+                unknown))
+        elif len(unknown) == 0:
+            varname = None
+        else:
+            varname = list(unknown)[0]
 
-                    # if you have Numpy, include numpy.* functions
-                    if numpy is not None:
-                        context["numpy"] = numpy
-                        context["np"] = numpy
+        # simple arithmetic and comparisons on large arrays may be evaluated by numexpr instead of Numpy
+        numexprNames = None
+        try:
+            import numexpr
+        except ImportError:
+            numexpr = None
+        else:
+            # before Python 3.8, literals are parsed as ast.Num, ast.Str, ... instead of ast.Constant
+            literal = ast.Constant if sys.version_info >= (3, 8) else ast.Num
+            allowed = (ast.Expression, ast.BinOp, ast.UnaryOp, ast.Compare, ast.Name, literal, ast.Load,
+                       ast.Add, ast.Sub, ast.Mult, ast.Div, ast.Pow, ast.USub, ast.UAdd, ast.Invert,
+                       ast.BitAnd, ast.BitOr, ast.Eq, ast.NotEq, ast.Lt, ast.LtE, ast.Gt, ast.GtE)
+            nodes = list(ast.walk(ast.parse(self.expr.strip(), mode="eval")))
+            if all(isinstance(x, allowed) for x in nodes) and \
+                    all(isinstance(ast.literal_eval(x), (int, float)) for x in nodes if isinstance(x, literal)):
+                numexprNames = set(x.id for x in nodes if isinstance(x, ast.Name))
+
+        minSize = self.numexprMinSize
+
+        def bind(datum):
+            # if the datum is a dict, use its items as variables
+            if isinstance(datum, dict):
+                return dict((n, datum[n]) for n in names if n in datum)
+
+            # if the datum is a Numpy record array, use its field names
+            if numpy is not None and isinstance(datum, numpy.core.records.recarray):
+                return dict((n, datum[n]) for n in names if n in datum.dtype.names)
+
+            # if the datum is a Pandas DataFrame, use its column names (only if Pandas is in use at all)
+            pandas = sys.modules.get("pandas")
+            if pandas is not None and isinstance(datum, pandas.DataFrame):
+                columns = datum.columns
+                return dict((n, datum[n].values) for n in names if n in columns)
+
+            # try to use its attributes as variables; otherwise, use the one and only variable as the object
+            try:
+                attributes = datum.__dict__
+            except AttributeError:
+                if isinstance(varname, Exception):
+                    raise varname
+                return {} if varname is None else {varname: datum}
+            else:
+                return dict((n, attributes[n]) for n in names if n in attributes)
 
-                    # if the datum is a dict, override the namespace with its dict keys
-                    if isinstance(datum, dict):                # if it's a dict
-                        context.update(datum)                  # use its items as variables
+        def function(datum):
+            bound = bind(datum)
 
-                    # if the datum is a Numpy record array, override the namespace with its field names
-                    elif numpy is not None and isinstance(datum, numpy.core.records.recarray):
-                        context.update(dict((n, datum[n]) for n in datum.dtype.names))
+            if numexprNames and numexprNames.issubset(bound) and \
+                    all(isinstance(bound[n], numpy.ndarray) and bound[n].dtype.kind in "biuf" and
+                        bound[n].shape == (len(bound[n]),) and len(bound[n]) >= minSize for n in numexprNames):
+                try:
+                    return numexpr.evaluate(self.expr, local_dict=bound, global_dict={})
+                except Exception:
+                    pass
 
-                    # if the datum is a Pandas DataFrame, override the namespace with its column names
-                    elif pandas is not None and isinstance(datum, pandas.core.frame.DataFrame):
-                        context.update(dict((n, datum[n].values) for n in datum.columns))
+            if len(bound) == 0:
+                return eval(c, base)
+            context = dict(base)
+            context.update(bound)
+            return eval(c, context)
 
-                    else:
-                        try:
-                            context.update(datum.__dict__)     # try to use its attributes as variables
-                        except AttributeError:
-                            v, = varname                       # otherwise, use the one and only variable
-                            if v is None:                      # as the object (only discover it once)
-                                v = set(c.co_names) - set(context.keys())
-                                if len(v) > 1:
-                                    raise NameError(
-                                        "more than one unrecognized variable names in single-argument "
-                                        "function: {0}".format(set(c.co_names) - set(context.keys())))
-                                elif len(v) == 0:
-                                    v = None
-                                else:
-                                    v = list(v)[0]
+        return function
 
-                                varname[0] = v
+    def asSparkSQL(self):
+        from pyspark.sql.column import Column
+        if isinstance(self.expr, Column):
+            return self.expr._jc
+        else:
+            raise TypeError("UserFcn is not a SparkSQL Column: " + repr(self))
 
-                            if v is not None:
-                                context.update({v: datum})
+    def asSQL(self):
+        if isinstance(self.expr, basestring):
+            return "(" + self.expr + ")"
+        else:
+            raise TypeError("UserFcn is not an SQL expression (string): " + repr(self))
 
-                    return eval(c, context)
+    def __call__(self, *args, **kwds):
+        return self._call(*args, **kwds)
 
-                self.fcn = function
+    def _memoKey(self):
+        if isinstance(self.expr, (basestring, types.FunctionType)):
+            return self.expr
+        else:
+            return self
+
+    def _call(self, *args, **kwds):
+        if not hasattr(self, "fcn"):
+            if isinstance(self.expr, types.FunctionType):
+                self.fcn = self.expr
+
+            elif isinstance(self.expr, basestring):
+                self.fcn = self._compileString()
 
             elif self.expr is None:
                 raise TypeError("immutable container (created from JSON or .ed) cannot be filled")
@@ -434,7 +525,7 @@ class CachedFcn(UserFcn):
         else:
             self.lastArgs = args
             self.lastKwds = kwds
-            self.lastReturn = super(CachedFcn, self).__call__(*args, **kwds)
+            self.lastReturn = self._call(*args, **kwds)
             return self.lastReturn
 
     def __repr__(self):
@@ -514,6 +605,59 @@ def named(name, fcn):
         return UserFcn(fcn, name)
 
 
+def _pathLabel(container):
+    """Label of a container in a path through a tree (as in reports): its name, with its quantity's name if any."""
+    name = getattr(getattr(container, "quantity", None), "name", None)
+    if name is None:
+        return container.name
+    return "{0}({1})".format(container.name, name)
+
+
+def _deepSizeOf(obj, seen):
+    """Bytes of ``obj`` and of all that it refers to, skipping (and adding to) the object ids in ``seen``.
+
+    Classes, modules, the globals of functions and the functions of bound methods are shared by the whole program,
+    so they are not counted. Numpy arrays count their data (through their base, for views).
+    """
+    numpy = sys.modules.get("numpy")
+    total = 0
+    stack = [obj]
+    while len(stack) > 0:
+        x = stack.pop()
+        if x is None or id(x) in seen or isinstance(x, (type, types.ModuleType)):
+            continue
+        seen.add(id(x))
+        total += sys.getsizeof(x)
+
+        if isinstance(x, dict):
+            stack.extend(x.keys())
+            stack.extend(x.values())
+        elif isinstance(x, (list, tuple, set, frozenset)):
+            stack.extend(x)
+        elif isinstance(x, (basestring, bytes, int, float, complex, types.MethodType, types.CodeType)):
+            pass
+        elif isinstance(x, types.FunctionType):
+            stack.extend([x.__code__, x.__defaults__, x.__kwdefaults__, getattr(x, "__dict__", None)])
+            stack.extend(cell.cell_contents for cell in x.__closure__ or () if _cellFull(cell))
+        elif numpy is not None and isinstance(x, numpy.ndarray):
+            stack.append(x.base)
+        else:
+            stack.append(getattr(x, "__dict__", None))
+            for cls in type(x).__mro__:
+                slots = cls.__dict__.get("__slots__", ())
+                stack.extend(getattr(x, name) for name in ([slots] if isinstance(slots, str) else slots)
+                             if hasattr(x, name))
+    return total
+
+
+def _cellFull(cell):
+    try:
+        cell.cell_contents
+    except ValueError:
+        return False
+    return True
+
+
 def get_n_dim(hist, itr=0):
     """Histogram dimension
 
@@ -528,7 +672,7 @@ def get_n_dim(hist, itr=0):
     elif isinstance(hist, histogrammar.Bag):
         return hist.dimension if hist.dimension > 0 else 1
     elif isinstance(hist, (histogrammar.Maximize, histogrammar.Minimize, histogrammar.Average,
-                           histogrammar.Deviate, histogrammar.Sum)):
+                           histogrammar.Deviate, histogrammar.Sum, histogrammar.CountDistinct)):
         return 1 if itr == 0 else 0
     # histogram has a sub-histogram. Extract it and recurse dimension
     sub_hist = _get_sub_hist(hist)
@@ -555,7 +699,7 @@ def get_datatype(hist, itr=0):
             return [np.number] * hist.dimension
         return [str] if hist.range == 'S' else [np.number]
     elif isinstance(hist, (histogrammar.Maximize, histogrammar.Minimize, histogrammar.Average,
-                           histogrammar.Deviate, histogrammar.Sum)):
+                           histogrammar.Deviate, histogrammar.Sum, histogrammar.CountDistinct)):
         # return if data type has already been determined from parent histogram
         if itr > 0:
             return []
@@ -578,7 +722,7 @@ def get_datatype(hist, itr=0):
 
     # from here histogram has a sub-histogram. (get it below and recurse.)
     datatype = []
-    if isinstance(hist, histogrammar.Categorize):
+    if isinstance(hist, (histogrammar.Categorize, histogrammar.TopK)):
         # type of input histogram is a string or bool.
         if len(hist.bins) > 0:
             keys = list(hist.bins.keys())
@@ -625,8 +769,8 @@ def _get_sub_hist(hist):
     """
     # if histogram has a sub-histogram, extract and return it
     # sub hists are only possible for the following hists
-    if isinstance(hist, histogrammar.Categorize):
-        sub_hist = hist.values[0] if hist.values else hist.value
+    if isinstance(hist, (histogrammar.Categorize, histogrammar.TopK)):
+        sub_hist = next(iter(hist.bins.values())) if hist.bins else hist.value
     elif isinstance(hist, histogrammar.Bin):
         if hist.entries > 0:
             # pick first sub-hist found that is filled
@@ -634,10 +778,12 @@ def _get_sub_hist(hist):
             sub_hist = hist.values[idx]
         else:
             sub_hist = hist.values[0] if hist.values else histogrammar.Count()
-    elif isinstance(hist, (histogrammar.SparselyBin, histogrammar.CentrallyBin)):
-        sub_hist = list(dict(hist.bins).values())[0] if hist.bins else hist.value
+    elif isinstance(hist, histogrammar.SparselyBin):
+        sub_hist = next(iter(hist.bins.values())) if hist.bins else hist.value
+    elif isinstance(hist, histogrammar.CentrallyBin):
+        sub_hist = hist.bins[0][1] if hist.bins else hist.value
     elif isinstance(hist, (histogrammar.IrregularlyBin, histogrammar.Stack)):
-        sub_hist = list(dict(hist.bins).values())[0] if hist.bins else histogrammar.Count()
+        sub_hist = hist.bins[0][1] if hist.bins else histogrammar.Count()
     elif isinstance(hist, histogrammar.Fraction):
         sub_hist = hist.denominator if hist.denominator else histogrammar.Count()
     elif isinstance(hist, histogrammar.Select):
@@ -19,6 +19,7 @@ import inspect
 
 modules = [
     "histogrammar.defs",
+    "histogrammar.sharedmem",
     "histogrammar.specialized",
     "histogrammar.util",
     "histogrammar.version",
@@ -29,6 +30,7 @@ modules = [
     "histogrammar.primitives.centrallybin",
     "histogrammar.primitives.collection",
     "histogrammar.primitives.count",
+    "histogrammar.primitives.countdistinct",
     "histogrammar.primitives.deviate",
     "histogrammar.primitives.fraction",
     "histogrammar.primitives.irregularlybin",
@@ -37,6 +39,7 @@ modules = [
     "histogrammar.primitives.sparselybin",
     "histogrammar.primitives.stack",
     "histogrammar.primitives.sum",
+    "histogrammar.primitives.topk",
     "histogrammar.plot.bokeh",
     "histogrammar.plot.root",
 ]
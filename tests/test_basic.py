@@ -19,7 +19,7 @@ import pickle
 import sys
 import unittest
 
-from histogrammar.defs import Factory
+from histogrammar.defs import ContainerException, Factory
 from histogrammar.primitives.average import Average
 from histogrammar.primitives.bag import Bag
 from histogrammar.primitives.bin import Bin
@@ -141,6 +141,11 @@ class TestBasic(unittest.TestCase):
 
     def checkPickle(self, x):
         self.assertEqual(pickle.loads(pickle.dumps(x)), x)
+        if pickle.HIGHEST_PROTOCOL >= 5:
+            self.assertEqual(pickle.loads(pickle.dumps(x, protocol=5)), x)
+            buffers = []
+            self.assertEqual(pickle.loads(pickle.dumps(x, protocol=5, buffer_callback=buffers.append),
+                                          buffers=buffers), x)
 
     def checkName(self, x):
         repr(x)
@@ -170,6 +175,8 @@ class TestBasic(unittest.TestCase):
         self.testPlotProfileErr()
         self.testPlotStack()
         self.testSparselyBin()
+        if pickle.HIGHEST_PROTOCOL >= 5:
+            self.testPickleColumns()
         self.testCentrallyBin()
         self.testFraction()
         self.testFractionSum()
@@ -187,6 +194,7 @@ class TestBasic(unittest.TestCase):
         self.testIndex()
         self.testIndexDifferentCuts()
         self.testBranch()
+        self.testCrossReferences()
         # self.testAggregate()
 
     # Count
@@ -744,6 +752,12 @@ class TestBasic(unittest.TestCase):
         self.checkPickle(two)
         self.checkName(two)
 
+        # the largest value below high is in the last bin, although num * (x - low) / (high - low) rounds to num
+        edge = Bin(10, -3.0, 3.0, named("xaxis", lambda x: x))
+        self.assertEqual(edge.bin(3.0 - 2 ** -51), 9)
+        edge.fill(3.0 - 2 ** -51)
+        self.assertEqual(edge.values[9].entries, 1.0)
+
     def testBinWithSum(self):
         one = Bin(5, -3.0, 7.0, named("xaxis", lambda x: x), Sum(named("yaxis", lambda x: 10.0)),
                   Sum(lambda x: 10.0), Sum(lambda x: 10.0), Sum(lambda x: 10.0))
@@ -903,6 +917,22 @@ class TestBasic(unittest.TestCase):
         self.assertEqual(len(entries), 2)
         self.assertEqual(list(entries), [0, 0])
 
+    @unittest.skipIf(pickle.HIGHEST_PROTOCOL < 5, "pickle protocol 5 needs Python 3.8")
+    def testPickleColumns(self):
+        hist = SparselyBin(0.01, named("something", lambda x: x), Deviate(named("elsie", lambda x: x)))
+        for i in xrange(1000):
+            hist.fill(math.sin(i))
+
+        buffers = []
+        pickled = pickle.dumps(hist, protocol=5, buffer_callback=buffers.append)
+        self.assertEqual(len(buffers), 4)  # keys, entries, mean, varianceTimesEntries
+        self.assertLess(len(pickled), len(pickle.dumps(hist, protocol=4)) / 5)
+
+        unpickled = pickle.loads(pickled, buffers=buffers)
+        self.assertEqual(unpickled, hist)
+        self.assertEqual(unpickled.toJson(), hist.toJson())
+        self.assertTrue(all(v.quantity is unpickled.value.quantity for v in unpickled.bins.values()))
+
     # CentrallyBin
 
     def testCentrallyBin(self):
@@ -1245,3 +1275,21 @@ class TestBasic(unittest.TestCase):
         self.checkJson(branching)
         self.checkPickle(branching)
         self.checkName(branching)
+
+    def testCrossReferences(self):
+        shared = Count()
+        self.assertRaises(ContainerException, lambda: Label(a=shared, b=shared).fill(1.0))
+        self.assertRaises(ContainerException, lambda: Branch(Select(named("x", lambda x: x > 0.0), shared),
+                                                             shared).fill(1.0))
+
+        # a histogram that has already been filled is checked again as part of a new tree
+        histogram = SparselyBin(1.0, named("x", lambda x: x))
+        histogram.fill(1.0)
+        self.assertRaises(ContainerException, lambda: UntypedLabel(a=histogram, b=histogram).fill(1.0))
+
+        # copies share neither bins nor anything else that is filled (only the template for new bins)
+        both = UntypedLabel(a=histogram, b=histogram.copy(), c=histogram.zero(), d=histogram + histogram)
+        both.fill(1.0)
+        self.assertEqual(histogram.bins[1].entries, 2.0)
+        self.assertEqual(both("b").bins[1].entries, 2.0)
+        self.assertEqual(both("d").bins[1].entries, 3.0)
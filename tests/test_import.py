@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+
+# Copyright 2016 DIANA-HEP
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import subprocess
+import sys
+import unittest
+
+# milliseconds that the modules of histogrammar itself may take to import, not counting numpy, pandas and other
+# dependencies (a generous budget: it takes much less, but loading the C parser eagerly takes more)
+IMPORT_BUDGET = 150
+
+
+class TestImport(unittest.TestCase):
+    def importHistogrammar(self, code="", before=""):
+        """Import histogrammar in a fresh interpreter (after ``before``); returns the output of ``code``."""
+        process = subprocess.run([sys.executable, "-c", before + "import histogrammar\n" + code],
+                                 stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True, check=True)
+        return process.stdout
+
+    def testLazyModules(self):
+        out = self.importHistogrammar(
+            "import sys\n"
+            "print(sorted(m for m in ('tqdm', 'histogrammar.pycparser', 'histogrammar.parsing',\n"
+            "                         'histogrammar.dfinterface.make_histograms', 'matplotlib', 'bokeh')\n"
+            "             if m in sys.modules))")
+        self.assertEqual(out.strip(), "[]")
+
+    def testImportTime(self):
+        process = subprocess.run([sys.executable, "-X", "importtime", "-c", "import histogrammar"],
+                                 stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True, check=True)
+        selfTime = 0
+        for line in process.stderr.splitlines():
+            if line.startswith("import time:") and "|" in line:
+                own, _, name = line[len("import time:"):].split("|")
+                if own.strip().isdigit() and name.strip().startswith("histogrammar"):
+                    selfTime += int(own)
+        self.assertLess(selfTime / 1000.0, IMPORT_BUDGET)
+
+    def testNoImportHooks(self):
+        out = self.importHistogrammar(
+            "import sys\nprint([f for f in sys.meta_path if type(f).__module__.startswith('histogrammar')])")
+        self.assertEqual(out.strip(), "[]")
+
+    def testDataFrameMethods(self):
+        try:
+            import pandas  # noqa
+        except ImportError:
+            self.skipTest("pandas is not installed")
+        code = ("df = pandas.DataFrame({'x': [0.5, 1.5, 1.5]})\n"
+                "print(df.hg_Bin(2, 0.0, 2.0, 'x').values[1].entries)\n"
+                "print(sorted(df.hg_make_histograms(features=['x'], bin_specs={'x': {'num': 2, 'low': 0.0, "
+                "'high': 2.0}}, sinks=[])))")
+        # pandas imported before or after histogrammar (as in the tutorial notebooks)
+        for out in (self.importHistogrammar(code, before="import pandas\n"),
+                    self.importHistogrammar("import pandas\n" + code)):
+            self.assertEqual(out.split(), ["2.0", "['x']"])
@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+
+# Copyright 2016 DIANA-HEP
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+
+from histogrammar.defs import Container, ContainerException, Factory
+from histogrammar.primitives.average import Average
+from histogrammar.primitives.bin import Bin
+from histogrammar.primitives.categorize import Categorize
+from histogrammar.primitives.centrallybin import CentrallyBin
+from histogrammar.primitives.collection import Branch, Index, Label, UntypedLabel
+from histogrammar.primitives.count import Count
+from histogrammar.primitives.deviate import Deviate
+from histogrammar.primitives.fraction import Fraction
+from histogrammar.primitives.irregularlybin import IrregularlyBin
+from histogrammar.primitives.minmax import Minimize, Maximize
+from histogrammar.primitives.select import Select
+from histogrammar.primitives.sparselybin import SparselyBin
+from histogrammar.primitives.stack import Stack
+from histogrammar.primitives.sum import Sum
+from histogrammar.util import named
+from histogrammar import util
+from tests.test_numpy import makeSamples
+
+tolerance = 1e-5
+util.relativeTolerance = tolerance
+util.absoluteTolerance = tolerance
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+
+@unittest.skipIf(numba is None, "numba is not installed")
+class TestNumba(unittest.TestCase):
+    SIZE = 1000
+    HOLES = 10
+    data = makeSamples(SIZE, HOLES)
+    positive = data["positive"]
+    boolean = data["boolean"]
+    noholes = data["noholes"]
+    withholes = data["withholes"]
+
+    def compare(self, hjit, weights=1.0):
+        hpy = hjit.copy()
+        arrays = {"positive": self.positive, "boolean": self.boolean, "noholes": self.noholes,
+                  "withholes": self.withholes}
+
+        for i in range(2):
+            hjit.fill.jit(arrays, weights=weights)
+            for j in range(self.SIZE):
+                w = weights if isinstance(weights, float) else float(weights[j])
+                hpy.fill(dict((k, v[j].item()) for k, v in arrays.items()), w)
+            self.assertEqual(Factory.fromJson(hjit.toJson()), Factory.fromJson(hpy.toJson()))
+
+    def testLeaves(self):
+        self.compare(UntypedLabel(count=Count(),
+                                  transformed=Count("0.5 * weight"),
+                                  sum=Sum("noholes"),
+                                  average=Average("withholes"),
+                                  deviate=Deviate("withholes"),
+                                  minimize=Minimize("noholes"),
+                                  maximize=Maximize("withholes")))
+
+    def testWeights(self):
+        self.compare(Bin(10, -3.0, 3.0, "noholes", Deviate("withholes")), weights=self.positive - 1.0)
+
+    def testBinning(self):
+        self.compare(UntypedLabel(bin=Bin(10, -3.0, 3.0, "withholes", Count(), Count(), Count(), Count()),
+                                  centrallybin=CentrallyBin([-1.0, 0.0, 1.0], "withholes", Sum("noholes")),
+                                  irregularlybin=IrregularlyBin([-1.0, 0.0, 1.0], "withholes", Average("noholes")),
+                                  stack=Stack([-1.0, 0.0, 1.0], "withholes")))
+
+    def testBinEdges(self):
+        # rounding puts values just below high at num, and values at an inner edge differ between the expressions
+        import numpy
+        values = numpy.array([3.0 - 2 ** -51, numpy.nextafter(3.0, -numpy.inf), -3.0, 3.0] +
+                             [numpy.nextafter(x, -numpy.inf) for x in numpy.linspace(-3.0, 3.0, 11)] +
+                             list(numpy.linspace(-3.0, 3.0, 11)))
+        for h in Bin(10, -3.0, 3.0, "x"), Bin(10, -3.0, 3.0, "x", Sum("x")):
+            hjit, hnumpy, hpy = h.copy(), h.copy(), h.copy()
+            hjit.fill.jit({"x": values})
+            hnumpy.fill.numpy({"x": values})
+            for x in values:
+                hpy.fill({"x": float(x)})
+            self.assertEqual(Factory.fromJson(hjit.toJson()), Factory.fromJson(hpy.toJson()))
+            self.assertEqual(Factory.fromJson(hnumpy.toJson()), Factory.fromJson(hpy.toJson()))
+            self.assertEqual(hjit.values[9].entries, 3.0)
+
+    def testSparselyBin(self):
+        self.compare(SparselyBin(0.5, "withholes", SparselyBin(0.1, "noholes", Minimize("positive"))))
+
+    def testCuts(self):
+        self.compare(Branch(Select("boolean", Bin(10, -3.0, 3.0, "noholes")),
+                            Fraction("noholes > 0.5", Sum("positive")),
+                            Index(Count(), Count()),
+                            Label(x=Bin(5, 0.0, 1.0, "sqrt(positive)"), y=Bin(5, 0.0, 1.0, "abs(noholes)"))))
+
+    def testFunctionQuantity(self):
+        self.compare(Bin(10, -3.0, 3.0, named("noholes", lambda d: d["noholes"]), Sum("positive")))
+
+    def testKernelCache(self):
+        Bin(7, -3.0, 3.0, "noholes").fill.jit(noholes=self.noholes)
+        numKernels = len(Container._numbaKernels)
+        h = Bin(7, -3.0, 3.0, "noholes")
+        h.fill.jit(noholes=self.noholes)
+        self.assertEqual(len(Container._numbaKernels), numKernels)
+        self.assertEqual(h.entries, self.SIZE)
+
+        # only the most recently used kernels are kept
+        kernels, maxKernels = Container._numbaKernels.copy(), Container._numbaKernelsMax
+        Container._numbaKernelsMax = 2
+        try:
+            for numBins in (3, 4, 5, 4, 6):
+                Bin(numBins, -3.0, 3.0, "noholes").fill.jit(noholes=self.noholes)
+            self.assertEqual(sorted(n for n in (3, 4, 5, 6) for source in Container._numbaKernels
+                                    if "range({0})".format(n) in source), [4, 6])
+        finally:
+            Container._numbaKernels.clear()
+            Container._numbaKernels.update(kernels)
+            Container._numbaKernelsMax = maxKernels
+
+    def testErrors(self):
+        self.assertRaises(ContainerException, lambda: Bin(10, -3.0, 3.0, "missing").fill.jit(noholes=self.noholes))
+        self.assertRaises(NotImplementedError, lambda: Categorize("noholes").fill.jit(noholes=self.noholes))
+        self.assertRaises(ValueError, lambda: Sum("noholes").fill.jit(noholes=self.noholes,
+                                                                      weights=self.positive[:10]))
@@ -23,7 +23,7 @@ import unittest
 import numpy
 
 import histogrammar as hg
-from histogrammar.defs import Factory
+from histogrammar.defs import ContainerException, Factory
 from histogrammar.primitives.average import Average
 from histogrammar.primitives.bag import Bag
 from histogrammar.primitives.bin import Bin
@@ -650,6 +650,19 @@ class TestPandas(unittest.TestCase):
         self.test_bin_width()
         self.test_irregular()
         self.test_centrally()
+        self.test_string_quantity()
+        self.test_fill_memo()
+        self.test_scalar_weights()
+        self.test_compacted_rows()
+        self.test_threaded_fill()
+        self.test_cloned_bins()
+        self.test_cached_metadata()
+        self.test_bag()
+        self.test_topk()
+        self.test_count_distinct()
+        self.test_profile()
+        self.test_estimate()
+        self.test_nbytes()
 
     def test_n_dim(self):
         """ Test dimension assigned to a histogram
@@ -1028,3 +1041,629 @@ class TestPandas(unittest.TestCase):
         np.testing.assert_array_equal(h.bin_edges(5, 110), [5., 15., 30., 70., float('inf')])
         np.testing.assert_array_equal(h.bin_centers(5, 110), [10., 20., 40., 100.])
         assert h.num_bins(5, 110) == 4
+
+    def test_string_quantity(self):
+        """ Test string quantities evaluated on dataframes, dicts and single variables"""
+        import numpy as np
+        import pandas as pd
+        from histogrammar.util import UserFcn
+
+        df = pd.DataFrame({"x": np.arange(10.0), "y": np.arange(10.0) % 3, "z": ["a"] * 10})
+        np.testing.assert_array_equal(UserFcn("x*y+2")(df), df["x"].values * df["y"].values + 2)
+        np.testing.assert_array_equal(UserFcn("np.sqrt(x) + pi")(df), np.sqrt(df["x"].values) + np.pi)
+        np.testing.assert_array_equal(UserFcn("x > y")({"x": df["x"].values, "y": 4.0}), df["x"].values > 4.0)
+        assert UserFcn("sqrt(q)")(16.0) == 4.0
+
+        h1 = hg.SparselyBin(1.0, "x*y+2")
+        h1.fill.numpy(df)
+        h2 = hg.SparselyBin(1.0, lambda d: (d["x"] * d["y"] + 2).values)
+        h2.fill.numpy(df)
+        assert sorted(h1.bins) == sorted(h2.bins)
+        np.testing.assert_array_equal(h1.bin_entries(), h2.bin_entries())
+
+        try:
+            import numexpr  # noqa
+        except ImportError:
+            return
+        # expressions with number literals are evaluated by numexpr on every Python version
+        evaluated = []
+        evaluate = numexpr.evaluate
+        numexpr.evaluate = lambda *args, **kwds: evaluated.append(args[0]) or evaluate(*args, **kwds)
+        try:
+            f = UserFcn("(x*y+2) / (y + 1.5)")
+            f.numexprMinSize = 0
+            np.testing.assert_array_almost_equal(f(df), (df["x"].values * df["y"].values + 2) / (df["y"].values + 1.5))
+            g = UserFcn("x + len('ab')")
+            g.numexprMinSize = 0
+            np.testing.assert_array_almost_equal(g(df), df["x"].values + 2)
+        finally:
+            numexpr.evaluate = evaluate
+        assert evaluated == ["(x*y+2) / (y + 1.5)"]
+
+    def test_fill_memo(self):
+        """ Test that quantities are evaluated once per fill, and once per memo shared among fills"""
+        import numpy as np
+
+        calls = []
+
+        def quantity(data):
+            calls.append(1)
+            return data * 2.0
+
+        data = np.arange(100.0)
+        h = hg.Label(a=hg.Bin(10, 0, 200, quantity), b=hg.Bin(20, 0, 200, quantity),
+                     c=hg.Bin(5, 0, 200, quantity, hg.Average(quantity)))
+        h.fill.numpy(data)
+        # the Averages in the bins of c slice the result for all rows
+        assert len(calls) == 1
+        assert h("c").values[0].mean == 19.0
+        np.testing.assert_array_equal(h("a").bin_entries(), [10.0] * 10)
+
+        # a memo is shared by fills of the same rows, here column subsets of one DataFrame
+        import pandas as pd
+        df = pd.DataFrame({"x": data, "y": -data})
+
+        def column(df):
+            calls.append(1)
+            return df["x"].values * 2.0
+
+        h2, h3 = hg.Bin(10, 0, 200, column), hg.Bin(10, 0, 200, column)
+        memo = {}
+        h2.fill.numpy(df[["x"]], memo=memo)
+        h3.fill.numpy(df, memo=memo)
+        assert len(calls) == 2
+        h3.fill.numpy(df)
+        assert len(calls) == 3
+        np.testing.assert_array_equal(h3.bin_entries(), [20.0] * 10)
+
+        # the memo only keeps results for its own rows; those of the rows handed to sub-aggregators are dropped
+        inner = []
+        memo = {}
+        h4 = hg.Bin(10, 0, 100, lambda d: d, hg.Bin(2, 0, 100, lambda d: inner.append(1) or d))
+        h4.fill.numpy(data, memo=memo)
+        assert len(memo) == 1 and len(inner) == 10
+
+        # outside of fills, quantities are evaluated on every call
+        fcn = hg.util.serializable(quantity)
+        fcn(data)
+        fcn(data)
+        assert len(calls) == 5
+
+    def test_scalar_weights(self):
+        """ Test that a scalar weight fills the same as an array of that weight"""
+        import numpy as np
+        import pandas as pd
+
+        df = pd.DataFrame({"x": np.random.normal(0, 1, 1000), "c": np.random.choice(["a", "b", "c"], 1000)})
+        df.loc[::50, "x"] = np.nan
+        h = hg.Branch(hg.Bin(10, -2.0, 2.0, "x", hg.Deviate("x"), hg.Count(), hg.Count(), hg.Sum("x")),
+                      hg.SparselyBin(0.5, "x", hg.Categorize("c", hg.Average("x"))),
+                      hg.Categorize("c", hg.Count("0.5 * weight")),
+                      hg.Select("x > 0", hg.CentrallyBin([-1.0, 0.0, 1.0], "x", hg.Minimize("x"))),
+                      hg.Fraction("x > 0", hg.Stack([-1.0, 0.0, 1.0], "x")),
+                      hg.IrregularlyBin([-1.0, 0.0, 1.0], "x", hg.Maximize("x")))
+        for w in [1.0, 2.5, -1.0]:
+            h1 = h.copy()
+            h1.fill.numpy(df, weights=w)
+            h2 = h.copy()
+            h2.fill.numpy(df, weights=np.full(len(df), w))
+            assert h1 == h2
+
+    def test_compacted_rows(self):
+        """ Test that sub-aggregators only see the rows that reach them"""
+        import numpy as np
+
+        seen = []
+
+        def quantity(data):
+            seen.append(len(data["x"]))
+            return data["x"]
+
+        data = {"x": np.arange(100.0), "c": np.arange(100) % 10 == 0}
+        h = hg.Select("c", hg.Bin(5, 0.0, 100.0, "x", hg.Sum(quantity)))
+        for weights in [1.0, np.ones(100)]:
+            del seen[:]
+            h.fill.numpy(data, weights=weights)
+            assert sorted(seen) == [2] * 5
+        np.testing.assert_array_equal([v.sum for v in h.cut.values], [20.0, 100.0, 180.0, 260.0, 340.0])
+
+        # the rows of a wide DataFrame are only sliced for sub-aggregators that read them
+        import pandas as pd
+        df = pd.DataFrame(dict(("c{0}".format(i), np.arange(100.0)) for i in range(50)), copy=True)
+        df["x"] = np.arange(100.0)
+        sliced = []
+        original = hg.Container._npSliceData
+
+        def slicing(self, data, rows, length):
+            sliced.append(len(rows))
+            return original(self, data, rows, length)
+        hg.Container._npSliceData = slicing
+        try:
+            counts = hg.SparselyBin(10.0, "x")
+            counts.fill.numpy(df, weights=np.ones(100))
+            assert sliced == [] and counts.entries == 100.0
+            sums = hg.SparselyBin(10.0, "x", hg.Sum("x"))
+            sums.fill.numpy(df, weights=np.ones(100))
+            assert sliced == [10] * 10
+        finally:
+            hg.Container._npSliceData = original
+        assert [v.sum for v in sums.bins.values()] == [45.0 + 100.0 * i for i in range(10)]
+
+    def test_threaded_fill(self):
+        """ Test that filling chunks on several threads gives the same result as one fill"""
+        import numpy as np
+        import pandas as pd
+
+        df = pd.DataFrame({"x": np.random.randint(-10, 10, 10000).astype(float),
+                           "y": np.random.randint(0, 5, 10000).astype(float)})
+        h = hg.Branch(hg.SparselyBin(2.0, "x", hg.Sum("y")), hg.Bin(5, -10, 10, "x", hg.Categorize("y")),
+                      hg.Bag("y", "N"))
+        h1 = h.copy()
+        h1.fill.numpy(df, weights=df["y"].values)
+        h2 = h.copy()
+        h2.numpyChunkRows = 1000
+        h2.fill.numpy(df, weights=df["y"].values, n_threads=3)
+        assert h1 == h2
+        assert h2.entries == df["y"].sum()
+
+    def test_cloned_bins(self):
+        """ Test that bins created from a template by a numpy fill are independent, fillable containers"""
+        import numpy as np
+
+        x = np.random.randint(0, 50, 1000).astype(float)
+        h = hg.SparselyBin(1.0, "x", hg.Bin(5, 0.0, 1.0, "y", hg.Sum("y")))
+        h.fill.numpy({"x": x, "y": x / 50.0})
+        expected = hg.SparselyBin(1.0, "x", hg.Bin(5, 0.0, 1.0, "y", hg.Sum("y")))
+        for xi in x:
+            expected.fill({"x": xi, "y": xi / 50.0})
+        assert h == expected
+
+        one, two = [h.bins[k] for k in sorted(h.bins)[:2]]
+        assert one.values[0] is not two.values[0] and one.nanflow is not two.nanflow
+        assert one.fill.container is one and one.values[0].fill.container is one.values[0]
+        before = two.entries
+        one.fill({"y": 0.5})
+        assert two.entries == before
+        assert h.value.entries == 0
+
+    def test_cached_metadata(self):
+        """ Test that bin arrays and properties follow fills, merges and direct changes"""
+        import numpy as np
+
+        h = hg.SparselyBin(1.0, "x", hg.Bin(4, 0.0, 1.0, "y"))
+        h.fill.numpy({"x": np.array([0.5, 1.5]), "y": np.array([0.1, 0.9])})
+        entries = h.bin_entries()
+        np.testing.assert_array_equal(entries, [1.0, 1.0])
+        entries *= 2.0
+        np.testing.assert_array_equal(h.bin_entries(), [1.0, 1.0])
+        assert h.n_dim == 2 and h.bins[0].bin_edges().flags.writeable
+
+        h.fill.numpy({"x": np.array([3.5]), "y": np.array([0.5])})
+        np.testing.assert_array_equal(h.bin_entries(), [1.0, 1.0, 0.0, 1.0])
+        np.testing.assert_array_equal(h.bin_centers(), [0.5, 1.5, 2.5, 3.5])
+        h += h
+        np.testing.assert_array_equal(h.bin_entries(), [2.0, 2.0, 0.0, 2.0])
+        np.testing.assert_array_equal(h.bins[0].bin_entries(), [2.0, 0.0, 0.0, 0.0])
+
+        empty = hg.SparselyBin.ed(1.0, 0.0, "Count", {}, hg.Count(), 0.0)
+        assert empty.n_dim == 1
+        empty += h
+        assert empty.n_dim == 2
+
+        # weights of both signs change the bins but not entries
+        b = hg.Bin(4, 0.0, 1.0, "x")
+        b.fill.numpy({"x": np.array([0.1])})
+        np.testing.assert_array_equal(b.bin_entries(), [1.0, 0.0, 0.0, 0.0])
+        b.fill.numpy({"x": np.array([0.3, 0.6])}, weights=np.array([1.0, -1.0]))
+        assert b.entries == 1.0
+        np.testing.assert_array_equal(b.bin_entries(), [1.0, 1.0, 0.0, 0.0])
+        b.fill(0.9)
+        np.testing.assert_array_equal(b.bin_entries(), [1.0, 1.0, 0.0, 1.0])
+
+        # direct changes of bins and binning, as downstream code makes them
+        b.values[2].entries = 5.0
+        b.entries += 5.0
+        np.testing.assert_array_equal(b.bin_entries(), [1.0, 1.0, 5.0, 1.0])
+        np.testing.assert_array_equal(b.bin_edges(), [0.0, 0.25, 0.5, 0.75, 1.0])
+        b.high = 2.0
+        np.testing.assert_array_equal(b.bin_edges(), [0.0, 0.5, 1.0, 1.5, 2.0])
+        np.testing.assert_array_equal(b.bin_centers(), [0.25, 0.75, 1.25, 1.75])
+        h.bins[7] = hg.Bin(4, 0.0, 1.0, "y")
+        h.bins[7].entries = 3.0
+        np.testing.assert_array_equal(h.bin_entries(), [2.0, 2.0, 0.0, 2.0, 0.0, 0.0, 0.0, 3.0])
+        np.testing.assert_array_equal(h.bin_edges()[[0, -1]], [0.0, 8.0])
+        c = hg.Categorize("c")
+        c.fill.numpy({"c": np.array(["a"])})
+        c.bins["b"] = hg.Count.ed(2.0)
+        np.testing.assert_array_equal(c.bin_entries(), [1.0, 2.0])
+        np.testing.assert_array_equal(c.bin_labels(), ["a", "b"])
+
+    def test_bag(self):
+        """ Test the vectorized Bag fill and Bag with a capacity"""
+        import numpy as np
+
+        vectors = np.random.randint(0, 5, (1000, 2)).astype(float)
+        vectors[:3] = [[np.nan, 0.0], [np.nan, -0.0], [1.0, np.nan]]
+        filled = hg.Bag(lambda x: x, "N2")
+        filled.fill.numpy(vectors)
+        expected = hg.Bag(lambda x: x, "N2")
+        for v in vectors:
+            expected.fill(v)
+        assert filled == expected
+        assert filled.values[("nan", 0.0)] == 2.0
+
+        strings = hg.Bag(lambda x: x, "S")
+        strings.fill.numpy(np.array(["one", "two", "one"]), weights=np.array([1.0, 0.0, 2.0]))
+        assert strings.values == {"one": 3.0} and strings.entries == 3.0
+        self.assertRaises(TypeError, lambda: strings.fill.numpy(np.array([1, 2])))
+
+        sample = hg.Bag("x", "N", capacity=10)
+        weights = np.where(np.arange(1000) < 5, 1e6, 1.0)
+        sample.fill.numpy({"x": np.arange(1000.0)}, weights=weights)
+        for x in np.arange(1000.0, 2000.0):
+            sample.fill({"x": x})
+        assert len(sample.values) == 10 and sample.entries == weights.sum() + 1000
+        assert all(sample.values[x] == 1e6 for x in range(5))
+        assert len((sample + sample).values) == 10 and (sample + sample).values[0.0] == 2e6
+
+        # the capacity and the reservoir keys are kept in JSON, and a sum is bounded by either operand
+        restored = Factory.fromJson(sample.toJson())
+        assert restored.capacity == 10 and restored._priorities == sample._priorities
+        assert restored.toJson() == sample.toJson()
+        unbounded = hg.Bag("x", "N")
+        unbounded.fill.numpy({"x": np.arange(100.0)})
+        assert unbounded != unbounded * 1.0 + hg.Bag("x", "N", capacity=200)
+        for total in (unbounded + sample, sample + unbounded):
+            assert total.capacity == 10 and len(total.values) == 10
+
+    def test_topk(self):
+        """ Test TopK against the row-by-row fill and its Space-Saving bounds"""
+        import collections
+        import numpy as np
+
+        rng = np.random.RandomState(12345)
+        categories = np.array(["c{0}".format(i) for i in rng.zipf(1.5, 5000) % 1000])
+        weights = rng.uniform(0.0, 2.0, len(categories))
+
+        filled = hg.TopK(20, "x", hg.Sum("w"))
+        filled.fill.numpy({"x": categories, "w": weights})
+        expected = hg.TopK(20, "x", hg.Sum("w"))
+        expected.fill.numpy({"x": categories[:2500], "w": weights[:2500]})
+        later = expected.zero()
+        later.fill.numpy({"x": categories[2500:], "w": weights[2500:]})
+        for h in filled, expected + later:
+            assert h.size == 20 and h.entries == 5000.0
+            assert h.other.entries + sum(v.entries for v in h.bins.values()) == 5000.0
+            assert abs(h.other.sum + sum(v.sum for v in h.bins.values()) - weights.sum()) < 1e-8
+
+        true = collections.Counter(categories.tolist())
+        onebyone = hg.TopK(20, "x")
+        for x in categories:
+            onebyone.fill({"x": x})
+        for h in filled, expected + later, onebyone:
+            for k, v in h.bins.items():
+                assert h.counts[k] - h.errors[k] == v.entries <= true[k] <= h.counts[k]
+            assert all(true[k] <= h.minCount for k in true if k not in h.bins)
+            assert true.most_common(1)[0][0] in h.bins
+
+        few = hg.TopK(5, "x")
+        few.fill.numpy({"x": np.array(["a", "b", "a"])})
+        assert few.counts == {"a": 2.0, "b": 1.0} and few.errors == {"a": 0.0, "b": 0.0}
+        assert Factory.fromJson(filled.toJson()).toJson() == filled.toJson()
+        assert filled * 2.0 == filled + filled
+
+    def test_count_distinct(self):
+        """ Test the HyperLogLog CountDistinct, alone and as a sub-aggregator"""
+        import pickle
+        import numpy as np
+
+        rng = np.random.RandomState(12345)
+        users = rng.randint(0, 20000, 100000)
+        filled = hg.CountDistinct("user")
+        filled.fill.numpy({"user": users})
+        exact = len(np.unique(users))
+        assert abs(filled.distinct - exact) < 0.05 * exact
+        assert filled.entries == 100000.0
+
+        # numbers, strings and bytes hash the same in the numpy and row-by-row fills, whatever the array type
+        for values in [users[:500], users[:500].astype(float), np.array(["u{0}".format(u) for u in users[:500]])]:
+            expected = hg.CountDistinct("user")
+            for x in values.tolist():
+                expected.fill({"user": x})
+            for array in values, values.astype(object):
+                h = hg.CountDistinct("user")
+                h.fill.numpy({"user": array})
+                assert h == expected
+        asbytes = hg.CountDistinct("user")
+        asbytes.fill.numpy({"user": np.array(["u{0}".format(u) for u in users[:500]]).astype("S")})
+        assert asbytes == expected
+
+        one, two = filled.zero(), filled.zero()
+        one.fill.numpy({"user": users[:60000]})
+        two.fill.numpy({"user": users[40000:]}, weights=np.where(users[40000:] % 2 == 0, 1.0, 0.0))
+        assert (one + two).distinct > one.distinct
+        assert two.entries == float((users[40000:] % 2 == 0).sum())
+        assert one + filled == filled.zero() + filled + one
+        assert filled * 2.0 == filled + filled
+
+        perbin = hg.SparselyBin(1000.0, "user", hg.CountDistinct("user"))
+        perbin.fill.numpy({"user": users})
+        assert abs(sum(v.distinct for v in perbin.bins.values()) - exact) < 0.05 * exact
+        assert Factory.fromJson(perbin.toJson()).toJson() == perbin.toJson()
+        assert pickle.loads(pickle.dumps(perbin)) == perbin
+
+    def test_profile(self):
+        """ Test the per-node statistics of fills in a profile"""
+        import numpy as np
+        from histogrammar.profiling import profile
+
+        rng = np.random.RandomState(12345)
+        data = {"x": rng.normal(0.0, 1.0, 10000), "c": np.array(["a", "b", "c"])[rng.randint(0, 3, 10000)]}
+        expected = hg.Categorize("c", hg.Bin(10, -3.0, 3.0, "x", hg.Sum("x")))
+        expected.fill.numpy(data)
+
+        filled = expected.zero()
+        fills = []
+        with profile(callback=fills.append) as prof:
+            filled.fill.numpy(data)
+            filled.fill({"x": 0.5, "c": "a"})
+        assert filled.entries == 10001.0
+        report = {r["path"]: r for r in prof.report()}
+        assert [r["path"] for r in prof.report()] == ["Categorize(c)", "Categorize(c)/Bin(x)",
+                                                      "Categorize(c)/Bin(x)/Count", "Categorize(c)/Bin(x)/Sum(x)"]
+        assert report["Categorize(c)"]["calls"] == 2
+        assert report["Categorize(c)"]["rows"] == report["Categorize(c)"]["rowsToChildren"] == 10001
+        assert report["Categorize(c)/Bin(x)"]["rows"] == 10001
+        binned = report["Categorize(c)/Bin(x)/Sum(x)"]["rows"] + report["Categorize(c)/Bin(x)/Count"]["rows"]
+        assert report["Categorize(c)/Bin(x)"]["rowsToChildren"] == binned == 10001
+        for r in report.values():
+            assert 0.0 <= r["quantityTime"] <= r["selfTime"] <= r["time"]
+            assert r["bytesAllocated"] is None
+        assert len(fills) == 2 and fills[1][0]["rows"] == 1
+
+        # only the fills in the block are profiled, and they fill as usual
+        again = expected.zero()
+        again.fill.numpy(data)
+        assert again == expected
+        assert prof.report()[0]["calls"] == 2
+        assert len(prof.table().split("\n")) == 5
+
+        # fills in other threads are not recorded
+        import threading
+        other = expected.zero()
+        with profile() as prof:
+            thread = threading.Thread(target=lambda: other.fill.numpy(data))
+            thread.start()
+            thread.join()
+            filled.fill({"x": 0.5, "c": "a"})
+        assert other == expected
+        assert [(r["path"], r["rows"]) for r in prof.report()] == [
+            ("Categorize(c)", 1), ("Categorize(c)/Bin(x)", 1), ("Categorize(c)/Bin(x)/Sum(x)", 1)]
+
+    def test_estimate(self):
+        """ Test the estimated cost of filling a tree against the tree that is filled"""
+        import numpy as np
+
+        rng = np.random.RandomState(12345)
+        data = {"x": rng.uniform(0.0, 10.0, 10000), "c": np.array(["a", "b", "c", "d"])[rng.randint(0, 4, 10000)]}
+        h = hg.Categorize("c", hg.Bin(10, 0.0, 10.0, "x", hg.Sum("x")))
+        estimate = h.estimate(10000, {"c": 4})
+        assert [node["path"] for node in estimate.nodes] == [
+            "Categorize(c)", "Categorize(c)/Bin(x)", "Categorize(c)/Bin(x)/Count", "Categorize(c)/Bin(x)/Sum(x)"]
+        nodes = dict((node["path"], node) for node in estimate.nodes)
+        assert nodes["Categorize(c)"]["strategy"] == "partition into 4 categories"
+        assert nodes["Categorize(c)/Bin(x)"]["calls"] == 4 and nodes["Categorize(c)/Bin(x)"]["rows"] == 10000
+        assert nodes["Categorize(c)/Bin(x)/Sum(x)"]["calls"] == 40
+        assert nodes["Categorize(c)/Bin(x)/Count"]["strategy"] == "empty"
+        assert estimate.warnings == [] and estimate.seconds > 0.0 and estimate.workBytes > 0
+
+        def containers(x):
+            return 1 + sum(containers(y) for y in x._filledChildren)
+
+        h.fill.numpy(data)
+        assert estimate.containers == containers(h)
+
+        # the fast path of Counts, and warnings when the per-bin fills get too small
+        assert "numpy.bincount" in hg.Bin(10, 0.0, 1.0, "x").explain(1000)
+        estimate = hg.SparselyBin(1.0, "x", hg.Categorize("c", hg.Sum("y"))).estimate(10**7, {"x": 10**4})
+        assert "assumed" in estimate.nodes[1]["strategy"]
+        assert len(estimate.warnings) == 3 and estimate.containers > 10**6
+
+    def test_nbytes(self):
+        """ Test the memory of container trees and memory budgets"""
+        import numpy as np
+        from histogrammar.defs import MemoryBudget, MemoryBudgetExceeded
+        from histogrammar.util import _deepSizeOf
+
+        rng = np.random.RandomState(12345)
+        data = {"x": rng.normal(0.0, 1.0, 10000), "c": np.array(["c{0}".format(i) for i in range(100)])[
+            rng.randint(0, 100, 10000)]}
+        h = hg.Categorize("c", hg.SparselyBin(0.1, "x"))
+        empty = h.nbytes
+        h.fill.numpy(data)
+        # at least the keys and a Count per bin
+        bins = sum(len(v.bins) for v in h.bins.values())
+        assert h.nbytes > empty + bins * sys.getsizeof(Count()) + sum(sys.getsizeof(k) for k in h.bins)
+        # shared objects (like the quantity functions) are counted in each container that refers to them
+        seen = set()
+        assert sum(v.nbytes for v in h.bins.values()) > h.nbytes > sum(_deepSizeOf(v, seen) for v in h.bins.values())
+        assert hg.Count().nbytes < hg.Bin(10, 0.0, 1.0, "x").nbytes < hg.Bin(100, 0.0, 1.0, "x").nbytes
+        # the bytes of numpy arrays count
+        assert hg.CountDistinct("x", precision=16).nbytes > 2**16
+
+        assert MemoryBudget(10 * h.nbytes).check(h, "h") == h.nbytes
+        try:
+            MemoryBudget(empty).check(h, "h")
+        except MemoryBudgetExceeded as err:
+            assert err.nbytes == h.nbytes and err.limit == empty and str(err).startswith("h uses ")
+        else:
+            raise AssertionError("MemoryBudgetExceeded not raised")
+
+        # a compaction that keeps the tree within the budget
+        def compact(container):
+            for k in sorted(container.bins)[10:]:
+                del container.bins[k]
+        limit = h.nbytes // 2
+        assert MemoryBudget(limit, compact).check(h) == h.nbytes <= limit
+        assert len(h.bins) == 10
+
+    def test_fillsql(self):
+        """ Test filling by a GROUP BY query against fillnumpy"""
+        import sqlite3
+        import numpy as np
+
+        rng = np.random.RandomState(12345)
+        data = {"x": rng.normal(0.0, 1.0, 1000), "y": rng.uniform(0.0, 10.0, 1000),
+                "w": rng.uniform(-0.5, 2.0, 1000), "c": np.array(["a", "b", "c"])[rng.randint(0, 3, 1000)]}
+        data["x"][:10] = np.nan
+        connection = sqlite3.connect(":memory:")
+        connection.execute("CREATE TABLE t (x REAL, y REAL, w REAL, c TEXT)")
+        connection.executemany("INSERT INTO t VALUES (?, ?, ?, ?)", zip(
+            [None if np.isnan(x) else x for x in data["x"].tolist()], data["y"].tolist(), data["w"].tolist(),
+            data["c"].tolist()))
+
+        def check(make, weights=None):
+            expected, filled = make(), make()
+            if weights is None:
+                expected.fill.numpy(data)
+            else:
+                expected.fill.numpy(data, np.maximum(data[weights], 0.0))
+            filled.fill.sql(connection, "t", weights)
+            assert filled == expected
+
+        for weights in (None, "w"):
+            check(lambda: hg.Bin(20, -2.0, 2.0, "x", hg.Sum("y")), weights)
+            check(lambda: hg.SparselyBin(0.5, "x", hg.Deviate("y")), weights)
+            check(lambda: hg.Categorize("c", hg.Bin(10, 0.0, 10.0, "y", hg.Average("y"))), weights)
+            check(lambda: hg.Select("y > 5", hg.Categorize("c", hg.Minimize("y"))), weights)
+            check(lambda: hg.SparselyBin(2.0, "y", hg.Maximize("y")), weights)
+            # a fractional cut multiplies the weight
+            check(lambda: hg.Select("y - 2", hg.Bin(10, 0.0, 10.0, "y", hg.Sum("y"))), weights)
+
+        # a WHERE clause, and primitives that have no SQL counterpart
+        filled = hg.Bin(10, 0.0, 10.0, "y")
+        filled.fillsql(connection, "t", where="c = 'a'")
+        assert filled.entries == float(np.sum(data["c"] == "a"))
+        self.assertRaises(NotImplementedError, lambda: hg.Bag("c", "S").fillsql(connection, "t"))
+        self.assertRaises(TypeError, lambda: hg.Sum(lambda d: d.y).fillsql(connection, "t"))
+
+        # in ANSI SQL, the cut is a condition
+        from histogrammar.sql import compileQuery
+        query, _ = compileQuery(hg.Select("y > 5", hg.Count()))
+        assert "CASE WHEN (y > 5) THEN 1 ELSE 0 END" in query.select("t")
+
+    def test_max_bins(self):
+        """ Test that SparselyBin coarsens its bins to stay within maxBins"""
+        import numpy as np
+
+        rng = np.random.RandomState(12345)
+        data = {"x": rng.standard_cauchy(10000), "y": rng.normal(0.0, 1.0, 10000)}
+        data["x"][:3] = [np.inf, -np.inf, np.nan]
+
+        bounded = hg.SparselyBin(0.1, "x", hg.Sum("y"), origin=0.05, maxBins=50)
+        bounded.fill.numpy(data)
+        assert len(bounded.bins) <= 50 and bounded.entries == 10000.0 and bounded.nanflow.entries == 1.0
+        factor = int(round(bounded.binWidth / 0.1))
+        assert factor > 1 and factor & (factor - 1) == 0
+
+        # the same as filling at the final binWidth (up to the order of summation)
+        expected = hg.SparselyBin(bounded.binWidth, "x", hg.Sum("y"), origin=0.05)
+        expected.fill.numpy(data)
+        assert bounded == expected
+
+        # coarsened histograms can be added to finer ones with the same origin, and the result obeys maxBins
+        fine = hg.SparselyBin(0.1, "x", hg.Sum("y"), origin=0.05)
+        fine.fill.numpy(data)
+        before = fine.toJson()
+        for total in (fine + bounded, bounded + fine):
+            assert total.binWidth == bounded.binWidth and total.entries == 20000.0 and total == expected * 2.0
+        total = fine.copy()
+        assert not any(total.bins[i] is v for i, v in fine.bins.items())
+        total += bounded
+        assert total == expected * 2.0 and fine.toJson() == before
+        self.assertRaises(ContainerException, lambda: fine + hg.SparselyBin(0.25, "x", hg.Sum("y"), origin=0.05))
+        self.assertRaises(ContainerException, lambda: fine + hg.SparselyBin(0.2, "x", hg.Sum("y")))
+
+        # row by row, and nested in a Categorize whose bins coarsen separately
+        scalar = hg.SparselyBin(0.1, "x", origin=0.05, maxBins=50)
+        for x in data["x"][:1000]:
+            scalar.fill({"x": x})
+        assert len(scalar.bins) <= 50 and scalar.entries == 1000.0
+        nested = hg.Categorize("c", hg.SparselyBin(0.1, "x", maxBins=20))
+        nested.fill.numpy({"x": data["x"], "c": np.where(data["y"] > 1.0, "a", "b")})
+        merged = nested.bins["a"] + nested.bins["b"]
+        assert len(merged.bins) <= 20 and merged.entries == 10000.0
+
+        # maxBins is kept in JSON
+        restored = Factory.fromJson(bounded.toJson())
+        assert restored.maxBins == 50 and restored.toJson() == bounded.toJson()
+        assert len((restored + fine).bins) <= 50
+
+        # an explicit coarsen() changes the bin arrays
+        h = hg.SparselyBin(1.0, "x")
+        h.fill.numpy({"x": np.arange(100) + 0.5})
+        assert len(h.bin_edges()) == 101
+        h.coarsen(2)
+        np.testing.assert_array_equal(h.bin_edges(), np.arange(0.0, 101.0, 2.0))
+        np.testing.assert_array_equal(h.bin_entries(), np.full(50, 2.0))
+
+    def test_window(self):
+        """ Test that a windowed SparselyBin keeps only its most recent bins"""
+        import numpy as np
+
+        rng = np.random.RandomState(12345)
+        t = rng.uniform(0.0, 100.0, 10000)
+        spilled = SparselyBin(1.0, "t")
+
+        def spill(index, container):
+            spilled.bins[index] = spilled.bins[index] + container if index in spilled.bins else container
+            spilled.entries += container.entries
+
+        # batches that go forward in time, with some late rows
+        windowed = SparselyBin(1.0, "t", window=10, spill=spill)
+        for batch in np.array_split(np.sort(t), 20):
+            windowed.fill.numpy({"t": np.concatenate([batch, rng.uniform(0.0, batch[0], 5)])})
+        assert sorted(windowed.bins) == list(range(90, 100))
+        total = SparselyBin(1.0, "t")
+        total.bins, total.entries = dict(spilled.bins), spilled.entries
+        total += windowed
+        # nothing is lost: the evicted and the kept bins add up to all rows
+        assert total.entries == sum(v.entries for v in total.bins.values()) == 10000.0 + 5 * 20
+        assert windowed.entries == sum(v.entries for v in windowed.bins.values())
+
+        # row by row, and a copy does not evict anything
+        rowwise = SparselyBin(1.0, "t", window=3)
+        for x in [0.5, 1.5, 2.5, 3.5, 1.2, 5.1]:
+            rowwise.fill({"t": x})
+        assert sorted(rowwise.bins) == [3, 5] and rowwise.entries == 2.0
+        assert rowwise.copy() == rowwise
+
+        # the window is kept in JSON, with its top at the highest bin
+        restored = Factory.fromJson(rowwise.toJson())
+        assert restored.window == 3 and restored._highest == 5
+        # late data below the window are evicted right away
+        restored += SparselyBin.ed(1.0, 2.0, "Count", {2: Count.ed(1.0), 4: Count.ed(1.0)}, Count.ed(0.0), 0.0)
+        assert sorted(restored.bins) == [3, 4, 5] and restored.entries == 3.0
+
+        # in steady streaming entries stays the same, but the bin arrays follow the window
+        steady = SparselyBin(1.0, "t", window=3)
+        steady.fill.numpy({"t": np.array([0.5, 1.5, 2.5])})
+        np.testing.assert_array_equal(steady.bin_centers(), [0.5, 1.5, 2.5])
+        steady.fill.numpy({"t": np.array([3.5])})
+        assert steady.entries == 3.0
+        np.testing.assert_array_equal(steady.bin_centers(), [1.5, 2.5, 3.5])
+        np.testing.assert_array_equal(steady.bin_edges(), [1.0, 2.0, 3.0, 4.0])
+
+        # spill is called one at a time from the threads of a threaded fill
+        import time
+        active, calls = [0], []
+
+        def slowSpill(index, container):
+            active[0] += 1
+            calls.append(active[0])
+            time.sleep(0.001)
+            active[0] -= 1
+        threaded = SparselyBin(1.0, "t", window=2, spill=slowSpill)
+        threaded.numpyChunkRows = 500
+        threaded.fill.numpy({"t": np.sort(t)}, n_threads=4)
+        assert len(calls) > 0 and max(calls) == 1
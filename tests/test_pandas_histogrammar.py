@@ -1,5 +1,7 @@
 #!/usr/bin/env python3
 
+import os
+
 import numpy as np
 import pandas as pd
 import pytest
@@ -161,6 +163,30 @@ def test_make_histograms_with_time_axis():
     assert bin_specs["origin"] == 9.5
 
 
+def test_fill_plan_shares_first_axis(monkeypatch):
+    from histogrammar.primitives.sparselybin import SparselyBin
+
+    features = ["date", "date:age", "date:latitude", "age"]
+    pandas_filler = PandasHistogrammar(features=features)
+    assert pandas_filler.get_fill_plan() == [
+        ("date", [["date"], ["date", "age"], ["date", "latitude"]]),
+        ("age", [["age"]]),
+    ]
+
+    # the date axis is binned once for all three date histograms, the age axis once on all rows
+    calls = []
+    npBinIndices = SparselyBin._npBinIndices
+    monkeypatch.setattr(SparselyBin, "_npBinIndices", lambda self, data, memo: calls.append(len(data)) or
+                        npBinIndices(self, data, memo))
+    hists = pandas_filler.get_histograms(pytest.test_df)
+    assert calls.count(len(pytest.test_df)) == 2
+
+    monkeypatch.undo()
+    for f in features:
+        single = PandasHistogrammar(features=[f]).get_histograms(pytest.test_df)[f]
+        assert hists[f].toJson() == single.toJson()
+
+
 def test_make_histograms_unit_binning():
 
     hists, features, bin_specs, time_axis, var_dtype = make_histograms(
@@ -281,3 +307,183 @@ def test_null_histograms():
     h = hists['mixed']
     assert 'nan' in h.bins
     assert h.bins['nan'].entries == 1
+
+
+def test_make_histograms_topk():
+    rng = np.random.RandomState(42)
+    df = pd.DataFrame({"id": ["id{0}".format(i) for i in rng.zipf(1.5, 1000) % 200],
+                       "x": rng.normal(size=1000)})
+
+    hists = make_histograms(df, max_nunique=10)
+
+    # the high-cardinality column is not skipped, but only keeps its most frequent categories
+    h = hists["id"]
+    assert h.name == "TopK"
+    assert h.capacity == 10 and h.size == 10
+    assert h.entries == 1000
+    assert h.other.entries + sum(v.entries for v in h.bins.values()) == 1000
+    assert get_bin_specs(hists)["id"] == {"capacity": 10}
+
+
+def test_make_histograms_sinks():
+    from histogrammar.dfinterface.sinks import CallbackSink, Sink
+
+    class Recorder(Sink):
+        def start(self, total, description=""):
+            self.total = total
+
+        def close(self):
+            self.closed = True
+
+    updates = []
+    recorder = Recorder()
+    features = ["age", "eyeColor", "age:eyeColor"]
+    hists = make_histograms(pytest.test_df, features=features, sinks=[recorder, CallbackSink(
+        lambda name, metrics: updates.append((name, metrics)))], profile=True)
+
+    assert recorder.total == 3 and recorder.closed
+    assert sorted(name for name, _ in updates) == sorted(hists) == sorted(features)
+    for name, metrics in updates:
+        assert metrics["rows"] == len(pytest.test_df)
+        assert metrics["time"] >= 0.0
+        assert metrics["nodes"][0]["rows"] == len(pytest.test_df)
+        assert len(metrics["nodes"]) == name.count(":") + 2
+
+
+def test_estimate():
+    features = ["age", "eyeColor", "age:eyeColor"]
+    filler = PandasHistogrammar(features=features, bin_specs={"age": {"binWidth": 10, "origin": 0}})
+    estimates = filler.estimate(pytest.test_df)
+    assert sorted(estimates) == sorted(features)
+
+    hists = filler.get_histograms(pytest.test_df)
+    for name, estimate in estimates.items():
+        assert estimate.rows == len(pytest.test_df)
+        assert estimate.nodes[0]["rows"] == len(pytest.test_df)
+        assert "assumed" not in estimate.nodes[0]["strategy"]
+    # the number of bins is estimated from the range and unique values of each column
+    assert estimates["age"].nodes[0]["strategy"].endswith(" {0} bins".format(hists["age"].size))
+    assert estimates["eyeColor"].nodes[0]["strategy"].endswith(" {0} categories".format(hists["eyeColor"].size))
+    assert "Histogram \"age:eyeColor\"" in filler.explain(pytest.test_df)
+
+
+def test_memory_budget():
+    from histogrammar.defs import MemoryBudgetExceeded
+    from histogrammar.dfinterface.make_histograms import get_nbytes
+    from histogrammar.dfinterface.sinks import CallbackSink
+
+    features = ["age", "eyeColor", "age:eyeColor"]
+    updates = {}
+    hists = make_histograms(pytest.test_df, features=features, memory_budget={"age:eyeColor": 10**7},
+                            sinks=[CallbackSink(updates.__setitem__)])
+    nbytes = get_nbytes(hists)
+    assert sorted(nbytes) == sorted(features)
+    assert all(0 < nbytes[name] <= hists[name].nbytes for name in features)
+    assert updates["age:eyeColor"]["nbytes"] == hists["age:eyeColor"].nbytes
+    assert "nbytes" not in updates["age"]
+
+    with pytest.raises(MemoryBudgetExceeded):
+        make_histograms(pytest.test_df, features=features, memory_budget=nbytes["age"] // 2)
+
+
+def test_make_histograms_max_bins():
+    bin_specs = {"age": {"binWidth": 1.0, "origin": 0.0, "max_bins": 10}}
+    hists = make_histograms(pytest.test_df, features=["age"], bin_specs=bin_specs)
+    h = hists["age"]
+    assert h.maxBins == 10 and len(h.bins) <= 10 and h.binWidth > 1.0
+    assert h.entries == len(pytest.test_df)
+
+
+def test_make_histograms_time_window():
+    spilled = []
+    hists = make_histograms(pytest.test_df, features=["date:age"], time_axis="date", time_width="30d",
+                            time_window="90d", time_spill=lambda feature, index, h: spilled.append((feature, index)))
+    h = hists["date:age"]
+    assert h.window == 3 and len(h.bins) <= 3
+    assert sorted(h.bins)[-1] - sorted(h.bins)[0] < 3
+    assert all(feature == "date:age" for feature, _ in spilled)
+    assert len(set(i for _, i in spilled) | set(h.bins)) > 3
+
+
+def test_make_histograms_previous(monkeypatch):
+    features = ["date:age", "age", "eyeColor", "isActive", "latitude:longitude"]
+    df = pytest.test_df
+    old, new = df.iloc[: len(df) // 2], df.iloc[len(df) // 2:]
+    hists = make_histograms(old, features=features, time_axis="date")
+
+    # the binning of the previous histograms is reused, without quantiles or unique counts
+    def fail(*args, **kwargs):
+        raise AssertionError("binning is re-derived")
+
+    monkeypatch.setattr(PandasHistogrammar, "get_quantiles", fail)
+    monkeypatch.setattr(PandasHistogrammar, "get_nunique", fail)
+    updated = make_histograms(new, previous=hists)
+    monkeypatch.undo()
+
+    assert sorted(updated) == sorted(features)
+    # the same as filling everything at once in that binning
+    everything = make_histograms(df, features=features, bin_specs=get_bin_specs(hists), binning="unit")
+    for name in features:
+        assert updated[name].entries == len(df)
+        assert updated[name] == everything[name]
+
+    # features that are not in previous are binned as in a run without previous
+    mixed = make_histograms(new, features=["age", "latitude"], previous={"age": hists["age"]})
+    fresh = make_histograms(new, features=["latitude"])
+    assert mixed["age"] == updated["age"]
+    assert mixed["latitude"].binWidth == fresh["latitude"].binWidth != 1.0
+    assert mixed["latitude"] == fresh["latitude"]
+
+
+def test_make_histograms_cache(tmp_path):
+    from histogrammar.dfinterface.cache import HistogramCache
+
+    cache = HistogramCache(str(tmp_path))
+    features = ["date:age", "eyeColor"]
+    hists = make_histograms(pytest.test_df, features=features, time_axis="date", cache=cache)
+    assert cache.stats()["misses"] == 1 and cache.stats()["entries"] == 1
+
+    cached = make_histograms(pytest.test_df, features=features, time_axis="date", cache=cache)
+    assert cache.hits == 1
+    assert sorted(cached) == sorted(hists)
+    uncached = make_histograms(pytest.test_df, features=features, time_axis="date")
+    for name in features:
+        # a miss returns the histograms as they were filled, a hit the same histograms read back from JSON
+        assert cached[name].toJson() == hists[name].toJson() == uncached[name].toJson()
+        assert callable(hists[name].quantity.expr) and cached[name].quantity.expr is None
+
+    # other data, arguments or version are other entries
+    make_histograms(pytest.test_df.iloc[1:], features=features, time_axis="date", cache=cache)
+    make_histograms(pytest.test_df, features=features, time_axis="date", time_width="7d", cache=cache)
+    make_histograms(pytest.test_df, features=features, time_axis="date", cache=cache, cache_key="2021-01-01")
+    assert cache.hits == 1 and cache.misses == 4 and cache.stats()["entries"] == 4
+
+    # the least recently used entries go first
+    size = max(os.path.getsize(os.path.join(str(tmp_path), name)) for name in os.listdir(str(tmp_path)))
+    cache.max_bytes = 2 * size
+    cache.evict()
+    assert cache.evictions == 2 and cache.stats()["entries"] == 2
+    make_histograms(pytest.test_df, features=features, time_axis="date", cache=cache, cache_key="2021-01-01")
+    assert cache.hits == 2
+
+    # functions are not part of a key: with a time_spill the cache is not used, and every spill is made
+    spilled = []
+    stats = cache.stats()
+    for _ in range(2):
+        make_histograms(pytest.test_df, features=features, time_axis="date", cache=cache, time_window=5,
+                        time_spill=lambda feature, index, hist: spilled.append(index))
+    assert cache.stats() == stats and len(spilled) > 0 and len(spilled) % 2 == 0
+
+    # numpy scalars and arrays are keyed by value, other values that are not JSON by their type and repr
+    from histogrammar.dfinterface.cache import cacheable
+    key = cache.key
+    assert key(pytest.test_df, {"n": np.int64(3)}) == key(pytest.test_df, {"n": 3})
+    assert key(pytest.test_df, {"x": np.arange(3)}) != key(pytest.test_df, {"x": np.arange(1, 4)})
+    assert key(pytest.test_df, {"t": pd.Timestamp("2021-01-01")}) != key(pytest.test_df,
+                                                                     {"t": pd.Timestamp("2021-02-01")})
+    assert key(pytest.test_df, {"w": pd.Timedelta("1d")}) == key(pytest.test_df, {"w": pd.Timedelta("24h")})
+    assert key(pytest.test_df, {"w": pd.Timedelta("1d")}) != key(pytest.test_df, {"w": pd.Timedelta("2d")})
+    assert key(pytest.test_df, {"t": np.datetime64("2021-01-01")}) != key(pytest.test_df, {"t": 18628})
+    assert cacheable({"t": pd.Timestamp("2021-01-01")}) and not cacheable({"x": object()})
+    with pytest.raises(TypeError):
+        key(pytest.test_df, {"x": object()})
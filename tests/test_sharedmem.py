@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+
+# Copyright 2016 DIANA-HEP
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import multiprocessing
+import pickle
+import sys
+import unittest
+
+import numpy
+
+from histogrammar.defs import ContainerException
+from histogrammar.primitives.average import Average
+from histogrammar.primitives.bin import Bin
+from histogrammar.primitives.categorize import Categorize
+from histogrammar.primitives.sparselybin import SparselyBin
+from histogrammar.sharedmem import SharedHistogram
+
+
+def fillWorker(shared, worker, data):
+    shared.fill(worker, data)
+    shared.close()
+
+
+@unittest.skipIf(sys.version_info < (3, 8), "multiprocessing.shared_memory needs Python 3.8")
+class TestSharedMemory(unittest.TestCase):
+    x = numpy.random.normal(0, 1, 10000)
+    x[::100] = numpy.nan
+    c = numpy.random.choice(["a", "b", "c"], 10000)
+
+    def compare(self, template, keys, data):
+        expected = template.copy()
+        expected.fill.numpy(data)
+        with SharedHistogram(template, 2, keys) as shared:
+            shared.fill(0, dict((k, v[:6000]) for k, v in data.items()))
+            worker = pickle.loads(pickle.dumps(shared))
+            worker.fill(1, dict((k, v[6000:]) for k, v in data.items()))
+            worker.close()
+            self.assertEqual(shared.toContainer(), expected)
+
+    def testBin(self):
+        self.compare(Bin(10, -2.0, 2.0, "x"), None, {"x": self.x})
+        # rounding puts the value just below high at index num, which is still the last bin
+        edges = numpy.array([-3.0, numpy.nextafter(3.0, -numpy.inf), 3.0] * 1000)
+        self.compare(Bin(10, -3.0, 3.0, "x"), None, {"x": edges})
+
+    def testSparselyBin(self):
+        self.compare(SparselyBin(0.5, "x"), (-20, 20), {"x": self.x})
+        with SharedHistogram(SparselyBin(0.5, "x"), 1, (0, 1)) as shared:
+            self.assertRaises(ValueError, lambda: shared.fill(0, {"x": self.x}))
+
+    def testCategorize(self):
+        self.compare(Categorize("c"), ["a", "b", "c", "d"], {"c": self.c})
+        with SharedHistogram(Categorize("c"), 1, ["a"]) as shared:
+            self.assertRaises(ValueError, lambda: shared.fill(0, {"c": self.c}))
+
+    def testErrors(self):
+        self.assertRaises(ContainerException, lambda: SharedHistogram(Bin(10, -2.0, 2.0, "x", Average("x")), 2))
+        self.assertRaises(ValueError, lambda: SharedHistogram(SparselyBin(0.5, "x"), 2))
+
+    def testProcesses(self):
+        expected = Bin(10, -2.0, 2.0, "x")
+        expected.fill.numpy({"x": self.x})
+        with SharedHistogram(Bin(10, -2.0, 2.0, "x"), 4) as shared:
+            pool = multiprocessing.Pool(4)
+            try:
+                pool.starmap(fillWorker, [(shared, i, {"x": x}) for i, x in enumerate(numpy.array_split(self.x, 4))])
+            finally:
+                pool.close()
+                pool.join()
+            self.assertEqual(shared.toContainer(), expected)